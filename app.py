@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import hmac
+import logging
 import os
 import sys
+import threading
+import time
 
 if sys.platform == "win32":
     os.environ["PYTHONUTF8"] = "1"
@@ -11,21 +15,131 @@ try:
 except ImportError:
     pass
 
+import click
 from flask import Flask, session, redirect, url_for, request, g
-from werkzeug.security import check_password_hash, generate_password_hash
 
-from config import SECRET_KEY
-from auth_util import get_db, current_user
+from config import (
+    SECRET_KEY, METRICS_TOKEN, IDEMPOTENCY_PURGE_INTERVAL, STOCK_SWEEP_INTERVAL, SHIFT_EXPIRY_SWEEP_INTERVAL,
+    OPERATION_PARTITIONS_INTERVAL, USER_CACHE_CHANNEL, PRICE_CACHE_CHANNEL, SHIFT_EVENTS_CHANNEL, REPORT_CACHE_CHANNEL,
+)
+from auth_util import get_db, get_pool, current_user, start_user_cache
+import idempotency
+import jobs
+import operation_partitions
+import price_cache
+import report_cache
+import sales_rollup
+import shift_events
+import query_stats
+import stock_events
+from passwords import verify_password, hash_password, PasswordPoolBusy
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = SECRET_KEY
+query_stats.init_app(app)
 
 
 @app.teardown_appcontext
 def close_db(e):
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    # Не удаляем g.db: потоковый ответ (stream_with_context) заново открывает
+    # контекст и может снова взять соединение, которое вернётся при повторном
+    # завершении контекста.
+    for key in ("db", "db_ro"):
+        db = g.get(key)
+        if db is not None:
+            db.close()
+
+
+REQUIRED_TABLES = (
+    "categories", "stores", "warehouses", "products", "employees", "shifts",
+    "operations", "operation_items", "store_product_stock", "warehouse_product_stock", "notifications",
+    "idempotency_keys", "shift_reports", "sales_daily_store", "sales_daily_product",
+)
+REQUIRED_COLUMNS = (
+    ("operations", "original_operation_id"), ("operation_items", "returned_quantity"), ("operation_items", "created_at"),
+)
+# Триггеры, уведомления которых слушают процессы, и их каналы: канал передаётся
+# триггеру аргументом в init_db.sql и должен совпадать с константой из config.py
+NOTIFY_TRIGGERS = (
+    ("trg_employees_notify_cache", USER_CACHE_CHANNEL), ("trg_stores_notify_employees", USER_CACHE_CHANNEL),
+    ("trg_products_notify_prices", PRICE_CACHE_CHANNEL), ("trg_shifts_notify", SHIFT_EVENTS_CHANNEL),
+    ("trg_sales_daily_store_notify", REPORT_CACHE_CHANNEL), ("trg_sales_daily_store_reset", REPORT_CACHE_CHANNEL),
+    ("trg_stores_notify_reports", REPORT_CACHE_CHANNEL), ("trg_employees_notify_reports", REPORT_CACHE_CHANNEL),
+    ("trg_products_notify_reports", REPORT_CACHE_CHANNEL),
+)
+
+_bootstrap_lock = threading.Lock()
+_bootstrap_state = {"done": False, "ms": None, "error": None, "warnings": []}
+
+jobs.every("idempotency_purge", IDEMPOTENCY_PURGE_INTERVAL, idempotency.purge_expired)
+jobs.every("low_stock_sweep", STOCK_SWEEP_INTERVAL, stock_events.sweep)
+jobs.every("shift_expiry", SHIFT_EXPIRY_SWEEP_INTERVAL, shift_events.close_expired)
+jobs.every("operation_partitions", OPERATION_PARTITIONS_INTERVAL, operation_partitions.ensure)
+
+
+def check_schema():
+    """Возвращает список предупреждений о недостающих таблицах и колонках."""
+    db = get_db()
+    tables = {r[0] for r in db.execute(
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()"
+    ) or []}
+    warnings = ["нет таблицы %s" % t for t in REQUIRED_TABLES if t not in tables]
+    columns = {(r[0], r[1]) for r in db.execute(
+        "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()"
+    ) or []}
+    warnings += ["нет колонки %s.%s" % tc for tc in REQUIRED_COLUMNS if tc[0] in tables and tc not in columns]
+    triggers = {r[0]: r[1] for r in db.execute(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE NOT tgisinternal"
+    ) or []}
+    for name, channel in NOTIFY_TRIGGERS:
+        if name not in triggers:
+            warnings.append("нет триггера %s" % name)
+        elif "('%s')" % channel not in triggers[name]:
+            warnings.append("триггер %s шлёт уведомления не в канал %s" % (name, channel))
+    if "operations" in tables and not operation_partitions.is_partitioned(db):
+        warnings.append("таблица operations не разбита на секции (python operation_partitions.py)")
+    return warnings
+
+
+def bootstrap():
+    """Однократная подготовка процесса: пул соединений, проверка схемы, учётная запись admin,
+    запуск фоновых задач (jobs.py), обработчика событий остатков (stock_events.py),
+    слушателя изменений цен для кэша (price_cache.py), слушателя изменений
+    сводки для кэша отчётов (report_cache.py), слушателя изменений сотрудников
+    (auth_util.user_cache) и слушателя событий смен (shift_events.py).
+
+    Вызывается при запуске (python app.py, asgi.py, flask bootstrap), а если
+    процесс запущен иначе — перед первым запросом. Повторные вызовы после
+    успешного выполнения ничего не делают. Нужен контекст приложения.
+    """
+    if _bootstrap_state["done"]:
+        return _bootstrap_state
+    with _bootstrap_lock:
+        if _bootstrap_state["done"]:
+            return _bootstrap_state
+        started = time.perf_counter()
+        try:
+            get_pool()
+            warnings = check_schema()
+            for w in warnings:
+                logger.warning("schema check: %s (выполните init_db.sql)", w)
+            init_admin_user()
+            jobs.start()
+            stock_events.start()
+            start_user_cache()
+            price_cache.start()
+            report_cache.start()
+            shift_events.start()
+        except Exception as e:
+            _bootstrap_state["error"] = str(e)
+            logger.warning("bootstrap failed, will retry on next request: %s", e)
+            return _bootstrap_state
+        ms = (time.perf_counter() - started) * 1000
+        _bootstrap_state.update(done=True, ms=round(ms, 1), error=None, warnings=warnings)
+        logger.info("bootstrap done in %.1f ms", ms)
+    return _bootstrap_state
 
 
 def init_admin_user():
@@ -33,7 +147,7 @@ def init_admin_user():
     row = db.execute_one("SELECT id_employee FROM employees WHERE login = %s", ("admin",))
     if row:
         return
-    pw_hash = generate_password_hash("admin123", method="pbkdf2:sha256")
+    pw_hash = hash_password("admin123")
     db.execute(
         """INSERT INTO employees (login, password_hash, full_name, role, is_active)
            VALUES (%s, %s, %s, %s, TRUE)""",
@@ -68,9 +182,19 @@ def login():
            WHERE login = %s AND is_active = TRUE""",
         (login_name,),
     )
-    if not row or not check_password_hash(row[1], password):
+    if not row:
+        return __render_login_page(error="Неверный логин или пароль")
+    # Пока хеш проверяется в пуле процессов, соединение с БД возвращается в пул
+    db.close()
+    try:
+        ok, new_hash = verify_password(row[1], password)
+    except PasswordPoolBusy:
+        return __render_login_page(error="Сервер занят, повторите вход через несколько секунд"), 503, {"Retry-After": "2"}
+    if not ok:
         return __render_login_page(error="Неверный логин или пароль")
     user_id, _ph, role, store_id = row
+    if new_hash:
+        db.execute("UPDATE employees SET password_hash = %s WHERE id_employee = %s", (new_hash, user_id), fetch=False)
     session.clear()
     session["user_id"] = user_id
     session["role"] = role
@@ -79,6 +203,7 @@ def login():
     if role == "admin":
         return redirect(url_for("admin_routes.admin_main"))
     db = get_db()
+    shift_events.expire_shifts(db, user_id)
     existing = db.execute_one(
         "SELECT id_shift FROM shifts WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL",
         (user_id, store_id),
@@ -112,6 +237,7 @@ def logout():
     session.clear()
     if role == "seller" and user_id and store_id:
         db = get_db()
+        expired = shift_events.expire_shifts(db, user_id)
         row = db.execute_one(
             "SELECT id_shift FROM shifts WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL ORDER BY shift_start DESC LIMIT 1",
             (user_id, store_id),
@@ -123,6 +249,8 @@ def logout():
                 fetch=False,
             )
             return redirect(url_for("seller_routes.shift_report", shift_id=row[0]))
+        if expired:
+            return redirect(url_for("seller_routes.shift_report", shift_id=max(expired)))
     return redirect(url_for("login"))
 
 
@@ -133,6 +261,8 @@ def check_db():
         db = get_db()
         dbname = db.db_params.get("dbname", "?")
         host = db.db_params.get("host", "?")
+        pool = get_pool()
+        pool_stats = pool.stats() if pool is not None else None
         row = db.execute_one(
             "SELECT id_employee, is_active FROM employees WHERE login = %s",
             ("admin",),
@@ -142,6 +272,13 @@ def check_db():
                 "ok": True,
                 "database": dbname,
                 "host": host,
+                "pool": pool_stats,
+                "bootstrap": _bootstrap_state,
+                "jobs": jobs.status(),
+                "stock_events": stock_events.status(),
+                "price_cache": price_cache.cache.stats(),
+                "report_cache": report_cache.cache.stats(),
+                "shift_events": shift_events.status(),
                 "admin_exists": True,
                 "admin_active": bool(row[1]),
                 "message": "Подключение к БД успешно. Пользователь admin есть в таблице employees.",
@@ -150,6 +287,8 @@ def check_db():
             "ok": True,
             "database": dbname,
             "host": host,
+            "pool": pool_stats,
+            "bootstrap": _bootstrap_state,
             "admin_exists": False,
             "message": "Подключение к БД успешно, но пользователя admin нет в таблице employees.",
         })
@@ -161,12 +300,34 @@ def check_db():
         }), 500
 
 
+@app.route("/api/metrics/sql")
+def sql_metrics():
+    """Счётчики SQL в формате Prometheus: с заголовком Authorization: Bearer METRICS_TOKEN,
+    а если токен не задан — только администратору в сессии."""
+    if METRICS_TOKEN:
+        # Сравниваются байты: compare_digest не принимает строки с не-ASCII символами,
+        # а заголовки WSGI-сервер декодирует как latin-1
+        try:
+            header = request.headers.get("Authorization", "").encode("latin-1")
+        except UnicodeEncodeError:
+            header = b""
+        allowed = hmac.compare_digest(header, ("Bearer " + METRICS_TOKEN).encode("utf-8"))
+    else:
+        user = current_user()
+        allowed = bool(user and user["role"] == "admin")
+    if not allowed:
+        return "forbidden\n", 403, {"Content-Type": "text/plain; charset=utf-8"}
+    pool = get_pool()
+    body = query_stats.render_prometheus(pool.stats() if pool is not None else None)
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
 @app.route("/api/fix-admin-password")
 def fix_admin_password():
     from flask import jsonify
     try:
         db = get_db()
-        pw_hash = generate_password_hash("admin123", method="pbkdf2:sha256")
+        pw_hash = hash_password("admin123")
         db.execute(
             "UPDATE employees SET password_hash = %s WHERE login = 'admin'",
             (pw_hash,),
@@ -188,21 +349,39 @@ app.register_blueprint(api_routes.bp, url_prefix="/api")
 
 
 @app.before_request
-def ensure_admin_user():
-    if request.endpoint and request.endpoint != "static":
-        try:
-            init_admin_user()
-        except Exception:
-            pass
+def ensure_bootstrapped():
+    if not _bootstrap_state["done"] and request.endpoint and request.endpoint != "static":
+        bootstrap()
+
+
+@app.cli.command("bootstrap")
+def bootstrap_command():
+    """Проверяет схему БД и создаёт учётную запись admin."""
+    state = bootstrap()
+    if state["error"]:
+        raise SystemExit("Ошибка: %s" % state["error"])
+    for w in state["warnings"]:
+        print("Внимание: %s" % w)
+    print("Готово за %.1f мс" % state["ms"])
+
+
+@app.cli.command("rebuild-rollups")
+@click.option("--date-from", type=click.DateTime(["%Y-%m-%d"]), help="Первый день (ГГГГ-ММ-ДД), по умолчанию — начало истории")
+@click.option("--date-to", type=click.DateTime(["%Y-%m-%d"]), help="Последний день (ГГГГ-ММ-ДД), по умолчанию — конец истории")
+def rebuild_rollups_command(date_from, date_to):
+    """Перестраивает сводные таблицы продаж по дням (sales_rollup.py)."""
+    count = sales_rollup.rebuild(date_from and date_from.date(), date_to and date_to.date())
+    print("Сводка пересчитана: %d операций" % count)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     import webbrowser
-    import threading
     def open_browser():
-        import time
         time.sleep(1.5)
         webbrowser.open("http://127.0.0.1:5000/start")
     if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        with app.app_context():
+            bootstrap()
         threading.Thread(target=open_browser, daemon=True).start()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""ASGI-точка входа: читающее API продавца обслуживается асинхронно, всё остальное — прежним Flask-приложением.
+
+Запуск: hypercorn asgi:application --bind 0.0.0.0:5000
+
+Запросы, для которых есть маршрут в routes/async_api_routes.py (опрос
+товаров и смены, поток событий смены), обрабатывает Quart-приложение с
+асинхронным пулом (async_database); ожидание ответа БД не занимает поток,
+поэтому один процесс держит много терминалов. Остальные пути (чеки,
+открытие и закрытие смены, страницы и API администратора, вход, отчёты)
+передаются в app.app через WSGI-адаптер hypercorn и выполняются в пуле
+потоков, как раньше.
+Сессия общая: оба приложения подписывают cookie одним SECRET_KEY.
+"""
+import os
+import sys
+
+if sys.platform == "win32":
+    os.environ["PYTHONUTF8"] = "1"
+
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from quart import Quart, jsonify
+from werkzeug.exceptions import HTTPException
+
+from app import app as flask_app, bootstrap
+from async_database import get_async_db, AsyncPoolTimeout, AsyncPoolTooManyRequests
+from config import SECRET_KEY, SALES_BATCH_MAX_RECEIPTS
+from routes import async_api_routes
+
+async_app = Quart(__name__)
+async_app.config["SECRET_KEY"] = SECRET_KEY
+async_app.register_blueprint(async_api_routes.bp, url_prefix="/api")
+
+
+@async_app.before_serving
+async def open_db():
+    with flask_app.app_context():
+        bootstrap()
+    await get_async_db().open()
+
+
+@async_app.after_serving
+async def close_db():
+    await get_async_db().close()
+
+
+@async_app.errorhandler(AsyncPoolTimeout)
+@async_app.errorhandler(AsyncPoolTooManyRequests)
+async def pool_busy(e):
+    return jsonify({"error": "Сервер перегружен, повторите запрос"}), 503
+
+
+# WSGI-адаптер читает тело запроса в память и по умолчанию отклоняет тела больше
+# 64 КиБ; самое большое тело — пакет чеков, на чек отводится до 4 КиБ JSON.
+_MAX_BODY_SIZE = max(64 * 1024, SALES_BATCH_MAX_RECEIPTS * 4 * 1024)
+_wsgi_app = AsyncioWSGIMiddleware(flask_app, max_body_size=_MAX_BODY_SIZE)
+_async_routes = async_app.url_map.bind("localhost")
+
+
+def _is_async_route(scope):
+    try:
+        _async_routes.match(scope["path"], method=scope["method"])
+    except HTTPException:
+        return False
+    return True
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan" or (scope["type"] == "http" and _is_async_route(scope)):
+        await async_app(scope, receive, send)
+    else:
+        await _wsgi_app(scope, receive, send)
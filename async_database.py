@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Асинхронный аналог database.Database для ASGI-точки входа (asgi.py).
+
+Работает поверх psycopg 3 и psycopg_pool. Синхронное приложение от них
+не зависит: без этих пакетов модуль импортируется, а AsyncDatabase
+при создании сообщает, что нужно установить.
+"""
+import time
+from contextlib import asynccontextmanager
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import AsyncConnectionPool, PoolTimeout as AsyncPoolTimeout, TooManyRequests as AsyncPoolTooManyRequests
+except ImportError:
+    psycopg = None
+    AsyncConnectionPool = None
+    AsyncPoolTimeout = AsyncPoolTooManyRequests = None
+
+from config import (
+    DB_POOL_MAX_LIFETIME, DB_POOL_TIMEOUT,
+    ASYNC_DB_POOL_MIN_SIZE, ASYNC_DB_POOL_MAX_SIZE, ASYNC_DB_POOL_MAX_WAITING,
+)
+from database import db_params_from_env, has_query_listeners, notify_query, statement_query
+
+
+if psycopg is not None:
+    class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+        """Асинхронный курсор, сообщающий подписчикам (add_query_listener) о каждом запросе."""
+
+        async def execute(self, query, params=None, **kwargs):
+            if not has_query_listeners():
+                return await super().execute(query, params, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await super().execute(query, params, **kwargs)
+            finally:
+                notify_query(query, time.perf_counter() - started)
+
+        async def executemany(self, query, params_seq, **kwargs):
+            if not has_query_listeners():
+                return await super().executemany(query, params_seq, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await super().executemany(query, params_seq, **kwargs)
+            finally:
+                notify_query(query, time.perf_counter() - started)
+
+
+class AsyncDatabase:
+    """Пул асинхронных соединений с тем же набором операций, что у Database.
+
+    Пул открывается явно (await open()) при старте ASGI-сервера. Запросы
+    пишутся с параметрами %s, как и для psycopg2; часто повторяющиеся запросы
+    psycopg 3 сам подготавливает на каждом соединении.
+    """
+
+    def __init__(self, db_params=None, min_size=ASYNC_DB_POOL_MIN_SIZE, max_size=ASYNC_DB_POOL_MAX_SIZE,
+                 max_waiting=ASYNC_DB_POOL_MAX_WAITING, max_lifetime=DB_POOL_MAX_LIFETIME,
+                 timeout=DB_POOL_TIMEOUT):
+        if AsyncConnectionPool is None:
+            raise RuntimeError("Для асинхронного режима установите пакеты psycopg[binary] и psycopg_pool")
+        self.db_params = db_params or db_params_from_env()
+        self.pool = AsyncConnectionPool(
+            make_conninfo(**{k: v for k, v in self.db_params.items() if v is not None}),
+            kwargs={"cursor_factory": InstrumentedAsyncCursor},
+            min_size=min_size,
+            max_size=max_size,
+            max_waiting=max_waiting,
+            max_lifetime=max_lifetime,
+            timeout=timeout,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+
+    async def open(self):
+        await self.pool.open(wait=True)
+
+    async def close(self):
+        await self.pool.close()
+
+    @asynccontextmanager
+    async def cursor(self):
+        """Курсор в отдельной транзакции: commit при выходе, rollback при исключении."""
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                yield cur
+
+    async def execute(self, query: str, params=None, fetch=True):
+        async with self.cursor() as cur:
+            await cur.execute(query, params or ())
+            if fetch and cur.description:
+                return await cur.fetchall()
+            return None
+
+    async def execute_one(self, query: str, params=None):
+        async with self.cursor() as cur:
+            await cur.execute(query, params or ())
+            return await cur.fetchone() if cur.description else None
+
+    async def execute_statement(self, cur, name: str, params=()):
+        """Выполняет на курсоре запрос, зарегистрированный через database.register_statement."""
+        await cur.execute(statement_query(name), params)
+
+    async def execute_statement_many(self, cur, name: str, rows):
+        """То же для набора строк; psycopg 3 отправляет их конвейером, за один обмен с сервером."""
+        if rows:
+            await cur.executemany(statement_query(name), rows)
+
+    def stats(self):
+        s = self.pool.get_stats()
+        return {
+            "min_size": self.pool.min_size,
+            "max_size": self.pool.max_size,
+            "idle": s.get("pool_available", 0),
+            "in_use": s.get("pool_size", 0) - s.get("pool_available", 0),
+            "waiting": s.get("requests_waiting", 0),
+            "checkouts": s.get("requests_num", 0),
+            "wait_timeouts": s.get("requests_errors", 0),
+        }
+
+
+_db = None
+
+
+def get_async_db():
+    """Общий для процесса AsyncDatabase; открывается и закрывается в asgi.py."""
+    global _db
+    if _db is None:
+        _db = AsyncDatabase()
+    return _db
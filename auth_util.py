@@ -1,26 +1,219 @@
 # -*- coding: utf-8 -*-
+import logging
+import select
+import threading
+import time
 from functools import wraps
+
+import psycopg2
 from flask import g, session, redirect, url_for
-from database import Database
+from database import Database, ConnectionPool, db_params_from_env, db_params_from_dsn
+from config import (
+    DB_POOL_ENABLED, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_LIFETIME,
+    DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE,
+    DB_REPLICA_DSN, DB_REPLICA_MAX_LAG_SECONDS, DB_REPLICA_LAG_CHECK_INTERVAL,
+    USER_CACHE_TTL, USER_CACHE_CHANNEL,
+)
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_replica_pool = None
+_pool_lock = threading.Lock()
+# Результат последней проверки реплики: пока он свежий, повторно не проверяем.
+_replica_state = {"checked_at": None, "ok": False}
+
+
+def get_pool():
+    global _pool
+    if not DB_POOL_ENABLED:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    db_params_from_env(),
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    timeout=DB_POOL_TIMEOUT,
+                    check_idle=DB_POOL_CHECK_IDLE,
+                )
+    return _pool
+
+
+def get_replica_pool():
+    global _replica_pool
+    if not DB_REPLICA_DSN:
+        return None
+    if _replica_pool is None:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(
+                    db_params_from_dsn(DB_REPLICA_DSN),
+                    min_size=0,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    timeout=DB_POOL_TIMEOUT,
+                    check_idle=DB_POOL_CHECK_IDLE,
+                    readonly=True,
+                )
+    return _replica_pool
+
 
+def _replica_check_due():
+    checked_at = _replica_state["checked_at"]
+    return checked_at is None or time.monotonic() - checked_at >= DB_REPLICA_LAG_CHECK_INTERVAL
 
-def get_db():
+
+def _open_replica():
+    """Соединение с репликой или None, если она недоступна или отстаёт больше допустимого."""
+    if not _replica_check_due() and not _replica_state["ok"]:
+        return None
+    try:
+        db = Database(pool=get_replica_pool())
+    except Exception as e:
+        logger.warning("replica unavailable, using primary: %s", e)
+        _replica_state.update(checked_at=time.monotonic(), ok=False)
+        return None
+    if _replica_check_due():
+        try:
+            lag = db.replication_lag()
+            ok = lag <= DB_REPLICA_MAX_LAG_SECONDS
+            if not ok:
+                logger.warning("replica lag %.1f s exceeds %.1f s, using primary", lag, DB_REPLICA_MAX_LAG_SECONDS)
+        except Exception as e:
+            logger.warning("replica lag check failed, using primary: %s", e)
+            ok = False
+        _replica_state.update(checked_at=time.monotonic(), ok=ok)
+    if not _replica_state["ok"]:
+        db.close()
+        return None
+    return db
+
+
+def get_db(readonly=False):
+    """Соединение текущего запроса.
+
+    readonly=True — запрос только читает данные и может уйти на реплику
+    (DB_REPLICA_DSN). Если реплика не настроена, недоступна или отстаёт
+    дольше DB_REPLICA_MAX_LAG_SECONDS, возвращается основное соединение.
+    """
+    if readonly and DB_REPLICA_DSN:
+        if "db_ro" not in g:
+            g.db_ro = _open_replica()
+        if g.db_ro is not None:
+            return g.db_ro
     if "db" not in g:
-        g.db = Database()
+        g.db = Database(pool=get_pool())
     return g.db
 
 
-def current_user():
-    if not session.get("user_id"):
-        return None
-    db = get_db()
-    row = db.execute_one(
-        """SELECT e.id_employee, e.login, e.full_name, e.role, e.store_id, s.name AS store_name
+class UserCache:
+    """Кэш сотрудников между запросами: user_id -> (срок годности, пользователь).
+
+    При ttl <= 0 выключен. Кэш свой у каждого процесса. Любое изменение или
+    удаление сотрудника (и переименование магазина) триггер из init_db.sql
+    сообщает через NOTIFY в канал USER_CACHE_CHANNEL, и поток-слушатель каждого
+    процесса сразу сбрасывает запись. Пока слушатель не подключён, кэш не
+    используется: пропущенное уведомление не может оставить прежние права.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = {}
+        self.enabled = False
+        # Растёт при каждом сбросе: put() не сохраняет сотрудника, прочитанного
+        # из БД до сброса, иначе в кэш могла бы вернуться прежняя запись.
+        self.generation = 0
+
+    def get(self, user_id):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            if not self.enabled:
+                return None
+            item = self._items.get(user_id)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._items[user_id]
+                return None
+            return item[1]
+
+    def put(self, user_id, user, generation):
+        """Сохраняет сотрудника, прочитанного из БД в поколении generation."""
+        if self.ttl <= 0 or user is None:
+            return
+        with self._lock:
+            if self.enabled and generation == self.generation:
+                self._items[user_id] = (time.monotonic() + self.ttl, user)
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+        if not enabled:
+            self.invalidate()
+
+    def invalidate(self, user_id=None):
+        """Сбрасывает запись сотрудника, а без user_id — весь кэш."""
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(user_id, None)
+
+
+user_cache = UserCache(USER_CACHE_TTL)
+_user_listener = {"thread": None}
+
+
+def _listen_users():
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**db_params_from_env())
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("LISTEN " + USER_CACHE_CHANNEL)
+            # Кэш включается только после LISTEN: изменения с этого момента придут уведомлениями
+            user_cache.set_enabled(True)
+            backoff = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    payload = conn.notifies.pop(0).payload
+                    user_cache.invalidate(int(payload) if payload.isdigit() else None)
+        except Exception as e:
+            user_cache.set_enabled(False)
+            logger.warning("user cache listener disconnected, retry in %d s: %s", backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start_user_cache():
+    """Запускает слушатель изменений сотрудников (один на процесс); до его подключения кэш выключен."""
+    if user_cache.ttl <= 0 or _user_listener["thread"] is not None:
+        return
+    _user_listener["thread"] = threading.Thread(target=_listen_users, name="user-cache", daemon=True)
+    _user_listener["thread"].start()
+
+CURRENT_USER_QUERY = """SELECT e.id_employee, e.login, e.full_name, e.role, e.store_id, s.name AS store_name
            FROM employees e
            LEFT JOIN stores s ON s.id_store = e.store_id
-           WHERE e.id_employee = %s AND e.is_active = TRUE""",
-        (session["user_id"],),
-    )
+           WHERE e.id_employee = %s AND e.is_active = TRUE"""
+
+
+def user_from_row(row):
     if not row:
         return None
     return {
@@ -33,6 +226,31 @@ def current_user():
     }
 
 
+def current_user():
+    """Пользователь текущей сессии; в пределах запроса запоминается в g."""
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    cached = g.get("current_user")
+    if cached is not None and cached[0] == user_id:
+        return cached[1]
+    user = user_cache.get(user_id)
+    if user is None:
+        generation = user_cache.generation
+        user = user_from_row(get_db().execute_one(CURRENT_USER_QUERY, (user_id,)))
+        user_cache.put(user_id, user, generation)
+    g.current_user = (user_id, user)
+    return user
+
+
+def invalidate_user(user_id=None):
+    """Сбрасывает запомненного пользователя (после изменения или отключения сотрудника)."""
+    user_cache.invalidate(user_id)
+    cached = g.get("current_user")
+    if cached is not None and (user_id is None or cached[0] == user_id):
+        g.pop("current_user", None)
+
+
 def require_admin(f):
     @wraps(f)
     def inner(*args, **kwargs):
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замер массового входа («штурм» /login в начале смены).
+Использование: python bench_login_storm.py [одновременных_входов] [всего_входов] [логин] [пароль]
+Пример: python bench_login_storm.py 50 200 admin admin123
+
+Скрипт поднимает приложение на свободном порту в этом же процессе и
+отправляет входы из нескольких потоков сразу. Прогон повторяется без пула
+процессов (хеш проверяется в потоке запроса) и с пулом (PASSWORD_HASH_WORKERS,
+PASSWORD_HASH_QUEUE). Для каждого режима печатаются успешные входы, отказы
+«сервер занят» (503), ошибки, число входов в секунду и задержки.
+"""
+import logging
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+import passwords
+from app import app
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def login_once(url, body):
+    opener = urllib.request.build_opener(_NoRedirect)
+    started = time.perf_counter()
+    try:
+        status = opener.open(url, data=body, timeout=60).status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = None
+    return status, time.perf_counter() - started
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def storm(url, body, concurrency, total):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        results = list(ex.map(lambda _: login_once(url, body), range(total)))
+    elapsed = time.perf_counter() - started
+    ok = [t for status, t in results if status == 302]
+    busy = sum(1 for status, _ in results if status == 503)
+    failed = len(results) - len(ok) - busy
+    return {
+        "ok": len(ok), "busy": busy, "failed": failed,
+        "rps": len(ok) / elapsed if elapsed else 0.0,
+        "p50": percentile(ok, 0.5) * 1000, "p95": percentile(ok, 0.95) * 1000, "max": max(ok, default=0) * 1000,
+    }
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    login = sys.argv[3] if len(sys.argv) > 3 else "admin"
+    password = sys.argv[4] if len(sys.argv) > 4 else "admin123"
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    logging.getLogger("sql").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d/login" % server.server_port
+    body = urllib.parse.urlencode({"login": login, "password": password}).encode()
+
+    status, _ = login_once(url, body)
+    if status != 302:
+        print(f"✗ Вход {login} не удался (HTTP {status}): проверьте логин и пароль")
+        server.shutdown()
+        sys.exit(1)
+
+    print(f"Входов: {total}, одновременно: {concurrency}")
+    print("=" * 78)
+    print(f"{'режим':<28}{'успешно':>8}{'503':>6}{'ошибки':>8}{'вход/с':>9}{'p50 мс':>9}{'p95 мс':>9}{'max мс':>9}")
+    modes = [("в потоке запроса", 0, 0),
+             (f"пул {PASSWORD_HASH_WORKERS} проц., очередь {PASSWORD_HASH_QUEUE}", max(1, PASSWORD_HASH_WORKERS), PASSWORD_HASH_QUEUE)]
+    for label, workers, queue in modes:
+        passwords.configure(workers=workers, queue=queue)
+        login_once(url, body)  # прогрев пула процессов
+        r = storm(url, body, concurrency, total)
+        print(f"{label:<28}{r['ok']:>8}{r['busy']:>6}{r['failed']:>8}{r['rps']:>9.1f}{r['p50']:>9.0f}{r['p95']:>9.0f}{r['max']:>9.0f}")
+    passwords.shutdown()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Замер выигрыша от подготовленных запросов (PREPARE/EXECUTE) на чеке продажи.
+Использование: python bench_prepared_statements.py [кол-во_чеков] [строк_в_чеке]
+Пример: python bench_prepared_statements.py 500 5
+
+Скрипт прогоняет запросы чека (поиск смены, цены, списание остатков, вставка
+операции и строк) обычным способом и через подготовленные запросы.
+Каждый чек выполняется в транзакции, которая откатывается, поэтому данные
+в БД не меняются. Нужны хотя бы один продавец и товары с остатком в его магазине.
+"""
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from database import Database, statement_query
+import routes.api_routes  # noqa: F401  регистрирует запросы pos_*
+
+WARMUP = 10
+
+
+def planning_ms(db, name, params):
+    """Время планирования запроса сервером (EXPLAIN SUMMARY), мс."""
+    with db.cursor() as cur:
+        cur.execute("EXPLAIN (SUMMARY) " + statement_query(name), params)
+        for (line,) in cur.fetchall():
+            m = re.search(r"Planning Time: ([\d.]+) ms", line)
+            if m:
+                return float(m.group(1))
+    return 0.0
+
+
+def receipt_statements(seller_id, store_id, product_ids):
+    """Запросы одного чека в том порядке, в каком их выполняет create_sale."""
+    steps = [
+        ("pos_open_shift", (seller_id, store_id)),
+        ("pos_products_prices", (list(product_ids),)),
+        ("pos_take_stock", (list(product_ids), [0] * len(product_ids), store_id)),
+        ("pos_insert_operation", ("sale", None, seller_id, store_id, 10, 5, 5, None)),
+    ]
+    # Строки чека create_sale вставляет одной многострочной командой; здесь —
+    # по одной, чтобы сравнивать один и тот же подготовленный запрос.
+    for pid in product_ids:
+        steps.append(("pos_insert_item", (None, datetime.now(timezone.utc), pid, 1, 10, 5, 10, 5, 5)))
+    return steps
+
+
+def run_receipts(db, steps, receipts, prepared):
+    cur = db.get_cursor()
+    try:
+        started = time.perf_counter()
+        for _ in range(receipts):
+            op = None
+            for name, params in steps:
+                if name == "pos_insert_item":
+                    params = tuple(op) + params[2:]
+                if prepared:
+                    db.run_prepared(cur, name, params)
+                else:
+                    cur.execute(statement_query(name), params)
+                if name == "pos_insert_operation":
+                    op = cur.fetchone()
+            db.connection.rollback()
+        return time.perf_counter() - started
+    finally:
+        db.connection.rollback()
+        cur.close()
+
+
+def main():
+    receipts = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    db = Database()
+    seller = db.execute_one(
+        """SELECT e.id_employee, e.store_id FROM employees e
+           WHERE e.role = 'seller' AND e.is_active = TRUE AND e.store_id IS NOT NULL
+           ORDER BY e.id_employee LIMIT 1"""
+    )
+    if not seller:
+        print("✗ Нет активного продавца с магазином — бенчмарку не на чем работать")
+        sys.exit(1)
+    seller_id, store_id = seller
+    product_ids = [r[0] for r in db.execute(
+        "SELECT product_id FROM store_product_stock WHERE store_id = %s ORDER BY product_id LIMIT %s",
+        (store_id, lines),
+    ) or []]
+    if not product_ids:
+        print("✗ В магазине продавца нет остатков товаров")
+        sys.exit(1)
+
+    steps = receipt_statements(seller_id, store_id, product_ids)
+    print(f"Чеков: {receipts}, строк в чеке: {len(product_ids)}, запросов на чек: {len(steps)}")
+    print("=" * 60)
+
+    plan_ms = 0.0
+    for name, params in steps:
+        if name in ("pos_insert_operation", "pos_insert_item", "pos_take_stock"):
+            # EXPLAIN без ANALYZE не выполняет запрос, поэтому вставки безопасны
+            params = tuple(1 if p is None else p for p in params)
+        plan_ms += planning_ms(db, name, params)
+    print(f"Планирование запросов одного чека без подготовки: {plan_ms:.3f} мс")
+
+    run_receipts(db, steps, WARMUP, prepared=False)
+    plain = run_receipts(db, steps, receipts, prepared=False)
+    # Первые выполнения подготовленного запроса сервер ещё планирует заново
+    # (plan_cache_mode = auto), поэтому прогреваем его до общего плана.
+    run_receipts(db, steps, WARMUP, prepared=True)
+    prepared = run_receipts(db, steps, receipts, prepared=True)
+
+    per_plain = plain / receipts * 1000
+    per_prepared = prepared / receipts * 1000
+    print(f"Без подготовки:        {per_plain:.3f} мс на чек")
+    print(f"Подготовленные запросы: {per_prepared:.3f} мс на чек")
+    print(f"Экономия:              {per_plain - per_prepared:.3f} мс на чек "
+          f"({(1 - per_prepared / per_plain) * 100 if per_plain else 0:.1f}%)")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,3 +10,52 @@ SHIFT_DURATION_SECONDS = None
 LOW_STOCK_THRESHOLD = 5
 MONEY_DECIMALS = 2
 PERCENT_DECIMALS = 1
+DB_POOL_ENABLED = os.environ.get("DB_POOL_ENABLED", "1") == "1"
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_POOL_CHECK_IDLE = float(os.environ.get("DB_POOL_CHECK_IDLE", "30"))
+SQL_STATS_ENABLED = os.environ.get("SQL_STATS_ENABLED", "1") == "1"
+SQL_SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", "200"))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get("SQL_N_PLUS_ONE_THRESHOLD", "10"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+DB_REPLICA_DSN = os.environ.get("DB_REPLICA_DSN", "")
+DB_REPLICA_MAX_LAG_SECONDS = float(os.environ.get("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("DB_REPLICA_LAG_CHECK_INTERVAL", "2"))
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get("ASYNC_DB_POOL_MIN_SIZE", "2"))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get("ASYNC_DB_POOL_MAX_SIZE", "20"))
+ASYNC_DB_POOL_MAX_WAITING = int(os.environ.get("ASYNC_DB_POOL_MAX_WAITING", "0"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "0"))
+# Канал задан аргументом триггеров в init_db.sql, поэтому не настраивается
+USER_CACHE_CHANNEL = "employee_changes"
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", "32"))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "10"))
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", "48"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.environ.get("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+SALES_BATCH_CHUNK = int(os.environ.get("SALES_BATCH_CHUNK", "100"))
+SALES_BATCH_MAX_RECEIPTS = int(os.environ.get("SALES_BATCH_MAX_RECEIPTS", "2000"))
+SALES_BATCH_CLOCK_SKEW_SECONDS = float(os.environ.get("SALES_BATCH_CLOCK_SKEW_SECONDS", "300"))
+STOCK_EVENTS_COALESCE_SECONDS = float(os.environ.get("STOCK_EVENTS_COALESCE_SECONDS", "2"))
+STOCK_EVENTS_QUEUE_SIZE = int(os.environ.get("STOCK_EVENTS_QUEUE_SIZE", "10000"))
+STOCK_SWEEP_INTERVAL = float(os.environ.get("STOCK_SWEEP_INTERVAL", "900"))
+PRICE_CACHE_SIZE = int(os.environ.get("PRICE_CACHE_SIZE", "10000"))
+# Канал задан аргументом триггера в init_db.sql, поэтому не настраивается
+PRICE_CACHE_CHANNEL = "product_prices"
+STORE_TIMEZONE = os.environ.get("STORE_TIMEZONE", "")
+SALES_BY_DATE_PAGE_SIZE = int(os.environ.get("SALES_BY_DATE_PAGE_SIZE", "200"))
+REPORT_SALES_PAGE_SIZE = int(os.environ.get("REPORT_SALES_PAGE_SIZE", "100"))
+REPORT_EXPORT_CHUNK_ROWS = int(os.environ.get("REPORT_EXPORT_CHUNK_ROWS", "1000"))
+REPORT_EXPORT_CSV_DELIMITER = os.environ.get("REPORT_EXPORT_CSV_DELIMITER", ";")
+REPORT_CACHE_SIZE = int(os.environ.get("REPORT_CACHE_SIZE", "256"))
+REPORT_CACHE_TTL = float(os.environ.get("REPORT_CACHE_TTL", "60"))
+REPORT_CACHE_STALE_SECONDS = float(os.environ.get("REPORT_CACHE_STALE_SECONDS", "0"))
+# Канал задан аргументом триггеров в init_db.sql, поэтому не настраивается
+REPORT_CACHE_CHANNEL = "report_changes"
+# Канал задан аргументом триггера в init_db.sql, поэтому не настраивается
+SHIFT_EVENTS_CHANNEL = "shift_events"
+SHIFT_EXPIRY_SWEEP_INTERVAL = float(os.environ.get("SHIFT_EXPIRY_SWEEP_INTERVAL", "60"))
+OPERATION_PARTITIONS_AHEAD_MONTHS = int(os.environ.get("OPERATION_PARTITIONS_AHEAD_MONTHS", "3"))
+OPERATION_PARTITIONS_INTERVAL = float(os.environ.get("OPERATION_PARTITIONS_INTERVAL", "3600"))
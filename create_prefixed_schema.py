@@ -33,7 +33,8 @@ def add_prefix_to_sql(sql_content, prefix):
     tables = [
         'categories', 'stores', 'warehouses', 'products', 'employees',
         'shifts', 'operations', 'operation_items', 'store_product_stock',
-        'warehouse_product_stock', 'notifications'
+        'warehouse_product_stock', 'notifications', 'idempotency_keys',
+        'shift_reports', 'sales_daily_store', 'sales_daily_product'
     ]
     
     # Заменяем имена таблиц на версии с префиксом
@@ -99,6 +100,54 @@ def add_prefix_to_sql(sql_content, prefix):
             modified_sql,
             flags=re.IGNORECASE
         )
+        # ON table FOR / ON table; - для триггеров
+        modified_sql = re.sub(
+            rf'\bON\s+{table}(\s+FOR\b|\s*;)',
+            rf'ON {prefixed_table}\1',
+            modified_sql,
+            flags=re.IGNORECASE
+        )
+        # UPDATE table / FROM table / JOIN table - для переноса данных в init_db.sql
+        modified_sql = re.sub(
+            rf'\bUPDATE\s+{table}\b',
+            f'UPDATE {prefixed_table}',
+            modified_sql,
+            flags=re.IGNORECASE
+        )
+        modified_sql = re.sub(
+            rf'\bFROM\s+{table}\b',
+            f'FROM {prefixed_table}',
+            modified_sql,
+            flags=re.IGNORECASE
+        )
+        modified_sql = re.sub(
+            rf'\bJOIN\s+{table}\b',
+            f'JOIN {prefixed_table}',
+            modified_sql,
+            flags=re.IGNORECASE
+        )
+        modified_sql = re.sub(
+            rf'\bINSERT\s+INTO\s+{table}\b',
+            f'INSERT INTO {prefixed_table}',
+            modified_sql,
+            flags=re.IGNORECASE
+        )
+        # 'table'::regclass - имя таблицы строкой (создание секций)
+        modified_sql = re.sub(
+            rf"'{table}'::regclass",
+            f"'{prefixed_table}'::regclass",
+            modified_sql,
+            flags=re.IGNORECASE
+        )
+    
+    # Функции триггеров тоже получают префикс: иначе схема с префиксом
+    # заменила бы функции основной схемы своими (с другими таблицами)
+    functions = re.findall(r'\bCREATE\s+OR\s+REPLACE\s+FUNCTION\s+(\w+)\s*\(', modified_sql, flags=re.IGNORECASE)
+    for function in set(functions):
+        modified_sql = re.sub(rf'\b{function}\s*\(', f'{prefix}_{function}(', modified_sql)
+    # Имена индексов общие со всеми таблицами схемы: без префикса индекс
+    # таблицы с префиксом не создался бы (IF NOT EXISTS), а DROP INDEX удалил бы чужой
+    modified_sql = re.sub(r'\b(idx_\w+)', rf'{prefix}_\1', modified_sql)
     
     return modified_sql
 
@@ -147,11 +196,11 @@ def main():
     # Выполняем модифицированный SQL
     print(f"\nСоздание таблиц с префиксом '{prefix}_'...")
     try:
-        # Правильно разбиваем SQL на команды, учитывая блоки DO $$ ... END $$
+        # Правильно разбиваем SQL на команды, учитывая тела в $$ ... $$
+        # (блоки DO и функции): точка с запятой внутри тела команду не завершает
         commands = []
         current_command = ""
-        in_do_block = False
-        do_block_delimiter = None
+        in_body = False
         
         for line in prefixed_sql.split('\n'):
             line_stripped = line.strip()
@@ -160,29 +209,12 @@ def main():
             if line_stripped.startswith('--'):
                 continue
             
-            # Проверяем начало блока DO $$
-            if re.search(r'\bDO\s+\$\$', line_stripped, re.IGNORECASE):
-                in_do_block = True
-                do_block_delimiter = '$$'
-                current_command = line + '\n'
-                continue
-            
-            # Если мы в блоке DO $$
-            if in_do_block:
-                current_command += line + '\n'
-                # Проверяем конец блока END $$
-                if re.search(r'\bEND\s+\$\$', line_stripped, re.IGNORECASE):
-                    if line_stripped.endswith(';'):
-                        commands.append(current_command.strip())
-                        current_command = ""
-                        in_do_block = False
-                continue
-            
-            # Обычная команда
             current_command += line + '\n'
+            if line.count('$$') % 2:
+                in_body = not in_body
             
-            # Если строка заканчивается на ; и мы не в блоке
-            if line_stripped.endswith(';'):
+            # Если строка заканчивается на ; и мы не в теле блока
+            if not in_body and line_stripped.endswith(';'):
                 cmd = current_command.strip()
                 if cmd and not cmd.startswith('--'):
                     commands.append(cmd)
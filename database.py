@@ -1,47 +1,359 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import sys
+import time
+import itertools
+import threading
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from psycopg2 import sql
 from contextlib import contextmanager
 
 
+def db_params_from_dsn(dsn: str):
+    params = psycopg2.extensions.parse_dsn(dsn)
+    params.setdefault('client_encoding', 'UTF8')
+    return params
+
+
+def db_params_from_env(dbname: str = "kursach1",
+                       user: str = "postgres",
+                       password: str = "1234",
+                       host: str = "localhost",
+                       port: str = "5432"):
+    return {
+        'dbname': os.environ.get("DB_NAME", dbname),
+        'user': os.environ.get("DB_USER", user),
+        'password': os.environ.get("DB_PASSWORD", password),
+        'host': os.environ.get("DB_HOST", host),
+        'port': os.environ.get("DB_PORT", port),
+        'client_encoding': 'UTF8'
+    }
+
+
+_stream_names = itertools.count(1)
+_statements = {}
+_STATEMENT_NAME_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+BULK_PAGE_SIZE = 1000
+
+
+_query_listeners = []
+
+
+def add_query_listener(fn):
+    """Подписывает fn(query, seconds) на каждый выполненный запрос."""
+    _query_listeners.append(fn)
+
+
+def has_query_listeners():
+    return bool(_query_listeners)
+
+
+def notify_query(query, seconds):
+    """Сообщает подписчикам о выполненном запросе; ошибки подписчиков игнорируются."""
+    for fn in _query_listeners:
+        try:
+            fn(query, seconds)
+        except Exception:
+            pass
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, сообщающий подписчикам текст и длительность каждого запроса."""
+
+    def execute(self, query, vars=None):
+        if not _query_listeners:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            notify_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        if not _query_listeners:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            notify_query(query, time.perf_counter() - started)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Соединение, которое помнит, какие запросы на нём уже подготовлены (PREPARE).
+
+    Набор живёт вместе с соединением: после переподключения он пуст
+    и запросы подготавливаются заново. Курсоры соединения по умолчанию
+    инструментированы (см. add_query_listener).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = InstrumentedCursor
+
+
+def register_statement(name: str, query: str):
+    """Регистрирует именованный запрос для execute_prepared / run_prepared.
+
+    Параметры в запросе записываются как обычно (%s), литеральных знаков %
+    в тексте быть не должно.
+    """
+    if not _STATEMENT_NAME_RE.match(name):
+        raise ValueError("Недопустимое имя подготовленного запроса: %r" % name)
+    counter = itertools.count(1)
+    text = re.sub(r"%s", lambda m: "$%d" % next(counter), query)
+    _statements[name] = (text, next(counter) - 1, query)
+
+
+def statement_query(name: str):
+    """Возвращает исходный текст (с %s) зарегистрированного запроса."""
+    return _statements[name][2]
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с ограничением размера.
+
+    Соединение, простоявшее без дела дольше check_idle секунд, перед выдачей
+    проверяется запросом SELECT 1; соединения старше max_lifetime закрываются
+    при возврате. Если все max_size соединений заняты, getconn ждёт не дольше
+    timeout секунд и затем бросает PoolTimeout.
+    """
+
+    def __init__(self, db_params, min_size=1, max_size=10, max_lifetime=1800.0,
+                 timeout=10.0, check_idle=30.0, readonly=False):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Некорректные размеры пула: min=%s, max=%s" % (min_size, max_size))
+        self.db_params = db_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.readonly = readonly
+        self._cond = threading.Condition()
+        self._idle = []
+        self._born = {}
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "health_check_failures": 0,
+            "wait_timeouts": 0,
+            "wait_time_total": 0.0,
+        }
+        for _ in range(min_size):
+            conn = self._new_connection()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    def _new_connection(self):
+        try:
+            conn = psycopg2.connect(connection_factory=PreparingConnection, **self.db_params)
+        except Exception as e:
+            raise RuntimeError(f"Ошибка подключения к БД: {e}") from e
+        conn.autocommit = False
+        if self.readonly:
+            conn.readonly = True
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._counters["connections_created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        self._born.pop(id(conn), None)
+        self._counters["connections_closed"] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn))
+        return born is None or time.monotonic() - born > self.max_lifetime
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._counters["health_check_failures"] += 1
+            return False
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            conn = idle_since = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Пул соединений закрыт")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        if self._expired(conn):
+                            self._discard(conn)
+                            continue
+                        break
+                    if self._in_use < self.max_size:
+                        break
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        self._counters["wait_timeouts"] += 1
+                        raise PoolTimeout(
+                            "Нет свободных соединений с БД (занято %s из %s)" % (self._in_use, self.max_size)
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                # Слот резервируется под блокировкой, а сетевые операции
+                # (проверка и новое подключение) выполняются уже без неё.
+                self._in_use += 1
+            if conn is not None and not self._healthy(conn, idle_since):
+                with self._cond:
+                    self._in_use -= 1
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._cond:
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+            with self._cond:
+                self._counters["checkouts"] += 1
+                self._counters["wait_time_total"] += time.monotonic() - started
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            if not discard and not conn.closed:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        discard = True
+            if self._closed or discard or conn.closed or self._expired(conn):
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._counters)
+            out.update({
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+            })
+            return out
+
+
+def _copy_text(val):
+    if val is None:
+        return "\\N"
+    if isinstance(val, bool):
+        return "t" if val else "f"
+    if hasattr(val, "isoformat"):
+        val = val.isoformat()
+    return (str(val).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class _CopyReader:
+    """Файлоподобный объект для copy_expert: строки кодируются в текстовый формат COPY по мере чтения."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            chunk = []
+            for row in itertools.islice(self._rows, 500):
+                chunk.append("\t".join(_copy_text(v) for v in row) + "\n")
+            if not chunk:
+                break
+            self._buf += "".join(chunk).encode("utf-8")
+        if size < 0:
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
 class Database:
     def __init__(self, dbname: str = "kursach1",
                  user: str = "postgres",
                  password: str = "1234",
                  host: str = "localhost",
-                 port: str = "5432"):
+                 port: str = "5432",
+                 pool: ConnectionPool = None):
         if sys.platform == "win32":
             os.environ["PYTHONUTF8"] = "1"
 
-        dbname = os.environ.get("DB_NAME", dbname)
-        user = os.environ.get("DB_USER", user)
-        password = os.environ.get("DB_PASSWORD", password)
-        host = os.environ.get("DB_HOST", host)
-        port = os.environ.get("DB_PORT", port)
-
-        self.db_params = {
-            'dbname': dbname,
-            'user': user,
-            'password': password,
-            'host': host,
-            'port': port,
-            'client_encoding': 'UTF8'
-        }
+        self.pool = pool
+        if pool is not None:
+            self.db_params = pool.db_params
+        else:
+            self.db_params = db_params_from_env(dbname, user, password, host, port)
 
         self.connection = None
         self.connect()
 
     def connect(self):
+        if self.pool is not None:
+            if self.connection is not None:
+                self.pool.putconn(self.connection, discard=True)
+                self.connection = None
+            self.connection = self.pool.getconn()
+            return
         try:
-            self.connection = psycopg2.connect(**self.db_params)
+            self.connection = psycopg2.connect(connection_factory=PreparingConnection, **self.db_params)
             self.connection.autocommit = False
         except Exception as e:
             raise RuntimeError(f"Ошибка подключения к БД: {e}") from e
 
     def close(self):
         if self.connection:
-            self.connection.close()
+            if self.pool is not None:
+                self.pool.putconn(self.connection)
+            else:
+                self.connection.close()
             self.connection = None
 
     def get_cursor(self):
@@ -76,3 +388,152 @@ class Database:
         with self.cursor() as cur:
             cur.execute(query, params or ())
             return cur.fetchone() if cur.description else None
+
+    @contextmanager
+    def _cursor_or(self, cur):
+        if cur is not None:
+            yield cur
+        else:
+            with self.cursor() as own:
+                yield own
+
+    def execute_values(self, query: str, rows, template=None, page_size: int = BULK_PAGE_SIZE, fetch=False, cur=None):
+        """Многострочный VALUES: query содержит ровно один %s, на его место подставляются строки rows.
+
+        Строки отправляются пачками по page_size, по одному запросу на пачку.
+        fetch=True возвращает строки RETURNING всех пачек в порядке rows.
+        Без cur выполняется в отдельной транзакции, с cur — в транзакции вызывающего.
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        if not rows:
+            return [] if fetch else None
+        with self._cursor_or(cur) as c:
+            return psycopg2.extras.execute_values(c, query, rows, template=template, page_size=page_size, fetch=fetch)
+
+    def insert_rows(self, table: str, columns, rows, returning=None, on_conflict=None,
+                    page_size: int = BULK_PAGE_SIZE, cur=None):
+        """INSERT нескольких строк пачками; returning — выражение RETURNING (например "id_operation").
+
+        Возвращает строки RETURNING в порядке rows или None, если returning не задан.
+        """
+        parts = [sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns)))]
+        if on_conflict:
+            parts.append(sql.SQL("ON CONFLICT " + on_conflict))
+        if returning:
+            parts.append(sql.SQL("RETURNING " + returning))
+        with self._cursor_or(cur) as c:
+            query = sql.SQL(" ").join(parts).as_string(c)
+            result = self.execute_values(query, rows, page_size=page_size, fetch=bool(returning), cur=c)
+        return result if returning else None
+
+    def update_rows(self, table: str, keys, columns, rows, types, assign=None, where=None, returning=None,
+                    page_size: int = BULK_PAGE_SIZE, cur=None):
+        """UPDATE ... FROM (VALUES ...): одна команда на пачку строк вместо UPDATE на каждую.
+
+        Каждая строка rows — значения keys, затем columns; types — SQL-типы
+        в том же порядке (литералы VALUES без приведения Postgres считает text).
+        В выражениях доступны t (обновляемая таблица) и v (строка VALUES).
+        assign — {колонка: выражение} вместо t.колонка = v.колонка, where —
+        дополнительное условие. Строки, не прошедшие условие, не обновляются и
+        не попадают в результат RETURNING.
+        """
+        names = list(keys) + list(columns)
+        if len(types) != len(names):
+            raise ValueError("update_rows: types должен содержать тип для каждой колонки (%d)" % len(names))
+        assign = assign or {}
+        set_sql = sql.SQL(", ").join(
+            sql.SQL("{} = {}").format(sql.Identifier(col), sql.SQL(assign.get(col) or "v." + col))
+            for col in list(columns) + [c for c in assign if c not in columns]
+        )
+        cond = [sql.SQL("t.{} = v.{}").format(sql.Identifier(k), sql.Identifier(k)) for k in keys]
+        if where:
+            cond.append(sql.SQL("(" + where + ")"))
+        query = sql.SQL("UPDATE {} AS t SET {} FROM (VALUES %s) AS v ({}) WHERE {}").format(
+            sql.Identifier(table), set_sql,
+            sql.SQL(", ").join(map(sql.Identifier, names)),
+            sql.SQL(" AND ").join(cond),
+        )
+        if returning:
+            query = sql.SQL("{} RETURNING {}").format(query, sql.SQL(returning))
+        template = "(" + ", ".join("%%s::%s" % t for t in types) + ")"
+        with self._cursor_or(cur) as c:
+            result = self.execute_values(query.as_string(c), rows, template=template, page_size=page_size,
+                                         fetch=bool(returning), cur=c)
+        return result if returning else None
+
+    def copy_rows(self, table: str, columns, rows, cur=None):
+        """Загружает строки (итерируемое кортежей) командой COPY ... FROM STDIN.
+
+        Строки читаются из rows по мере отправки, целиком в памяти не собираются.
+        Возвращает число загруженных строк.
+        """
+        with self._cursor_or(cur) as c:
+            query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+                sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, columns))).as_string(c)
+            c.copy_expert(query, _CopyReader(rows))
+            return c.rowcount
+
+    def stream(self, query: str, params=None, batch_size: int = 1000):
+        """Построчно отдаёт результат запроса через серверный (именованный) курсор.
+
+        В памяти одновременно держится не больше batch_size строк. Пока генератор
+        не исчерпан, другие запросы через этот же объект выполнять нельзя:
+        их commit закроет серверный курсор.
+        """
+        if self.connection is None or self.connection.closed:
+            self.connect()
+        cur = self.connection.cursor(name="stream_%d" % next(_stream_names))
+        cur.itersize = batch_size
+        done = False
+        try:
+            cur.execute(query, params or ())
+            for row in cur:
+                yield row
+            done = True
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                done = False
+            if done:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+
+    def replication_lag(self):
+        """Отставание реплики в секундах (0 для основного сервера или догнавшей реплики)."""
+        row = self.execute_one(
+            """SELECT CASE
+                 WHEN NOT pg_is_in_recovery() THEN 0
+                 WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                 ELSE COALESCE(EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - pg_last_xact_replay_timestamp())), 0)
+               END"""
+        )
+        return float(row[0] or 0) if row else 0.0
+
+    def run_prepared(self, cur, name: str, params=()):
+        """Выполняет зарегистрированный запрос на курсоре, подготавливая его при первом использовании."""
+        text, nparams, _query = _statements[name]
+        if len(params) != nparams:
+            raise ValueError("Запрос %s ожидает %d параметров, передано %d" % (name, nparams, len(params)))
+        prepared = cur.connection.prepared
+        if name not in prepared:
+            cur.execute("PREPARE %s AS %s" % (name, text))
+            prepared.add(name)
+        if nparams:
+            cur.execute("EXECUTE %s (%s)" % (name, ", ".join(["%s"] * nparams)), params)
+        else:
+            cur.execute("EXECUTE %s" % name)
+
+    def execute_prepared(self, name: str, params=(), fetch=True):
+        with self.cursor() as cur:
+            self.run_prepared(cur, name, params)
+            if fetch and cur.description:
+                return cur.fetchall()
+            return None
+
+    def execute_prepared_one(self, name: str, params=()):
+        with self.cursor() as cur:
+            self.run_prepared(cur, name, params)
+            return cur.fetchone() if cur.description else None
@@ -25,50 +25,52 @@ TABLES_ORDER = [
 ]
 
 
+def _sql_literal(val):
+    if val is None:
+        return 'NULL'
+    if isinstance(val, str):
+        # Экранируем кавычки и спецсимволы
+        escaped = val.replace("'", "''").replace("\\", "\\\\")
+        return f"'{escaped}'"
+    if isinstance(val, (int, float)):
+        return str(val)
+    if isinstance(val, bool):
+        return 'TRUE' if val else 'FALSE'
+    if hasattr(val, 'isoformat'):  # datetime, date, time
+        return f"'{val.isoformat()}'"
+    # Для других типов (например, Decimal) преобразуем в строку
+    escaped = str(val).replace("'", "''")
+    return f"'{escaped}'"
+
+
 def export_table_data(db, table_name, output_file):
-    """Экспортирует данные из таблицы в SQL формат."""
+    """Экспортирует данные из таблицы в SQL формат.
+
+    Строки читаются серверным курсором порциями, поэтому таблица любого
+    размера выгружается при постоянном расходе памяти.
+    """
     try:
-        # Получаем все данные из таблицы
-        rows = db.execute(f"SELECT * FROM {table_name} ORDER BY 1")
-        
-        if not rows:
-            output_file.write(f"-- Таблица {table_name} пуста\n\n")
-            return
-        
         # Получаем имена колонок
         columns = db.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}' ORDER BY ordinal_position")
         column_names = [col[0] for col in columns]
+        columns_str = ', '.join(column_names)
         
-        output_file.write(f"-- Данные таблицы {table_name}\n")
-        output_file.write(f"TRUNCATE TABLE {table_name} CASCADE;\n\n")
-        
-        # Формируем INSERT запросы
-        for row in rows:
-            values = []
-            for i, val in enumerate(row):
-                if val is None:
-                    values.append('NULL')
-                elif isinstance(val, str):
-                    # Экранируем кавычки и спецсимволы
-                    escaped = val.replace("'", "''").replace("\\", "\\\\")
-                    values.append(f"'{escaped}'")
-                elif isinstance(val, (int, float)):
-                    values.append(str(val))
-                elif isinstance(val, bool):
-                    values.append('TRUE' if val else 'FALSE')
-                elif hasattr(val, 'isoformat'):  # datetime, date, time
-                    values.append(f"'{val.isoformat()}'")
-                else:
-                    # Для других типов (например, Decimal) преобразуем в строку
-                    escaped = str(val).replace("'", "''")
-                    values.append(f"'{escaped}'")
-            
-            columns_str = ', '.join(column_names)
-            values_str = ', '.join(values)
+        count = 0
+        for row in db.stream(f"SELECT * FROM {table_name} ORDER BY 1", batch_size=5000):
+            if count == 0:
+                output_file.write(f"-- Данные таблицы {table_name}\n")
+                output_file.write(f"TRUNCATE TABLE {table_name} CASCADE;\n\n")
+            # Формируем INSERT запросы
+            values_str = ', '.join(_sql_literal(val) for val in row)
             output_file.write(f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});\n")
+            count += 1
+        
+        if count == 0:
+            output_file.write(f"-- Таблица {table_name} пуста\n\n")
+            return
         
         output_file.write("\n")
-        print(f"✓ Экспортировано {len(rows)} записей из таблицы {table_name}")
+        print(f"✓ Экспортировано {count} записей из таблицы {table_name}")
         
     except Exception as e:
         print(f"✗ Ошибка при экспорте таблицы {table_name}: {e}")
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Ключи идемпотентности для продаж и возвратов (заголовок Idempotency-Key).
+
+Касса при медленной сети повторяет POST. Первый запрос с ключом занимает строку
+idempotency_keys (employee_id, idem_key) в той же транзакции, что и сам чек, и
+записывает в неё id операции и ответ. Повтор с тем же ключом получает
+сохранённый ответ и остатки не трогает; если первый запрос ещё выполняется,
+повтор ждёт его на уникальном ключе. Если чек не прошёл (нехватка товара,
+ошибка), транзакция откатывается вместе с ключом, и повтор выполняется заново.
+
+Ключи старше IDEMPOTENCY_KEY_TTL_HOURS удаляет фоновая задача (jobs.py).
+"""
+import hashlib
+import json
+
+from auth_util import get_pool
+from config import IDEMPOTENCY_KEY_TTL_HOURS
+from database import Database, register_statement
+
+
+KEY_MAX_LENGTH = 200
+
+register_statement("idem_lookup", "SELECT endpoint, request_hash, response FROM idempotency_keys WHERE employee_id = %s AND idem_key = %s")
+# ON CONFLICT ждёт завершения транзакции, занявшей тот же ключ: после её commit
+# строка не вставляется (RETURNING пуст), после rollback — вставляется.
+register_statement("idem_claim", """INSERT INTO idempotency_keys (employee_id, idem_key, endpoint, request_hash, created_at)
+           VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP) ON CONFLICT (employee_id, idem_key) DO NOTHING RETURNING employee_id""")
+register_statement("idem_store", "UPDATE idempotency_keys SET operation_id = %s, response = %s::jsonb WHERE employee_id = %s AND idem_key = %s")
+# Те же операции для пакета чеков (/api/sales/batch): ключ — client_id чека.
+register_statement("idem_lookup_many", """SELECT idem_key, endpoint, request_hash, response FROM idempotency_keys
+           WHERE employee_id = %s AND idem_key = ANY(%s::varchar[])""")
+register_statement("idem_claim_many", """INSERT INTO idempotency_keys (employee_id, idem_key, endpoint, request_hash, created_at)
+           SELECT %s, v.idem_key, %s, v.request_hash, CURRENT_TIMESTAMP FROM unnest(%s::varchar[], %s::char(64)[]) AS v(idem_key, request_hash)
+           ON CONFLICT (employee_id, idem_key) DO NOTHING RETURNING idem_key""")
+register_statement("idem_store_many", """UPDATE idempotency_keys AS t SET operation_id = v.operation_id, response = v.response::jsonb
+           FROM unnest(%s::varchar[], %s::int[], %s::text[]) AS v(idem_key, operation_id, response)
+           WHERE t.employee_id = %s AND t.idem_key = v.idem_key""")
+register_statement("idem_release_many", "DELETE FROM idempotency_keys WHERE employee_id = %s AND idem_key = ANY(%s::varchar[])")
+
+
+class IdempotencyError(ValueError):
+    pass
+
+
+def key_from(headers):
+    """Ключ из заголовка Idempotency-Key или None, если заголовка нет."""
+    key = (headers.get("Idempotency-Key") or "").strip()
+    if len(key) > KEY_MAX_LENGTH:
+        raise IdempotencyError("Заголовок Idempotency-Key длиннее %d символов" % KEY_MAX_LENGTH)
+    return key or None
+
+
+def fingerprint(data):
+    """Хеш тела запроса: тот же ключ с другим чеком — ошибка клиента, а не повтор."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")).hexdigest()
+
+
+def stored_response(row, endpoint, request_hash):
+    """Сохранённый ответ по строке idem_lookup; IdempotencyError, если ключ занят другим запросом."""
+    if not row or row[2] is None:
+        raise IdempotencyError("Запрос с этим Idempotency-Key ещё выполняется, повторите позже")
+    if row[0] != endpoint or row[1] != request_hash:
+        raise IdempotencyError("Idempotency-Key уже использован для другого запроса")
+    return row[2]
+
+
+def dump_response(body):
+    return json.dumps(body, ensure_ascii=False)
+
+
+def purge_expired(pool=None):
+    """Удаляет ключи старше IDEMPOTENCY_KEY_TTL_HOURS; возвращает число удалённых строк."""
+    db = Database(pool=pool or get_pool())
+    try:
+        with db.cursor() as cur:
+            cur.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'",
+                (IDEMPOTENCY_KEY_TTL_HOURS,),
+            )
+            return cur.rowcount
+    finally:
+        db.close()
@@ -63,6 +63,37 @@ def replace_table_names_in_sql(sql_content, prefix):
     return modified_sql
 
 
+# Сколько строк подряд идущих INSERT объединять в один многострочный INSERT
+IMPORT_BATCH_ROWS = 500
+
+_INSERT_RE = re.compile(r'^(INSERT\s+INTO\s+\S+\s*\([^)]*\)\s*VALUES)\s*(\(.*\))$', re.IGNORECASE | re.DOTALL)
+
+
+def group_inserts(commands, batch_rows=IMPORT_BATCH_ROWS):
+    """Объединяет подряд идущие INSERT в одну таблицу с одинаковым списком колонок.
+
+    Возвращает список пар (SQL, исходные команды): вместо запроса на каждую
+    строку выполняется один INSERT ... VALUES (...), (...) на пачку.
+    """
+    batches = []
+    head, values, originals = None, [], []
+    for cmd in commands:
+        m = _INSERT_RE.match(cmd)
+        key = ' '.join(m.group(1).split()) if m else None
+        if head is not None and (key != head or len(values) >= batch_rows):
+            batches.append((head + ' ' + ',\n'.join(values), originals))
+            head, values, originals = None, [], []
+        if key is None:
+            batches.append((cmd, [cmd]))
+            continue
+        head = key
+        values.append(m.group(2))
+        originals.append(cmd)
+    if head is not None:
+        batches.append((head + ' ' + ',\n'.join(values), originals))
+    return batches
+
+
 def main():
     if len(sys.argv) < 3:
         print("Использование: python import_to_prefixed_db.py <prefix> <export_file.sql>")
@@ -199,19 +230,36 @@ def main():
                 if lines:
                     commands.append('\n'.join(lines))
         
+        def run(cmd, i):
+            try:
+                db.execute(cmd, fetch=False)
+                return True
+            except Exception as e:
+                # Некоторые ошибки можно игнорировать
+                error_str = str(e).lower()
+                if "already exists" not in error_str and "duplicate" not in error_str:
+                    print(f"  Предупреждение при выполнении команды {i}: {e}")
+                return False
+        
         executed = 0
-        for i, cmd in enumerate(commands, 1):
-            if cmd.strip():
-                try:
-                    db.execute(cmd, fetch=False)
+        done = 0
+        for batch_sql, originals in group_inserts(commands):
+            if len(originals) == 1:
+                if run(batch_sql, done + 1):
                     executed += 1
-                    if i % 10 == 0:
-                        print(f"  Обработано команд: {i}/{len(commands)}")
-                except Exception as e:
-                    # Некоторые ошибки можно игнорировать
-                    error_str = str(e).lower()
-                    if "already exists" not in error_str and "duplicate" not in error_str:
-                        print(f"  Предупреждение при выполнении команды {i}: {e}")
+                done += 1
+                continue
+            try:
+                db.execute(batch_sql, fetch=False)
+                executed += len(originals)
+            except Exception:
+                # Пачка целиком откатилась: повторяем её по одной команде,
+                # чтобы ошибка в одной строке не потеряла остальные
+                for offset, cmd in enumerate(originals, 1):
+                    if run(cmd, done + offset):
+                        executed += 1
+            done += len(originals)
+            print(f"  Обработано команд: {done}/{len(commands)}")
         
         print(f"✓ Импортировано {executed} команд")
         
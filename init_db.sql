@@ -55,11 +55,23 @@ CREATE TABLE IF NOT EXISTS shifts (
     shift_start TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     shift_end TIMESTAMP WITH TIME ZONE,
     status VARCHAR(20) DEFAULT 'open',
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    sales_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_count INTEGER NOT NULL DEFAULT 0,
+    returns_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
     CONSTRAINT shift_duration_check CHECK (shift_end IS NULL OR shift_end > shift_start)
 );
 
+-- Операции и строки чеков разбиты на секции по месяцам created_at (их создаёт
+-- ensure_operation_partitions ниже). Ключи включают created_at, как того требует
+-- секционирование; строка чека хранит время своей операции. Перевод существующей
+-- базы с обычных таблиц: python operation_partitions.py
 CREATE TABLE IF NOT EXISTS operations (
-    id_operation SERIAL PRIMARY KEY,
+    id_operation SERIAL,
     operation_type VARCHAR(20) NOT NULL,
     shift_id INTEGER REFERENCES shifts(id_shift),
     employee_id INTEGER NOT NULL REFERENCES employees(id_employee),
@@ -69,20 +81,26 @@ CREATE TABLE IF NOT EXISTS operations (
     total_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
     total_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    original_operation_id INTEGER REFERENCES operations(id_operation)
-);
+    original_operation_id INTEGER,
+    PRIMARY KEY (id_operation, created_at)
+) PARTITION BY RANGE (created_at);
 
 CREATE TABLE IF NOT EXISTS operation_items (
-    id SERIAL PRIMARY KEY,
-    operation_id INTEGER NOT NULL REFERENCES operations(id_operation) ON DELETE CASCADE,
+    id SERIAL,
+    operation_id INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
     product_id INTEGER NOT NULL REFERENCES products(id_product),
     quantity INTEGER NOT NULL CHECK (quantity > 0),
     unit_price NUMERIC(12,2) NOT NULL,
     purchase_price NUMERIC(12,2) NOT NULL,
     total_price NUMERIC(12,2) NOT NULL,
     cost NUMERIC(12,2) NOT NULL,
-    profit NUMERIC(12,2) NOT NULL
-);
+    profit NUMERIC(12,2) NOT NULL,
+    returned_quantity INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id, created_at),
+    FOREIGN KEY (operation_id, created_at) REFERENCES operations(id_operation, created_at) ON DELETE CASCADE,
+    CONSTRAINT operation_items_returned_check CHECK (returned_quantity >= 0 AND returned_quantity <= quantity)
+) PARTITION BY RANGE (created_at);
 
 CREATE TABLE IF NOT EXISTS store_product_stock (
     store_id INTEGER NOT NULL REFERENCES stores(id_store),
@@ -116,8 +134,22 @@ CREATE TABLE IF NOT EXISTS notifications (
     )
 );
 
+-- Ключи Idempotency-Key продаж и возвратов: повтор запроса кассы возвращает сохранённый ответ
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    employee_id INTEGER NOT NULL REFERENCES employees(id_employee),
+    idem_key VARCHAR(200) NOT NULL,
+    endpoint VARCHAR(20) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    operation_id INTEGER,
+    response JSONB,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (employee_id, idem_key)
+);
+
 CREATE INDEX IF NOT EXISTS idx_shifts_employee_store ON shifts(employee_id, store_id);
 CREATE INDEX IF NOT EXISTS idx_shifts_end ON shifts(shift_end);
+-- Открытые смены: их перебирает фоновое закрытие просроченных смен (shift_events.close_expired)
+CREATE INDEX IF NOT EXISTS idx_shifts_open ON shifts(shift_start) WHERE shift_end IS NULL;
 DO $$
 BEGIN
   IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'operations' AND column_name = 'original_operation_id') THEN
@@ -126,9 +158,370 @@ BEGIN
 END $$;
 CREATE INDEX IF NOT EXISTS idx_operations_shift ON operations(shift_id);
 CREATE INDEX IF NOT EXISTS idx_operations_type ON operations(operation_type);
-CREATE INDEX IF NOT EXISTS idx_operations_created ON operations(created_at);
+DROP INDEX IF EXISTS idx_operations_created;
+CREATE INDEX IF NOT EXISTS idx_operations_created_id ON operations(created_at, id_operation);
 CREATE INDEX IF NOT EXISTS idx_operations_original ON operations(original_operation_id);
+CREATE INDEX IF NOT EXISTS idx_operations_store_type_created ON operations(store_id, operation_type, created_at);
+-- Месячные секции таблицы p_table с месяца p_from по месяц p_to (границы — по UTC)
+-- и секция по умолчанию для операций вне них (например, давних чеков из пакета
+-- терминала). Возвращает число созданных секций; обычную таблицу не трогает.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(p_table REGCLASS, p_from DATE, p_to DATE) RETURNS INTEGER AS $$
+DECLARE
+  base TEXT;
+  part TEXT;
+  m DATE := date_trunc('month', p_from)::date;
+  created INTEGER := 0;
+BEGIN
+  SELECT relname INTO base FROM pg_class WHERE oid = p_table AND relkind = 'p';
+  IF base IS NULL THEN
+    RETURN 0;
+  END IF;
+  IF to_regclass(quote_ident(base || '_default')) IS NULL THEN
+    BEGIN
+      EXECUTE 'CREATE TABLE ' || quote_ident(base || '_default') || ' PARTITION OF ' || p_table::text || ' DEFAULT';
+      created := created + 1;
+    EXCEPTION WHEN duplicate_table THEN
+      NULL;
+    END;
+  END IF;
+  WHILE m <= p_to LOOP
+    part := base || '_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM');
+    IF to_regclass(quote_ident(part)) IS NULL THEN
+      BEGIN
+        EXECUTE 'CREATE TABLE ' || quote_ident(part) || ' PARTITION OF ' || p_table::text
+             || ' FOR VALUES FROM (' || quote_literal(to_char(m, 'YYYY-MM-DD') || ' 00:00:00+00') || ')'
+             || ' TO (' || quote_literal(to_char(m + INTERVAL '1 month', 'YYYY-MM-DD') || ' 00:00:00+00') || ')';
+        created := created + 1;
+      EXCEPTION
+        WHEN duplicate_table THEN
+          NULL;
+        WHEN check_violation THEN
+          -- В секции по умолчанию уже есть строки этого месяца: месяц остаётся в ней
+          RAISE WARNING USING MESSAGE = 'секция ' || part || ' не создана: строки месяца уже в секции по умолчанию';
+      END;
+    END IF;
+    m := (m + INTERVAL '1 month')::date;
+  END LOOP;
+  RETURN created;
+END $$ LANGUAGE plpgsql;
+-- Секции operations и operation_items на текущий месяц и p_months_ahead следующих
+-- (вызывается здесь и фоновой задачей operation_partitions, jobs.py)
+CREATE OR REPLACE FUNCTION ensure_operation_partitions(p_months_ahead INTEGER) RETURNS INTEGER AS $$
+  SELECT ensure_monthly_partitions('operations'::regclass, today, (today + p_months_ahead * INTERVAL '1 month')::date)
+       + ensure_monthly_partitions('operation_items'::regclass, today, (today + p_months_ahead * INTERVAL '1 month')::date)
+  FROM (SELECT (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date AS today) AS t
+$$ LANGUAGE sql;
+SELECT ensure_operation_partitions(3);
 CREATE INDEX IF NOT EXISTS idx_store_stock_store ON store_product_stock(store_id);
 CREATE INDEX IF NOT EXISTS idx_store_stock_product ON store_product_stock(product_id);
 CREATE INDEX IF NOT EXISTS idx_wh_stock_warehouse ON warehouse_product_stock(warehouse_id);
 CREATE INDEX IF NOT EXISTS idx_wh_stock_product ON warehouse_product_stock(product_id);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at);
+-- Не больше одного непрочитанного уведомления о низком остатке на пару (магазин/склад, товар);
+-- дубли, созданные до этого ограничения, закрываются
+UPDATE notifications AS n SET status = 'resolved'
+FROM notifications AS m
+WHERE n.status = 'unread' AND m.status = 'unread' AND n.product_id = m.product_id
+  AND n.store_id IS NOT DISTINCT FROM m.store_id AND n.warehouse_id IS NOT DISTINCT FROM m.warehouse_id AND n.id < m.id;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_notifications_unread_key ON notifications (product_id, COALESCE(store_id, 0), COALESCE(warehouse_id, 0)) WHERE status = 'unread';
+-- Уведомление кэшей цен приложения (price_cache.py) об изменении товара.
+-- Канал — аргумент триггера: тот же, что PRICE_CACHE_CHANNEL в config.py
+CREATE OR REPLACE FUNCTION notify_product_prices() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify(TG_ARGV[0], OLD.id_product::text);
+  ELSE
+    PERFORM pg_notify(TG_ARGV[0], NEW.id_product::text);
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_products_notify_prices ON products;
+CREATE TRIGGER trg_products_notify_prices AFTER INSERT OR UPDATE OR DELETE ON products FOR EACH ROW EXECUTE FUNCTION notify_product_prices('product_prices');
+-- Уведомление потоков /api/shifts/events (shift_events.py) об открытии и закрытии смены.
+-- Канал — аргумент триггера: тот же, что SHIFT_EVENTS_CHANNEL в config.py
+CREATE OR REPLACE FUNCTION notify_shift_events() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' OR NEW.shift_end IS DISTINCT FROM OLD.shift_end THEN
+    PERFORM pg_notify(TG_ARGV[0], json_build_object(
+      'shift_id', NEW.id_shift, 'employee_id', NEW.employee_id, 'store_id', NEW.store_id, 'closed', NEW.shift_end IS NOT NULL
+    )::text);
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_shifts_notify ON shifts;
+CREATE TRIGGER trg_shifts_notify AFTER INSERT OR UPDATE OF shift_end ON shifts FOR EACH ROW EXECUTE FUNCTION notify_shift_events('shift_events');
+-- Уведомление кэшей сотрудников (auth_util.user_cache) об изменении или удалении
+-- сотрудника. Канал — аргумент триггера: тот же, что USER_CACHE_CHANNEL в config.py
+CREATE OR REPLACE FUNCTION notify_employee_changes() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify(TG_ARGV[0], OLD.id_employee::text);
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+-- Пустое уведомление в канал из аргумента триггера: слушатели сбрасывают кэш целиком
+CREATE OR REPLACE FUNCTION notify_reset() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify(TG_ARGV[0], '');
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_employees_notify_cache ON employees;
+CREATE TRIGGER trg_employees_notify_cache AFTER UPDATE OR DELETE ON employees FOR EACH ROW
+  EXECUTE FUNCTION notify_employee_changes('employee_changes');
+-- Название магазина входит в запись сотрудника
+DROP TRIGGER IF EXISTS trg_stores_notify_employees ON stores;
+CREATE TRIGGER trg_stores_notify_employees AFTER UPDATE OF name ON stores FOR EACH ROW
+  WHEN (OLD.name IS DISTINCT FROM NEW.name) EXECUTE FUNCTION notify_reset('employee_changes');
+-- Сколько по строке продажи уже возвращено: ведётся при оформлении возврата.
+-- Для существующих данных возвраты разносятся по строкам продажи того же товара в порядке id.
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'operation_items' AND column_name = 'returned_quantity') THEN
+    ALTER TABLE operation_items ADD COLUMN returned_quantity INTEGER NOT NULL DEFAULT 0;
+    UPDATE operation_items AS t
+    SET returned_quantity = LEAST(t.quantity, r.returned - l.sold_before)
+    FROM (
+      SELECT id, operation_id, product_id,
+             SUM(quantity) OVER (PARTITION BY operation_id, product_id ORDER BY id) - quantity AS sold_before
+      FROM operation_items
+    ) AS l
+    JOIN (
+      SELECT o.original_operation_id AS operation_id, oi.product_id, SUM(oi.quantity) AS returned
+      FROM operations AS o
+      JOIN operation_items AS oi ON oi.operation_id = o.id_operation
+      WHERE o.operation_type = 'return' AND o.original_operation_id IS NOT NULL
+      GROUP BY o.original_operation_id, oi.product_id
+    ) AS r ON r.operation_id = l.operation_id AND r.product_id = l.product_id
+    WHERE t.id = l.id AND r.returned > l.sold_before;
+    ALTER TABLE operation_items ADD CONSTRAINT operation_items_returned_check CHECK (returned_quantity >= 0 AND returned_quantity <= quantity);
+  END IF;
+END $$;
+-- Время операции в строках чека (ключ секций operation_items); для существующих строк — из operations
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'operation_items' AND column_name = 'created_at') THEN
+    ALTER TABLE operation_items ADD COLUMN created_at TIMESTAMP WITH TIME ZONE;
+    UPDATE operation_items AS oi SET created_at = o.created_at FROM operations AS o WHERE o.id_operation = oi.operation_id;
+    ALTER TABLE operation_items ALTER COLUMN created_at SET NOT NULL;
+  END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_operation_items_operation ON operation_items(operation_id);
+CREATE INDEX IF NOT EXISTS idx_operation_items_not_returned ON operation_items(operation_id) WHERE returned_quantity < quantity;
+-- Итоги смены (sales_*, returns_*) ведутся в транзакциях продажи и возврата.
+-- Для существующих смен они один раз считаются по операциям.
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'shifts' AND column_name = 'sales_count') THEN
+    ALTER TABLE shifts
+      ADD COLUMN sales_count INTEGER NOT NULL DEFAULT 0,
+      ADD COLUMN sales_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+      ADD COLUMN sales_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+      ADD COLUMN sales_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
+      ADD COLUMN returns_count INTEGER NOT NULL DEFAULT 0,
+      ADD COLUMN returns_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+      ADD COLUMN returns_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+      ADD COLUMN returns_profit NUMERIC(14,2) NOT NULL DEFAULT 0;
+    UPDATE shifts AS s
+    SET sales_count = t.sales_count, sales_revenue = t.sales_revenue, sales_cost = t.sales_cost, sales_profit = t.sales_profit,
+        returns_count = t.returns_count, returns_revenue = t.returns_revenue, returns_cost = t.returns_cost, returns_profit = t.returns_profit
+    FROM (
+      SELECT shift_id,
+             COUNT(*) FILTER (WHERE operation_type = 'sale') AS sales_count,
+             COALESCE(SUM(total_revenue) FILTER (WHERE operation_type = 'sale'), 0) AS sales_revenue,
+             COALESCE(SUM(total_cost) FILTER (WHERE operation_type = 'sale'), 0) AS sales_cost,
+             COALESCE(SUM(total_profit) FILTER (WHERE operation_type = 'sale'), 0) AS sales_profit,
+             COUNT(*) FILTER (WHERE operation_type = 'return') AS returns_count,
+             COALESCE(SUM(total_revenue) FILTER (WHERE operation_type = 'return'), 0) AS returns_revenue,
+             COALESCE(SUM(total_cost) FILTER (WHERE operation_type = 'return'), 0) AS returns_cost,
+             COALESCE(SUM(total_profit) FILTER (WHERE operation_type = 'return'), 0) AS returns_profit
+      FROM operations WHERE shift_id IS NOT NULL GROUP BY shift_id
+    ) AS t
+    WHERE s.id_shift = t.shift_id;
+  END IF;
+END $$;
+-- Z-отчёт: итоги и чеки смены, зафиксированные при её закрытии. Не изменяется.
+CREATE TABLE IF NOT EXISTS shift_reports (
+    shift_id INTEGER PRIMARY KEY REFERENCES shifts(id_shift),
+    employee_id INTEGER NOT NULL,
+    store_id INTEGER NOT NULL,
+    seller_name VARCHAR(300),
+    store_name VARCHAR(300),
+    shift_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    shift_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    sales_count INTEGER NOT NULL,
+    sales_revenue NUMERIC(14,2) NOT NULL,
+    sales_cost NUMERIC(14,2) NOT NULL,
+    sales_profit NUMERIC(14,2) NOT NULL,
+    returns_count INTEGER NOT NULL,
+    returns_revenue NUMERIC(14,2) NOT NULL,
+    returns_cost NUMERIC(14,2) NOT NULL,
+    returns_profit NUMERIC(14,2) NOT NULL,
+    receipts JSONB NOT NULL DEFAULT '[]',
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+-- Чеки смены для Z-отчёта: [id, время, выручка, себестоимость, прибыль, тип, id продажи для возврата]
+CREATE OR REPLACE FUNCTION shift_report_receipts(p_shift_id INTEGER) RETURNS JSONB AS $$
+  SELECT COALESCE(jsonb_agg(jsonb_build_array(
+           o.id_operation, o.created_at, o.total_revenue, o.total_cost, o.total_profit, o.operation_type, o.original_operation_id
+         ) ORDER BY o.created_at), '[]'::jsonb)
+  FROM operations o
+  WHERE o.shift_id = p_shift_id AND o.operation_type IN ('sale', 'return')
+$$ LANGUAGE sql STABLE;
+CREATE OR REPLACE FUNCTION snapshot_shift_report() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO shift_reports (shift_id, employee_id, store_id, seller_name, store_name, shift_start, shift_end,
+                             sales_count, sales_revenue, sales_cost, sales_profit,
+                             returns_count, returns_revenue, returns_cost, returns_profit, receipts)
+  VALUES (NEW.id_shift, NEW.employee_id, NEW.store_id,
+          (SELECT full_name FROM employees WHERE id_employee = NEW.employee_id),
+          (SELECT name FROM stores WHERE id_store = NEW.store_id),
+          NEW.shift_start, NEW.shift_end,
+          NEW.sales_count, NEW.sales_revenue, NEW.sales_cost, NEW.sales_profit,
+          NEW.returns_count, NEW.returns_revenue, NEW.returns_cost, NEW.returns_profit,
+          shift_report_receipts(NEW.id_shift))
+  ON CONFLICT (shift_id) DO NOTHING;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_shifts_snapshot ON shifts;
+CREATE TRIGGER trg_shifts_snapshot AFTER UPDATE OF shift_end ON shifts FOR EACH ROW
+  WHEN (OLD.shift_end IS NULL AND NEW.shift_end IS NOT NULL) EXECUTE FUNCTION snapshot_shift_report();
+CREATE OR REPLACE FUNCTION shift_reports_immutable() RETURNS trigger AS $$
+BEGIN
+  RAISE EXCEPTION USING MESSAGE = 'Z-отчёт смены ' || OLD.shift_id || ' нельзя изменить';
+END $$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_shift_reports_immutable ON shift_reports;
+CREATE TRIGGER trg_shift_reports_immutable BEFORE UPDATE ON shift_reports FOR EACH ROW EXECUTE FUNCTION shift_reports_immutable();
+-- Z-отчёты для смен, закрытых до появления таблицы
+INSERT INTO shift_reports (shift_id, employee_id, store_id, seller_name, store_name, shift_start, shift_end,
+                           sales_count, sales_revenue, sales_cost, sales_profit,
+                           returns_count, returns_revenue, returns_cost, returns_profit, receipts)
+SELECT s.id_shift, s.employee_id, s.store_id, e.full_name, st.name, s.shift_start, s.shift_end,
+       s.sales_count, s.sales_revenue, s.sales_cost, s.sales_profit,
+       s.returns_count, s.returns_revenue, s.returns_cost, s.returns_profit, shift_report_receipts(s.id_shift)
+FROM shifts s
+LEFT JOIN employees e ON e.id_employee = s.employee_id
+LEFT JOIN stores st ON st.id_store = s.store_id
+WHERE s.shift_end IS NOT NULL AND NOT EXISTS (SELECT 1 FROM shift_reports r WHERE r.shift_id = s.id_shift)
+ON CONFLICT (shift_id) DO NOTHING;
+-- Сводные итоги продаж и возвратов по дням (sales_rollup.py): магазин × день и товар × магазин × день.
+-- День — дата операции в часовом поясе магазинов (STORE_TIMEZONE).
+CREATE TABLE IF NOT EXISTS sales_daily_store (
+    day DATE NOT NULL,
+    store_id INTEGER NOT NULL REFERENCES stores(id_store),
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    sales_quantity INTEGER NOT NULL DEFAULT 0,
+    sales_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_count INTEGER NOT NULL DEFAULT 0,
+    returns_quantity INTEGER NOT NULL DEFAULT 0,
+    returns_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, store_id)
+);
+CREATE TABLE IF NOT EXISTS sales_daily_product (
+    day DATE NOT NULL,
+    store_id INTEGER NOT NULL REFERENCES stores(id_store),
+    product_id INTEGER NOT NULL REFERENCES products(id_product),
+    sales_quantity INTEGER NOT NULL DEFAULT 0,
+    sales_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+    sales_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_quantity INTEGER NOT NULL DEFAULT 0,
+    returns_revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_cost NUMERIC(14,2) NOT NULL DEFAULT 0,
+    returns_profit NUMERIC(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, store_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sales_daily_product_product ON sales_daily_product(product_id, day);
+-- Добавляет к сводным таблицам операции (p_operation_ids, p_created_at) — продажи и возвраты.
+-- Время операции вместе с id позволяет читать только секции этих операций.
+-- Вызывается в транзакции чека и при перестроении; строки товаров
+-- обновляются в порядке ключа, чтобы параллельные чеки не взаимоблокировались.
+DROP FUNCTION IF EXISTS sales_rollup_add(INTEGER[], TEXT);
+CREATE OR REPLACE FUNCTION sales_rollup_add(p_operation_ids INTEGER[], p_created_at TIMESTAMP WITH TIME ZONE[], p_timezone TEXT) RETURNS VOID AS $$
+  INSERT INTO sales_daily_store AS t (day, store_id,
+                                      sales_count, sales_quantity, sales_revenue, sales_cost, sales_profit,
+                                      returns_count, returns_quantity, returns_revenue, returns_cost, returns_profit)
+  SELECT (o.created_at AT TIME ZONE COALESCE(NULLIF(p_timezone, ''), current_setting('TimeZone')))::date, o.store_id,
+         COUNT(*) FILTER (WHERE o.operation_type = 'sale'),
+         COALESCE(SUM(q.quantity) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(o.total_revenue) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(o.total_cost) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(o.total_profit) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COUNT(*) FILTER (WHERE o.operation_type = 'return'),
+         COALESCE(SUM(q.quantity) FILTER (WHERE o.operation_type = 'return'), 0),
+         COALESCE(SUM(o.total_revenue) FILTER (WHERE o.operation_type = 'return'), 0),
+         COALESCE(SUM(o.total_cost) FILTER (WHERE o.operation_type = 'return'), 0),
+         COALESCE(SUM(o.total_profit) FILTER (WHERE o.operation_type = 'return'), 0)
+  FROM unnest(p_operation_ids, p_created_at) AS k(id_operation, created_at)
+  JOIN operations o ON o.id_operation = k.id_operation AND o.created_at = k.created_at
+  CROSS JOIN LATERAL (
+    SELECT COALESCE(SUM(oi.quantity), 0) AS quantity FROM operation_items oi
+    WHERE oi.operation_id = o.id_operation AND oi.created_at = o.created_at
+  ) q
+  WHERE o.operation_type IN ('sale', 'return')
+  GROUP BY 1, 2
+  ORDER BY 1, 2
+  ON CONFLICT (day, store_id) DO UPDATE SET
+    sales_count = t.sales_count + EXCLUDED.sales_count, sales_quantity = t.sales_quantity + EXCLUDED.sales_quantity,
+    sales_revenue = t.sales_revenue + EXCLUDED.sales_revenue, sales_cost = t.sales_cost + EXCLUDED.sales_cost,
+    sales_profit = t.sales_profit + EXCLUDED.sales_profit,
+    returns_count = t.returns_count + EXCLUDED.returns_count, returns_quantity = t.returns_quantity + EXCLUDED.returns_quantity,
+    returns_revenue = t.returns_revenue + EXCLUDED.returns_revenue, returns_cost = t.returns_cost + EXCLUDED.returns_cost,
+    returns_profit = t.returns_profit + EXCLUDED.returns_profit;
+  INSERT INTO sales_daily_product AS t (day, store_id, product_id,
+                                        sales_quantity, sales_revenue, sales_cost, sales_profit,
+                                        returns_quantity, returns_revenue, returns_cost, returns_profit)
+  SELECT (o.created_at AT TIME ZONE COALESCE(NULLIF(p_timezone, ''), current_setting('TimeZone')))::date, o.store_id, oi.product_id,
+         COALESCE(SUM(oi.quantity) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(oi.total_price) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(oi.cost) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(oi.profit) FILTER (WHERE o.operation_type = 'sale'), 0),
+         COALESCE(SUM(oi.quantity) FILTER (WHERE o.operation_type = 'return'), 0),
+         COALESCE(SUM(oi.total_price) FILTER (WHERE o.operation_type = 'return'), 0),
+         COALESCE(SUM(oi.cost) FILTER (WHERE o.operation_type = 'return'), 0),
+         COALESCE(SUM(oi.profit) FILTER (WHERE o.operation_type = 'return'), 0)
+  FROM unnest(p_operation_ids, p_created_at) AS k(id_operation, created_at)
+  JOIN operations o ON o.id_operation = k.id_operation AND o.created_at = k.created_at
+  JOIN operation_items oi ON oi.operation_id = o.id_operation AND oi.created_at = o.created_at
+  WHERE o.operation_type IN ('sale', 'return')
+  GROUP BY 1, 2, 3
+  ORDER BY 1, 2, 3
+  ON CONFLICT (day, store_id, product_id) DO UPDATE SET
+    sales_quantity = t.sales_quantity + EXCLUDED.sales_quantity, sales_revenue = t.sales_revenue + EXCLUDED.sales_revenue,
+    sales_cost = t.sales_cost + EXCLUDED.sales_cost, sales_profit = t.sales_profit + EXCLUDED.sales_profit,
+    returns_quantity = t.returns_quantity + EXCLUDED.returns_quantity, returns_revenue = t.returns_revenue + EXCLUDED.returns_revenue,
+    returns_cost = t.returns_cost + EXCLUDED.returns_cost, returns_profit = t.returns_profit + EXCLUDED.returns_profit;
+$$ LANGUAGE sql;
+-- Первое заполнение сводных таблиц (в часовом поясе сессии; при другом
+-- STORE_TIMEZONE перестройте их: flask rebuild-rollups)
+SELECT sales_rollup_add(array_agg(id_operation), array_agg(created_at), '')
+FROM operations
+WHERE NOT EXISTS (SELECT 1 FROM sales_daily_store);
+-- Уведомление кэшей отчётов (report_cache.py) об изменении сводки за день и
+-- магазин: приходит после фиксации каждого чека продажи, пакета и возврата.
+-- Канал — аргумент триггера: тот же, что REPORT_CACHE_CHANNEL в config.py
+CREATE OR REPLACE FUNCTION notify_report_changes() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    PERFORM pg_notify(TG_ARGV[0], to_char(OLD.day, 'YYYY-MM-DD') || ':' || OLD.store_id);
+  ELSE
+    PERFORM pg_notify(TG_ARGV[0], to_char(NEW.day, 'YYYY-MM-DD') || ':' || NEW.store_id);
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+-- Пустое уведомление (notify_reset) сбрасывает кэш отчётов целиком: переименование
+-- магазина, сотрудника или товара меняет все отчёты с ними, TRUNCATE — всю сводку
+DROP TRIGGER IF EXISTS trg_sales_daily_store_notify ON sales_daily_store;
+CREATE TRIGGER trg_sales_daily_store_notify AFTER INSERT OR UPDATE OR DELETE ON sales_daily_store FOR EACH ROW EXECUTE FUNCTION notify_report_changes('report_changes');
+DROP TRIGGER IF EXISTS trg_sales_daily_store_reset ON sales_daily_store;
+CREATE TRIGGER trg_sales_daily_store_reset AFTER TRUNCATE ON sales_daily_store FOR EACH STATEMENT EXECUTE FUNCTION notify_reset('report_changes');
+DROP TRIGGER IF EXISTS trg_stores_notify_reports ON stores;
+CREATE TRIGGER trg_stores_notify_reports AFTER UPDATE OF name ON stores FOR EACH ROW
+  WHEN (OLD.name IS DISTINCT FROM NEW.name) EXECUTE FUNCTION notify_reset('report_changes');
+DROP TRIGGER IF EXISTS trg_employees_notify_reports ON employees;
+CREATE TRIGGER trg_employees_notify_reports AFTER UPDATE OF full_name ON employees FOR EACH ROW
+  WHEN (OLD.full_name IS DISTINCT FROM NEW.full_name) EXECUTE FUNCTION notify_reset('report_changes');
+DROP TRIGGER IF EXISTS trg_products_notify_reports ON products;
+CREATE TRIGGER trg_products_notify_reports AFTER UPDATE OF name ON products FOR EACH ROW
+  WHEN (OLD.name IS DISTINCT FROM NEW.name) EXECUTE FUNCTION notify_reset('report_changes');
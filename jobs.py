@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Периодические фоновые задачи процесса.
+
+Задача регистрируется через every(); start() запускает по одному потоку-демону
+на задачу (вызывается из app.bootstrap, повторный вызов ничего не делает).
+Каждый процесс сервера выполняет свои задачи сам, поэтому они должны быть
+безопасны при параллельном запуске в нескольких процессах.
+"""
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_jobs = []
+_lock = threading.Lock()
+_stop = threading.Event()
+_started = {"done": False}
+
+
+def every(name, interval, func):
+    """Регистрирует func() для запуска раз в interval секунд; interval <= 0 — задача выключена."""
+    if interval and interval > 0:
+        _jobs.append((name, float(interval), func))
+
+
+def _run(name, interval, func):
+    while not _stop.wait(interval):
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            logger.warning("job %s failed: %s", name, e)
+            continue
+        logger.info("job %s done in %.1f ms: %s", name, (time.perf_counter() - started) * 1000, result)
+
+
+def start():
+    with _lock:
+        if _started["done"]:
+            return
+        _started["done"] = True
+        for name, interval, func in _jobs:
+            threading.Thread(target=_run, args=(name, interval, func), name="job-" + name, daemon=True).start()
+
+
+def stop():
+    _stop.set()
+
+
+def status():
+    return [{"name": name, "interval": interval} for name, interval, _func in _jobs] if _started["done"] else []
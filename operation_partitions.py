@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Секции таблиц operations и operation_items по месяцам created_at.
+
+Обе таблицы разбиты на секции по месяцам (границы — по UTC) и секцию по
+умолчанию; строка чека хранит время своей операции, поэтому запросы с
+условием на created_at читают только секции нужных месяцев. Секции на текущий
+месяц и OPERATION_PARTITIONS_AHEAD_MONTHS следующих создаёт функция
+ensure_operation_partitions из init_db.sql — при выполнении init_db.sql и
+фоновой задачей ensure (jobs.py), так что секция месяца появляется заранее.
+
+В базе, созданной до секционирования, это обычные таблицы: init_db.sql их не
+перестраивает, а приложение работает с обеими схемами. Перевод на секции
+(таблицы блокируются на время переноса данных):
+    python operation_partitions.py [префикс]
+Префикс — тот же, что у create_prefixed_schema.py.
+"""
+import sys
+
+from psycopg2 import sql
+
+from auth_util import get_pool
+from config import OPERATION_PARTITIONS_AHEAD_MONTHS
+from database import Database
+
+
+def ensure(pool=None):
+    """Создаёт недостающие секции на ближайшие месяцы; возвращает число созданных."""
+    db = Database(pool=pool or get_pool())
+    try:
+        row = db.execute_one("SELECT ensure_operation_partitions(%s)", (OPERATION_PARTITIONS_AHEAD_MONTHS,))
+    finally:
+        db.close()
+    return row[0] if row else 0
+
+
+def is_partitioned(db, table="operations"):
+    """True — таблица разбита на секции, False — обычная, None — таблицы нет."""
+    row = db.execute_one("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    return None if not row else row[0] == "p"
+
+
+def _name(prefix, name):
+    return f"{prefix}_{name}" if prefix else name
+
+
+def _init_sql(prefix):
+    with open("init_db.sql", encoding="utf-8") as f:
+        text = f.read()
+    if prefix:
+        from create_prefixed_schema import add_prefix_to_sql
+        text = add_prefix_to_sql(text, prefix)
+    return text
+
+
+def _retire(cur, table):
+    """Переименовывает таблицу в <table>_legacy и освобождает имена её ключей, индексов и последовательностей."""
+    legacy = table + "_legacy"
+    cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(legacy)))
+    cur.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f', 'c')", (legacy,))
+    for (name,) in cur.fetchall():
+        cur.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT IF EXISTS {} CASCADE").format(sql.Identifier(legacy), sql.Identifier(name)))
+    cur.execute(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = %s::regclass",
+        (legacy,),
+    )
+    for (name,) in cur.fetchall():
+        cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+    cur.execute(
+        """SELECT s.relname FROM pg_depend d JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+           WHERE d.refobjid = %s::regclass AND d.deptype = 'a'""",
+        (legacy,),
+    )
+    for (name,) in cur.fetchall():
+        cur.execute(sql.SQL("ALTER SEQUENCE {} RENAME TO {}").format(sql.Identifier(name), sql.Identifier(name + "_legacy")))
+
+
+def _copy(cur, table):
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position",
+        (table,),
+    )
+    columns = sql.SQL(", ").join(sql.Identifier(r[0]) for r in cur.fetchall())
+    cur.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+        sql.Identifier(table), columns, columns, sql.Identifier(table + "_legacy")))
+    return cur.rowcount
+
+
+def migrate(db, prefix=""):
+    """Переводит обычные operations и operation_items на секции в одной транзакции.
+
+    Старые таблицы сначала доводятся до текущей схемы выполнением init_db.sql,
+    затем переименовываются, тот же init_db.sql создаёт секционированные
+    таблицы, и данные переносятся в секции их месяцев. Возвращает (операций,
+    строк чеков) или None, если таблицы уже разбиты на секции.
+    """
+    ops, items = _name(prefix, "operations"), _name(prefix, "operation_items")
+    state = is_partitioned(db, ops)
+    if state is None:
+        raise ValueError("Нет таблицы %s: сначала выполните init_db.sql" % ops)
+    if state:
+        return None
+    init_sql = _init_sql(prefix)
+    ensure_partitions = sql.Identifier(_name(prefix, "ensure_monthly_partitions"))
+    with db.cursor() as cur:
+        cur.execute(init_sql)
+        cur.execute(sql.SQL("LOCK TABLE {}, {} IN ACCESS EXCLUSIVE MODE").format(sql.Identifier(ops), sql.Identifier(items)))
+        for table in (items, ops):
+            _retire(cur, table)
+        cur.execute(init_sql)
+        cur.execute(
+            sql.SQL("""SELECT {f}(%s::regclass, d.first_day, d.last_day), {f}(%s::regclass, d.first_day, d.last_day)
+                       FROM (SELECT (MIN(created_at) AT TIME ZONE 'UTC')::date AS first_day,
+                                    (MAX(created_at) AT TIME ZONE 'UTC')::date AS last_day FROM {legacy}) AS d""").format(
+                f=ensure_partitions, legacy=sql.Identifier(ops + "_legacy")),
+            (ops, items),
+        )
+        counts = tuple(_copy(cur, table) for table in (ops, items))
+        for table, column in ((ops, "id_operation"), (items, "id")):
+            cur.execute(
+                sql.SQL("SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(MAX({}), 0) + 1, false) FROM {}").format(
+                    sql.Identifier(column), sql.Identifier(table)),
+                (table, column),
+            )
+        cur.execute(sql.SQL("DROP TABLE {}, {}").format(sql.Identifier(items + "_legacy"), sql.Identifier(ops + "_legacy")))
+    for table in (ops, items):
+        db.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)), fetch=False)
+    return counts
+
+
+def main():
+    prefix = sys.argv[1].strip() if len(sys.argv) > 1 else ""
+    table = _name(prefix, "operations")
+    print(f"Перевод {table} и {_name(prefix, 'operation_items')} на секции по месяцам...")
+    db = Database()
+    try:
+        counts = migrate(db, prefix)
+    except ValueError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+    if counts is None:
+        print("✓ Таблицы уже разбиты на секции")
+    else:
+        print(f"✓ Перенесено операций: {counts[0]}, строк чеков: {counts[1]}")
+
+
+if __name__ == "__main__":
+    main()
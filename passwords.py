@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Проверка и хеширование паролей в отдельном пуле процессов.
+
+Проверка pbkdf2 занимает десятки миллисекунд процессора и держит GIL, поэтому
+при массовом входе продавцов в начале смены она выносится в пул процессов
+(PASSWORD_HASH_WORKERS). Очередь ограничена (PASSWORD_HASH_QUEUE): если
+заданий больше, verify_password сразу бросает PasswordPoolBusy, и вход
+отвечает «сервер занят, повторите».
+
+Если параметры хеша (PASSWORD_HASH_METHOD) изменились, при успешном входе
+пароль перехешируется в том же процессе пула: новый хеш возвращается вызывающему,
+и тот сохраняет его. Отдельная миграция для этого не нужна.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config import PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE, PASSWORD_HASH_TIMEOUT
+
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordPoolBusy(RuntimeError):
+    pass
+
+
+_lock = threading.Lock()
+_state = {"executor": None, "slots": None, "workers": PASSWORD_HASH_WORKERS, "queue": PASSWORD_HASH_QUEUE}
+
+
+def hash_method(pwhash):
+    """Метод с параметрами из сохранённого хеша, например pbkdf2:sha256:1000000."""
+    return (pwhash or "").split("$", 1)[0]
+
+
+_canonical = {}
+
+
+def _canonical_for(method):
+    # werkzeug дописывает к методу параметры по умолчанию; чтобы сравнивать
+    # с сохранёнными хешами, берём их из пробного хеша (один раз на процесс).
+    if method not in _canonical:
+        _canonical[method] = hash_method(generate_password_hash("", method=method))
+    return _canonical[method]
+
+
+def _verify(pwhash, password, method):
+    """Выполняется в процессе пула: (пароль верен, новый хеш или None)."""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if hash_method(pwhash) != _canonical_for(method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+def configure(workers=None, queue=None):
+    """Пересоздаёт пул с другими размерами (используется бенчмарком)."""
+    shutdown()
+    with _lock:
+        if workers is not None:
+            _state["workers"] = workers
+        if queue is not None:
+            _state["queue"] = queue
+
+
+def _executor():
+    with _lock:
+        if _state["executor"] is None and _state["workers"] > 0:
+            if multiprocessing.current_process().daemon:
+                # Процессы-демоны (например, рабочие процессы hypercorn) не могут
+                # запускать дочерние; pbkdf2 в hashlib отпускает GIL, так что
+                # пул потоков с той же очередью тоже не блокирует обработку запросов.
+                logger.info("daemon process: verifying passwords in a thread pool")
+                _state["executor"] = ThreadPoolExecutor(max_workers=_state["workers"])
+            else:
+                _state["executor"] = ProcessPoolExecutor(max_workers=_state["workers"])
+            # Занято слотов = выполняется + ждёт в очереди
+            _state["slots"] = threading.BoundedSemaphore(_state["workers"] + _state["queue"])
+        return _state["executor"], _state["slots"]
+
+
+def verify_password(pwhash, password):
+    """Проверяет пароль; возвращает (верен ли, новый хеш для сохранения или None).
+
+    Бросает PasswordPoolBusy, если очередь пула заполнена или ответ не пришёл
+    за PASSWORD_HASH_TIMEOUT секунд.
+    """
+    if not pwhash:
+        return False, None
+    executor, slots = _executor()
+    if executor is None:
+        return _verify(pwhash, password, PASSWORD_HASH_METHOD)
+    if not slots.acquire(blocking=False):
+        raise PasswordPoolBusy("Очередь проверки паролей заполнена")
+    try:
+        future = executor.submit(_verify, pwhash, password, PASSWORD_HASH_METHOD)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _f: slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        raise PasswordPoolBusy("Проверка пароля не уложилась в %s с" % PASSWORD_HASH_TIMEOUT)
+
+
+def shutdown():
+    with _lock:
+        executor = _state["executor"]
+        _state["executor"] = _state["slots"] = None
+    if executor is not None:
+        executor.shutdown(wait=True)
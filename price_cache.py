@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Кэш цен товаров в памяти процесса для расчёта чеков продажи и возврата.
+
+Цены меняются редко, а читаются на каждом чеке. Кэш хранит для каждого товара
+розничную и закупочную цену в копейках в заранее выделенных массивах
+(array("q")) на PRICE_CACHE_SIZE товаров; при переполнении вытесняется давно
+не использованный товар (алгоритм CLOCK — приближение LRU с одним битом
+обращения на ячейку). Кэш заполняется целиком при старте и дозаполняется
+товарами, которых в нём не оказалось.
+
+Любое изменение products (в том числе вне приложения) триггер
+trg_products_notify_prices сообщает через NOTIFY в канал PRICE_CACHE_CHANNEL.
+Поток-слушатель каждого процесса сбрасывает по нему записи товаров. Пока
+слушатель не подключён (при старте, после обрыва связи), кэш не используется
+и цены читаются из БД: пропущенное уведомление не может оставить старую цену.
+"""
+import logging
+import select
+import threading
+import time
+from array import array
+
+import psycopg2
+
+from config import PRICE_CACHE_SIZE, PRICE_CACHE_CHANNEL
+from database import db_params_from_env
+
+
+logger = logging.getLogger(__name__)
+
+
+def _cents(value):
+    return int(round(value * 100))
+
+
+class PriceCache:
+    def __init__(self, capacity):
+        self.capacity = max(0, int(capacity))
+        self._slots = {}                              # product_id -> ячейка
+        self._ids = array("q", [0]) * self.capacity
+        self._retail = array("q", [0]) * self.capacity
+        self._purchase = array("q", [0]) * self.capacity
+        self._ref = bytearray(self.capacity)          # бит обращения CLOCK
+        self._free = []
+        self._used = 0
+        self._hand = 0
+        self._lock = threading.Lock()
+        self.enabled = False
+        # Растёт при каждом сбросе: put_many() не сохраняет цены, прочитанные
+        # из БД до сброса, иначе в кэш могла бы вернуться старая цена.
+        self.generation = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get_many(self, product_ids):
+        """({product_id: (розничная, закупочная)}, товары не из кэша, поколение для put_many)."""
+        found, missing = {}, []
+        with self._lock:
+            if not self.enabled:
+                return found, list(set(product_ids)), self.generation
+            for pid in set(product_ids):
+                slot = self._slots.get(pid)
+                if slot is None:
+                    missing.append(pid)
+                    continue
+                self._ref[slot] = 1
+                found[pid] = (self._retail[slot] / 100, self._purchase[slot] / 100)
+            self.hits += len(found)
+            self.misses += len(missing)
+            return found, missing, self.generation
+
+    def put_many(self, rows, generation):
+        """Сохраняет строки (product_id, розничная, закупочная), прочитанные из БД в поколении generation."""
+        with self._lock:
+            if not self.enabled or generation != self.generation or not self.capacity:
+                return
+            for pid, retail, purchase in rows:
+                slot = self._slots.get(pid)
+                if slot is None:
+                    slot = self._take_slot()
+                    self._slots[pid] = slot
+                    self._ids[slot] = pid
+                self._retail[slot] = _cents(retail)
+                self._purchase[slot] = _cents(purchase)
+                self._ref[slot] = 1
+
+    def _take_slot(self):
+        if self._free:
+            return self._free.pop()
+        if self._used < self.capacity:
+            self._used += 1
+            return self._used - 1
+        # Все ячейки заняты: стрелка снимает биты обращения, пока не найдёт ячейку без него
+        while self._ref[self._hand]:
+            self._ref[self._hand] = 0
+            self._hand = (self._hand + 1) % self.capacity
+        slot = self._hand
+        self._hand = (self._hand + 1) % self.capacity
+        del self._slots[self._ids[slot]]
+        self.evictions += 1
+        return slot
+
+    def invalidate(self, product_ids=None):
+        """Сбрасывает записи товаров; без аргумента — весь кэш."""
+        with self._lock:
+            self.generation += 1
+            if product_ids is None:
+                self._slots.clear()
+                self._free = []
+                self._used = self._hand = 0
+                self._ref[:] = bytes(self.capacity)
+                return
+            for pid in product_ids:
+                slot = self._slots.pop(pid, None)
+                if slot is not None:
+                    self._ref[slot] = 0
+                    self._free.append(slot)
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+        if not enabled:
+            self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled, "capacity": self.capacity, "size": len(self._slots),
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            }
+
+
+cache = PriceCache(PRICE_CACHE_SIZE)
+_listener = {"thread": None}
+
+
+def _load(cur):
+    cache.set_enabled(True)
+    generation = cache.generation
+    cur.execute(
+        "SELECT id_product, retail_price, purchase_price FROM products WHERE is_active = TRUE ORDER BY id_product LIMIT %s",
+        (cache.capacity,),
+    )
+    cache.put_many(cur.fetchall(), generation)
+
+
+def _listen():
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**db_params_from_env())
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("LISTEN " + PRICE_CACHE_CHANNEL)
+            # Загрузка после LISTEN: изменения, сделанные во время загрузки, придут уведомлениями
+            _load(cur)
+            logger.info("price cache loaded: %d products", cache.stats()["size"])
+            backoff = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                changed = []
+                while conn.notifies:
+                    payload = conn.notifies.pop(0).payload
+                    if not payload.isdigit():
+                        changed = None
+                        break
+                    changed.append(int(payload))
+                conn.notifies.clear()
+                if changed is None or changed:
+                    cache.invalidate(changed)
+        except Exception as e:
+            cache.set_enabled(False)
+            logger.warning("price cache listener disconnected, retry in %d s: %s", backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start():
+    """Запускает слушатель уведомлений (один на процесс); до его подключения кэш выключен."""
+    if not cache.capacity or _listener["thread"] is not None:
+        return
+    _listener["thread"] = threading.Thread(target=_listen, name="price-cache", daemon=True)
+    _listener["thread"].start()
+
+
+def lookup(product_ids, fetch):
+    """Цены товаров {product_id: (розничная, закупочная)}.
+
+    fetch(недостающие id) читает строки (product_id, розничная, закупочная) из БД
+    и вызывается, только если в кэше есть не все товары.
+    """
+    prices, missing, generation = cache.get_many(product_ids)
+    if missing:
+        rows = fetch(missing) or []
+        cache.put_many(rows, generation)
+        prices.update((r[0], (r[1], r[2])) for r in rows)
+    return prices
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Учёт SQL-запросов по HTTP-запросам: число, время, медленные запросы и признаки N+1."""
+import json
+import logging
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import g, request, has_request_context
+
+from config import SQL_STATS_ENABLED, SQL_SLOW_QUERY_MS, SQL_N_PLUS_ONE_THRESHOLD
+from database import add_query_listener
+
+logger = logging.getLogger("sql")
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_PARAM = re.compile(r"%s|\$\d+")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_SPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_endpoints = {}
+_statements = {}
+_totals = {"slow_queries": 0, "n_plus_one": 0}
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(query):
+    """Приводит запрос к общему виду: литералы и параметры заменяются на ?, пробелы схлопываются."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    q = _RE_STRING.sub("?", str(query))
+    q = _RE_PARAM.sub("?", q)
+    q = _RE_NUMBER.sub("?", q)
+    q = _RE_LIST.sub("(?)", q)
+    return _RE_SPACE.sub(" ", q).strip()
+
+
+def _on_query(query, seconds):
+    norm = normalize_sql(query)
+    slow = seconds * 1000 >= SQL_SLOW_QUERY_MS
+    with _lock:
+        st = _statements.setdefault(norm, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+        st["calls"] += 1
+        st["seconds"] += seconds
+        if seconds > st["max_seconds"]:
+            st["max_seconds"] = seconds
+        if slow:
+            _totals["slow_queries"] += 1
+    endpoint = None
+    if has_request_context():
+        endpoint = request.endpoint
+        stats = g.get("sql_stats")
+        if stats is not None:
+            stats["queries"] += 1
+            stats["seconds"] += seconds
+            per = stats["by_statement"].setdefault(norm, [0, 0.0])
+            per[0] += 1
+            per[1] += seconds
+    if slow:
+        logger.warning("slow query %.1f ms (%s): %s", seconds * 1000, endpoint or "-", norm)
+
+
+def _before_request():
+    g.sql_stats = {"queries": 0, "seconds": 0.0, "by_statement": {}, "started": time.perf_counter()}
+
+
+def _after_request(response):
+    stats = g.get("sql_stats")
+    if stats is not None:
+        stats["status"] = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    stats = g.pop("sql_stats", None)
+    if stats is None or request.endpoint in (None, "static"):
+        return
+    endpoint = request.endpoint
+    repeated = {
+        norm: per[0] for norm, per in stats["by_statement"].items()
+        if per[0] > SQL_N_PLUS_ONE_THRESHOLD
+    }
+    with _lock:
+        ep = _endpoints.setdefault(endpoint, {"requests": 0, "queries": 0, "seconds": 0.0, "n_plus_one": 0})
+        ep["requests"] += 1
+        ep["queries"] += stats["queries"]
+        ep["seconds"] += stats["seconds"]
+        if repeated:
+            ep["n_plus_one"] += 1
+            _totals["n_plus_one"] += 1
+    for norm, count in repeated.items():
+        logger.warning("possible N+1 in %s: statement ran %d times: %s", endpoint, count, norm)
+    logger.info(json.dumps({
+        "endpoint": endpoint,
+        "method": request.method,
+        "path": request.path,
+        "status": stats.get("status", 500 if exc else None),
+        "queries": stats["queries"],
+        "sql_ms": round(stats["seconds"] * 1000, 2),
+        "request_ms": round((time.perf_counter() - stats["started"]) * 1000, 2),
+        "statements": len(stats["by_statement"]),
+    }, ensure_ascii=False))
+
+
+def init_app(app):
+    if not SQL_STATS_ENABLED:
+        return
+    add_query_listener(_on_query)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def _label(value):
+    value = str(value)[:300]
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", " ")
+
+
+def render_prometheus(pool_stats=None):
+    """Счётчики в текстовом формате Prometheus."""
+    with _lock:
+        endpoints = {k: dict(v) for k, v in _endpoints.items()}
+        statements = {k: dict(v) for k, v in _statements.items()}
+        totals = dict(_totals)
+    lines = []
+
+    def family(name, kind, samples, fmt):
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            lines.append(("%s{%s} " + fmt) % (name, labels, value))
+
+    ep_labels = [('endpoint="%s"' % _label(name), ep) for name, ep in sorted(endpoints.items())]
+    family("app_http_requests_total", "counter", [(l, ep["requests"]) for l, ep in ep_labels], "%d")
+    family("app_sql_queries_total", "counter", [(l, ep["queries"]) for l, ep in ep_labels], "%d")
+    family("app_sql_seconds_total", "counter", [(l, ep["seconds"]) for l, ep in ep_labels], "%.6f")
+    family("app_sql_n_plus_one_requests_total", "counter", [(l, ep["n_plus_one"]) for l, ep in ep_labels], "%d")
+    st_labels = [('statement="%s"' % _label(norm), st) for norm, st in sorted(statements.items())]
+    family("app_sql_statement_calls_total", "counter", [(l, st["calls"]) for l, st in st_labels], "%d")
+    family("app_sql_statement_seconds_total", "counter", [(l, st["seconds"]) for l, st in st_labels], "%.6f")
+    family("app_sql_statement_max_seconds", "gauge", [(l, st["max_seconds"]) for l, st in st_labels], "%.6f")
+    lines += [
+        "# TYPE app_sql_slow_queries_total counter",
+        "app_sql_slow_queries_total %d" % totals["slow_queries"],
+        "# TYPE app_sql_n_plus_one_total counter",
+        "app_sql_n_plus_one_total %d" % totals["n_plus_one"],
+    ]
+    if pool_stats:
+        for key in ("in_use", "idle", "waiting", "max_size"):
+            lines.append("# TYPE app_db_pool_%s gauge" % key)
+            lines.append("app_db_pool_%s %d" % (key, pool_stats[key]))
+        for key in ("checkouts", "connections_created", "connections_closed", "wait_timeouts", "health_check_failures"):
+            lines.append("# TYPE app_db_pool_%s_total counter" % key)
+            lines.append("app_db_pool_%s_total %d" % (key, pool_stats[key]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Кэш ответов отчётов администратора в памяти процесса.
+
+Страницы отчётов раз за разом запрашивают одни и те же /api/reports/... с
+одним и тем же периодом. Ответ запоминается по маршруту и параметрам запроса
+(пустые параметры отбрасываются, порядок не важен) вместе с его областью —
+днями date_from..date_to и магазином store_id.
+
+Любое изменение сводки sales_daily_store, то есть каждый проведённый чек
+продажи, пакет и возврат, триггер trg_sales_daily_store_notify сообщает через
+NOTIFY в канал REPORT_CACHE_CHANNEL после фиксации транзакции: "ГГГГ-ММ-ДД:магазин".
+Поток-слушатель каждого процесса увеличивает версию данных и сбрасывает
+только ответы, в область которых попадает этот день и магазин. Пустое
+уведомление (переименование магазина, сотрудника или товара, TRUNCATE
+сводки) сбрасывает весь кэш. Ответ, прочитанный до изменения, которое
+пришло, пока он считался, не сохраняется: put() сверяет версию.
+
+Ответ за прошедшие дни хранится, пока его не вытеснят или не сбросят;
+период, включающий сегодняшний день (или без date_to), — не дольше
+REPORT_CACHE_TTL секунд, на случай правки операций в обход приложения.
+Пока слушатель не подключён, кэш не используется.
+
+Если REPORT_CACHE_STALE_SECONDS > 0, сброшенный ответ ещё столько секунд
+хранится как устаревший. Его отдают, пока ответ пересчитывает другой запрос
+или пока все соединения пула заняты, а пересчитывает первый запрос,
+пришедший при свободном пуле. Заголовок X-Cache: HIT, MISS, STALE или
+BYPASS (кэш выключен).
+"""
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta, timezone
+from functools import wraps
+from zoneinfo import ZoneInfo
+
+import psycopg2
+from flask import Response, g, make_response, request
+
+from auth_util import current_user, get_pool
+from config import (
+    REPORT_CACHE_SIZE, REPORT_CACHE_TTL, REPORT_CACHE_STALE_SECONDS, REPORT_CACHE_CHANNEL, STORE_TIMEZONE,
+)
+from database import db_params_from_env
+
+
+logger = logging.getLogger(__name__)
+
+_VERSION_LOG = 1024                   # сколько последних изменений помнит put() для сверки версий
+
+
+class _Entry:
+    __slots__ = ("scope", "body", "mimetype", "headers", "expires", "stale_since")
+
+    def __init__(self, scope, body, mimetype, headers, expires):
+        self.scope = scope            # (первый день или None, последний день или None, магазин или None)
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers
+        self.expires = expires
+        self.stale_since = None
+
+
+def _covers(scope, day, store_id):
+    first, last, store = scope
+    return ((first is None or first <= day) and (last is None or day <= last)
+            and (store is None or store_id is None or store == store_id))
+
+
+class ReportCache:
+    def __init__(self, capacity, stale_seconds=0):
+        self.capacity = max(0, int(capacity))
+        self.stale_seconds = stale_seconds
+        self._entries = OrderedDict()                 # ключ -> _Entry, от давно не использованных
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.enabled = False
+        # Версия данных растёт на каждом изменении; _changes — последние
+        # изменения (версия, день, магазин), день None — изменилось всё.
+        self.version = 0
+        self._changes = deque(maxlen=_VERSION_LOG)
+        self.hits = self.misses = self.stale_hits = self.invalidations = 0
+
+    def get(self, key):
+        """(запись или None, состояние: hit, stale, miss или bypass, версия данных для put)."""
+        now = time.monotonic()
+        with self._lock:
+            if not self.enabled:
+                return None, "bypass", self.version
+            entry = self._entries.get(key)
+            if entry is not None and entry.stale_since is None and entry.expires is not None and now >= entry.expires:
+                self._retire(key, entry, now)
+                entry = self._entries.get(key)
+            if entry is not None and entry.stale_since is not None and now - entry.stale_since > self.stale_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, "miss", self.version
+            self._entries.move_to_end(key)
+            if entry.stale_since is not None:
+                return entry, "stale", self.version
+            self.hits += 1
+            return entry, "hit", self.version
+
+    def put(self, key, scope, response, version, ttl=None):
+        """Сохраняет ответ, прочитанный при версии данных version, если с тех пор его область не менялась."""
+        with self._lock:
+            if not self.enabled or not self.capacity:
+                return
+            if version < self.version:
+                if not self._changes or self._changes[0][0] > version + 1:
+                    return                    # изменений было больше, чем помнит журнал
+                for v, day, store_id in self._changes:
+                    if v > version and (day is None or _covers(scope, day, store_id)):
+                        return
+            headers = [(k, v) for k, v in response.headers.items() if k.startswith("X-")]
+            expires = time.monotonic() + ttl if ttl is not None else None
+            self._entries[key] = _Entry(scope, response.get_data(), response.mimetype, headers, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def _retire(self, key, entry, now):
+        if self.stale_seconds > 0:
+            entry.stale_since = entry.stale_since or now
+        else:
+            del self._entries[key]
+
+    def invalidate(self, changes=None):
+        """Новая версия данных: сбрасывает ответы, затронутые изменениями [(день, магазин)]; без аргумента — все."""
+        now = time.monotonic()
+        with self._lock:
+            for day, store_id in changes if changes is not None else [(None, None)]:
+                self.version += 1
+                self._changes.append((self.version, day, store_id))
+                for key, entry in list(self._entries.items()):
+                    if day is None or _covers(entry.scope, day, store_id):
+                        self._retire(key, entry, now)
+                        self.invalidations += 1
+
+    def begin_refresh(self, key):
+        """True — этот запрос пересчитывает устаревший ответ; False — его уже пересчитывает другой."""
+        with self._lock:
+            if key in self._refreshing:
+                self.stale_hits += 1
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def served_stale(self):
+        with self._lock:
+            self.stale_hits += 1
+
+    def set_enabled(self, enabled):
+        with self._lock:
+            self.enabled = enabled
+            if not enabled:
+                self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled, "capacity": self.capacity, "size": len(self._entries),
+                "version": self.version, "hits": self.hits, "misses": self.misses,
+                "stale_hits": self.stale_hits, "invalidations": self.invalidations,
+            }
+
+
+cache = ReportCache(REPORT_CACHE_SIZE, REPORT_CACHE_STALE_SECONDS)
+_listener = {"thread": None}
+
+
+def _parse(payload):
+    """"ГГГГ-ММ-ДД:магазин" -> (день, магазин); пустое или неверное уведомление — None (сбросить всё)."""
+    day, _sep, store_id = payload.partition(":")
+    try:
+        return date.fromisoformat(day), int(store_id)
+    except ValueError:
+        return None
+
+
+def _listen():
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**db_params_from_env())
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("LISTEN " + REPORT_CACHE_CHANNEL)
+            # Кэш включается только после LISTEN: изменения с этого момента придут уведомлениями
+            cache.set_enabled(True)
+            backoff = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                changes = set()
+                while conn.notifies:
+                    change = _parse(conn.notifies.pop(0).payload)
+                    if change is None:
+                        changes = None
+                        break
+                    changes.add(change)
+                conn.notifies.clear()
+                if changes is None or changes:
+                    cache.invalidate(changes)
+        except Exception as e:
+            cache.set_enabled(False)
+            logger.warning("report cache listener disconnected, retry in %d s: %s", backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start():
+    """Запускает слушатель уведомлений (один на процесс); до его подключения кэш выключен."""
+    if not cache.capacity or _listener["thread"] is not None:
+        return
+    _listener["thread"] = threading.Thread(target=_listen, name="report-cache", daemon=True)
+    _listener["thread"].start()
+
+
+def _last_closed_day():
+    """Последний уже закончившийся день в часовом поясе магазинов.
+
+    Без STORE_TIMEZONE дни считаются в часовом поясе сессии БД, который здесь
+    неизвестен, поэтому берётся день, закончившийся везде: позавчера по UTC.
+    """
+    if STORE_TIMEZONE:
+        try:
+            return datetime.now(ZoneInfo(STORE_TIMEZONE)).date() - timedelta(days=1)
+        except (KeyError, ValueError):
+            pass
+    return datetime.now(timezone.utc).date() - timedelta(days=2)
+
+
+def _scope(args):
+    """Область ответа по параметрам date_from, date_to, store_id; неверные — ValueError."""
+    first = date.fromisoformat(args["date_from"]) if args.get("date_from") else None
+    last = date.fromisoformat(args["date_to"]) if args.get("date_to") else None
+    store_id = int(args["store_id"]) if args.get("store_id") else None
+    return first, last, store_id
+
+
+def _pool_saturated():
+    pool = get_pool()
+    if pool is None:
+        return False
+    stats = pool.stats()
+    return stats["waiting"] > 0 or stats["in_use"] >= stats["max_size"]
+
+
+def _cached_response(entry, state):
+    resp = Response(entry.body, mimetype=entry.mimetype)
+    for k, v in entry.headers:
+        resp.headers[k] = v
+    resp.headers["X-Cache"] = state
+    return resp
+
+
+def cached(f):
+    """Кэширует успешные ответы отчёта администратора (см. описание модуля)."""
+    @wraps(f)
+    def inner(*args, **kwargs):
+        user = current_user()
+        if not cache.capacity or not user or user["role"] != "admin":
+            return f(*args, **kwargs)
+        try:
+            scope = _scope(request.args)
+        except ValueError:
+            return f(*args, **kwargs)         # ошибку параметров сообщит сам отчёт
+        key = (request.endpoint, tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v != "")))
+        entry, state, version = cache.get(key)
+        if state == "hit":
+            return _cached_response(entry, "HIT")
+        refreshing = False
+        if state == "stale":
+            if _pool_saturated():
+                cache.served_stale()
+                return _cached_response(entry, "STALE")
+            refreshing = cache.begin_refresh(key)
+            if not refreshing:
+                return _cached_response(entry, "STALE")
+        try:
+            resp = make_response(f(*args, **kwargs))
+        finally:
+            if refreshing:
+                cache.end_refresh(key)
+        if state != "bypass" and resp.status_code == 200 and not resp.is_streamed:
+            # Реплика могла отстать от уведомлений, поэтому ответ с неё хранится не дольше TTL
+            past = scope[1] is not None and scope[1] <= _last_closed_day() and g.get("db_ro") is None
+            cache.put(key, scope, resp, version, ttl=None if past else REPORT_CACHE_TTL)
+        resp.headers["X-Cache"] = "BYPASS" if state == "bypass" else "MISS"
+        return resp
+
+    return inner
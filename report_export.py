@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка отчётов в CSV и XLSX без сборки файла в памяти.
+
+Строки приходят генератором (обычно Database.stream — серверный курсор) и
+сразу превращаются в куски ответа, поэтому память не зависит от числа строк.
+CSV отдаётся по мере чтения: первые строки клиент получает, пока запрос ещё
+идёт. XLSX — zip-архив, который собирается только целиком: строки пишутся во
+временный файл (xlsxwriter в режиме constant_memory), и файл отдаётся после
+чтения последней строки.
+
+XLSX требует пакета xlsxwriter; без него модуль импортируется, а
+xlsx_chunks сообщает, что нужно установить (xlsx_available() — False).
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime
+from decimal import Decimal
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+from config import REPORT_EXPORT_CSV_DELIMITER, REPORT_EXPORT_CHUNK_ROWS
+
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_FILE_CHUNK = 64 * 1024
+XLSX_MAX_ROWS = 1048576                 # строк на листе, считая заголовок
+
+
+def xlsx_available():
+    return xlsxwriter is not None
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def csv_chunks(header, rows, chunk_rows=None):
+    """Куски CSV (str): заголовок, затем строки по chunk_rows за раз.
+
+    Начинается с BOM, чтобы Excel открыл файл в UTF-8; разделитель —
+    REPORT_EXPORT_CSV_DELIMITER.
+    """
+    chunk_rows = chunk_rows or REPORT_EXPORT_CHUNK_ROWS
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=REPORT_EXPORT_CSV_DELIMITER, lineterminator="\r\n")
+    buf.write("\ufeff")
+    writer.writerow(header)
+    n = 0
+    for row in rows:
+        writer.writerow([_csv_value(v) for v in row])
+        n += 1
+        if n >= chunk_rows:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            n = 0
+    yield buf.getvalue()
+
+
+def xlsx_chunks(header, rows, sheet_name="Отчёт"):
+    """Куски XLSX (bytes). Числа и даты пишутся ячейками своего типа.
+
+    На листе XLSX не больше XLSX_MAX_ROWS строк: дальше строки продолжаются на
+    листах «<sheet_name> 2», «<sheet_name> 3» и т. д.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("Для выгрузки в XLSX установите пакет xlsxwriter")
+    with tempfile.TemporaryFile() as f:
+        wb = xlsxwriter.Workbook(f, {"constant_memory": True, "remove_timezone": True})
+        bold = wb.add_format({"bold": True})
+        date_format = wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"})
+        money = wb.add_format({"num_format": "0.00"})
+        ws, r, sheets = None, XLSX_MAX_ROWS, 0
+        for row in rows:
+            if r >= XLSX_MAX_ROWS:
+                sheets += 1
+                ws = wb.add_worksheet(sheet_name if sheets == 1 else "%s %d" % (sheet_name, sheets))
+                ws.write_row(0, 0, header, bold)
+                ws.freeze_panes(1, 0)
+                r = 1
+            for c, value in enumerate(row):
+                if value is None:
+                    continue
+                if isinstance(value, datetime):
+                    ws.write_datetime(r, c, value, date_format)
+                elif isinstance(value, Decimal):
+                    ws.write_number(r, c, float(value), money)
+                else:
+                    ws.write(r, c, value)
+            r += 1
+        if ws is None:
+            ws = wb.add_worksheet(sheet_name)
+            ws.write_row(0, 0, header, bold)
+        wb.close()
+        f.seek(0)
+        while True:
+            chunk = f.read(_FILE_CHUNK)
+            if not chunk:
+                break
+            yield chunk
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, render_template, redirect, url_for, request, g, make_response
 from auth_util import current_user, require_admin, get_db
+import report_export
 
 bp = Blueprint("admin_routes", __name__, template_folder="../templates")
 
@@ -22,7 +23,7 @@ def _admin_nav(active=None):
 @bp.route("/")
 @require_admin
 def admin_main():
-    db = get_db()
+    db = get_db(readonly=True)
     user = current_user()
     notifications = db.execute(
         """SELECT p.name AS product_name, p.id_product AS product_id,
@@ -147,7 +148,10 @@ def employees():
 @require_admin
 def sales():
     user = current_user()
-    return render_template("admin/sales.html", user=user, nav_items=_admin_nav("admin_routes.sales"), brand_url=url_for("admin_routes.admin_main"))
+    return render_template(
+        "admin/sales.html", user=user, nav_items=_admin_nav("admin_routes.sales"), brand_url=url_for("admin_routes.admin_main"),
+        xlsx_available=report_export.xlsx_available(),
+    )
 
 
 @bp.route("/reports")
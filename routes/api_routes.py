@@ -1,16 +1,239 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime
-
-
-from flask import Blueprint, request, jsonify
-from auth_util import current_user, get_db
-from config import SHIFT_DURATION_HOURS, SHIFT_DURATION_SECONDS, LOW_STOCK_THRESHOLD, MONEY_DECIMALS, PERCENT_DECIMALS
+import json
+import queue
+import time
+from datetime import date, datetime, timezone
+
+
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
+from auth_util import current_user, get_db, get_pool, invalidate_user
+from config import (
+    SHIFT_DURATION_HOURS, SHIFT_DURATION_SECONDS, MONEY_DECIMALS, PERCENT_DECIMALS,
+    SALES_BATCH_CHUNK, SALES_BATCH_MAX_RECEIPTS, SALES_BATCH_CLOCK_SKEW_SECONDS,
+    STORE_TIMEZONE, SALES_BY_DATE_PAGE_SIZE, REPORT_SALES_PAGE_SIZE, REPORT_EXPORT_CHUNK_ROWS,
+)
+from database import Database, register_statement
+import idempotency
+from idempotency import IdempotencyError
+from passwords import hash_password
+import price_cache
+import report_cache
+import report_export
+import sales_rollup
+import shift_events
+import stock_events
 
 def _shift_duration_seconds():
     return SHIFT_DURATION_SECONDS if SHIFT_DURATION_SECONDS is not None else SHIFT_DURATION_HOURS * 3600
 
 bp = Blueprint("api_routes", __name__)
 
+# Начало дня (дата + сдвиг в днях) в часовом поясе магазинов STORE_TIMEZONE,
+# по умолчанию — в часовом поясе сессии БД. Фильтр по дню задаётся
+# полуоткрытым интервалом created_at >= начало AND created_at < начало
+# следующего дня: в отличие от created_at::date, такое условие использует индекс.
+_DAY_START = "(%s::date + %s::int)::timestamp AT TIME ZONE COALESCE(NULLIF(%s::text, ''), current_setting('TimeZone'))"
+
+# Запросы, которые выполняются на каждом чеке продажи/возврата: готовятся один раз на соединение.
+register_statement("pos_open_shift", """SELECT id_shift,
+           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - shift_start))::BIGINT AS elapsed_sec
+           FROM shifts WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL ORDER BY shift_start DESC LIMIT 1""")
+register_statement("pos_current_shift", """SELECT id_shift, shift_start,
+           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - shift_start))::BIGINT AS elapsed_sec
+           FROM shifts
+           WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL
+           ORDER BY shift_start DESC LIMIT 1""")
+# Итоги смены копятся в той же транзакции, что и чек; закрытая за это время смена
+# не обновляется (RETURNING пуст), и чек откатывается. При закрытии смены итоги
+# фиксируются в Z-отчёт (триггер trg_shifts_snapshot в init_db.sql).
+register_statement("pos_shift_totals", """UPDATE shifts SET
+           sales_count = sales_count + %s, sales_revenue = sales_revenue + %s, sales_cost = sales_cost + %s, sales_profit = sales_profit + %s,
+           returns_count = returns_count + %s, returns_revenue = returns_revenue + %s, returns_cost = returns_cost + %s, returns_profit = returns_profit + %s
+           WHERE id_shift = %s AND shift_end IS NULL RETURNING id_shift""")
+register_statement("pos_products_prices", "SELECT id_product, retail_price, purchase_price FROM products WHERE id_product = ANY(%s::int[])")
+register_statement("pos_stock_levels", "SELECT product_id, quantity FROM store_product_stock WHERE store_id = %s AND product_id = ANY(%s::int[])")
+# Блокирует строки остатков по возрастанию товара. UPDATE ... FROM и вставка
+# с ON CONFLICT блокируют строки в порядке плана соединения, а не входного
+# массива, поэтому перед изменением остатков чек сначала берёт блокировки этим
+# запросом: параллельные чеки ждут друг друга, а не взаимоблокируются.
+register_statement("pos_lock_stock", """SELECT product_id, quantity FROM store_product_stock
+           WHERE store_id = %s AND product_id = ANY(%s::int[]) ORDER BY product_id FOR UPDATE""")
+# Списание остатков всего чека одной командой после pos_lock_stock: условие
+# quantity >= v.qty проверяется по заблокированным строкам, так что две кассы не
+# могут продать один и тот же остаток. Не прошедшие условие товары не попадают
+# в RETURNING.
+register_statement("pos_take_stock", """UPDATE store_product_stock AS t
+           SET quantity = t.quantity - v.qty, update_date = CURRENT_TIMESTAMP
+           FROM unnest(%s::int[], %s::int[]) AS v(product_id, qty)
+           WHERE t.store_id = %s AND t.product_id = v.product_id AND t.quantity >= v.qty
+           RETURNING t.product_id, t.quantity""")
+register_statement("pos_sale_header", "SELECT id_operation, store_id, operation_type, created_at FROM operations WHERE id_operation = %s")
+# Строки продажи с уже возвращённым количеством; при оформлении возврата они
+# блокируются (FOR UPDATE), чтобы два параллельных возврата не превысили проданное.
+# Время продажи (из pos_sale_header) ограничивает поиск одной секцией operation_items.
+register_statement("pos_sale_lines", "SELECT id, product_id, quantity, returned_quantity FROM operation_items WHERE operation_id = %s AND created_at = %s ORDER BY id")
+register_statement("pos_lock_sale_lines", "SELECT id, product_id, quantity, returned_quantity FROM operation_items WHERE operation_id = %s AND created_at = %s ORDER BY id FOR UPDATE")
+register_statement("pos_mark_returned", """UPDATE operation_items AS t SET returned_quantity = t.returned_quantity + v.qty
+           FROM unnest(%s::int[], %s::int[]) AS v(id, qty) WHERE t.id = v.id AND t.created_at = %s""")
+# Продажи магазина за день, по которым ещё можно оформить возврат, страницами
+# по (created_at, id_operation) после курсора; индекс idx_operations_store_type_created.
+register_statement("pos_sales_for_return", """SELECT o.id_operation, o.created_at, o.total_revenue
+           FROM operations o
+           WHERE o.store_id = %s AND o.operation_type = 'sale'
+             AND o.created_at >= """ + _DAY_START + """ AND o.created_at < """ + _DAY_START + """
+             AND (o.created_at, o.id_operation) > (%s::timestamptz, %s::int)
+             AND EXISTS (SELECT 1 FROM operation_items oi
+                         WHERE oi.operation_id = o.id_operation AND oi.created_at = o.created_at AND oi.returned_quantity < oi.quantity)
+           ORDER BY o.created_at, o.id_operation LIMIT %s""")
+register_statement("pos_insert_operation", """INSERT INTO operations (operation_type, shift_id, employee_id, store_id, operation_date, total_revenue, total_cost, total_profit, created_at, original_operation_id)
+           VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s, CURRENT_TIMESTAMP, %s) RETURNING id_operation, created_at""")
+register_statement("pos_insert_item", """INSERT INTO operation_items (operation_id, created_at, product_id, quantity, unit_price, purchase_price, total_price, cost, profit)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""")
+register_statement("pos_increment_stock", """INSERT INTO store_product_stock (store_id, product_id, quantity, update_date) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+           ON CONFLICT (store_id, product_id) DO UPDATE SET quantity = store_product_stock.quantity + EXCLUDED.quantity, update_date = CURRENT_TIMESTAMP""")
+
+
+_BATCH_OPERATION_COLUMNS = ("operation_type", "shift_id", "employee_id", "store_id", "operation_date", "total_revenue", "total_cost", "total_profit", "created_at")
+_ITEM_COLUMNS = ("operation_id", "created_at", "product_id", "quantity", "unit_price", "purchase_price", "total_price", "cost", "profit")
+
+
+def _item_row(operation_id, created_at, it):
+    return (operation_id, created_at, it["product_id"], it["quantity"], it["price"], it["cost"], it["revenue"], it["cost"], it["profit"])
+
+
+def _stock_rows(store_id, line_items):
+    """(store_id, product_id, количество) по товарам чека; повторы товара суммируются,
+    чтобы одна пакетная команда не затрагивала строку остатка дважды. Порядок
+    блокировок этим не задаётся: его обеспечивает pos_lock_stock."""
+    qty = {}
+    for it in line_items:
+        qty[it["product_id"]] = qty.get(it["product_id"], 0) + it["quantity"]
+    return [(store_id, pid, q) for pid, q in sorted(qty.items())]
+
+
+class StockShortage(Exception):
+    def __init__(self, available):
+        super().__init__("Недостаточно товара на точке (остаток %s)" % available)
+        self.available = available
+
+
+class ShiftClosed(Exception):
+    def __init__(self):
+        super().__init__("Смена уже закрыта. Откройте новую смену.")
+
+
+def _shift_totals_params(shift_id, operation_type, count, revenue, cost, profit):
+    """Параметры pos_shift_totals: count чеков продажи или возврата с суммами."""
+    totals = (count, _round_money(revenue), _round_money(cost), _round_money(profit))
+    zero = (0, 0, 0, 0)
+    return (totals + zero if operation_type == "sale" else zero + totals) + (shift_id,)
+
+
+def _requested_items(items):
+    """Строки чека из запроса: {"product_id", "quantity"}; пустые и некорректные пропускаются."""
+    out = []
+    for it in items:
+        try:
+            pid = int(it.get("product_id") or 0)
+            qty = int(it.get("quantity") or 0)
+        except (TypeError, ValueError):
+            continue
+        if pid and qty > 0:
+            out.append({"product_id": pid, "quantity": qty})
+    return out
+
+
+def _price_lines(prices, items):
+    """Считает строки чека по ценам {product_id: (розничная, закупочная)}.
+
+    Возвращает (строки, выручка, себестоимость, прибыль); товары без цены пропускаются.
+    """
+    total_revenue = total_cost = total_profit = 0
+    line_items = []
+    for it in items:
+        prod = prices.get(it["product_id"])
+        if not prod:
+            continue
+        qty = it["quantity"]
+        price, cost_unit = float(prod[0]), float(prod[1])
+        revenue = price * qty
+        cost = cost_unit * qty
+        profit = revenue - cost
+        total_revenue += revenue
+        total_cost += cost
+        total_profit += profit
+        line_items.append({"product_id": it["product_id"], "quantity": qty, "price": price, "cost": cost_unit, "revenue": revenue, "profit": profit})
+    return line_items, total_revenue, total_cost, total_profit
+
+
+class ReturnExceeded(Exception):
+    def __init__(self):
+        super().__init__("Количество возврата по товару не может превышать оставшееся к возврату (продано минус уже возвращено)")
+
+
+def _return_lines(lines, items):
+    """Разносит возврат по строкам продажи.
+
+    lines — строки pos_sale_lines (id, товар, продано, уже возвращено), items —
+    запрошенные {"product_id", "quantity"}. Возвращает (товары возврата с
+    суммарным количеством, [(id строки, сколько добавить к returned_quantity)]).
+    Если по товару просят больше, чем осталось, бросает ReturnExceeded.
+    """
+    wanted = {}
+    for it in items:
+        wanted[it["product_id"]] = wanted.get(it["product_id"], 0) + it["quantity"]
+    left = dict(wanted)
+    increments = []
+    for line_id, pid, sold, returned in lines:
+        take = min(left.get(pid, 0), sold - returned)
+        if take > 0:
+            increments.append((line_id, take))
+            left[pid] -= take
+    if any(left.values()):
+        raise ReturnExceeded()
+    return [{"product_id": pid, "quantity": qty} for pid, qty in wanted.items()], increments
+
+
+def _product_prices(db, product_ids):
+    """Цены {product_id: (розничная, закупочная)} из кэша процесса; недостающие — одним запросом."""
+    return price_cache.lookup(product_ids, lambda missing: db.execute_prepared("pos_products_prices", (missing,)))
+
+
+def _shortage(line_items, taken, levels):
+    """StockShortage по первой строке чека, товар которой не удалось списать."""
+    for it in line_items:
+        if it["product_id"] not in taken:
+            return StockShortage(levels.get(it["product_id"]) or 0)
+    return None
+
+
+def _idempotency(data):
+    """(ключ, хеш тела) по заголовку Idempotency-Key; (None, None), если заголовка нет."""
+    key = idempotency.key_from(request.headers)
+    return (key, idempotency.fingerprint(data)) if key else (None, None)
+
+
+def _replay(row, endpoint, request_hash):
+    """Ответ на повтор запроса с тем же Idempotency-Key."""
+    try:
+        body = idempotency.stored_response(row, endpoint, request_hash)
+    except IdempotencyError as e:
+        return jsonify({"error": str(e)}), 409
+    resp = jsonify(body)
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def _open_shift_or_error(db, u, expired_message):
+    """(id смены, None) или (None, ответ с ошибкой); просроченная смена считается закрытой."""
+    shift_row = db.execute_prepared_one("pos_open_shift", (u["id"], u["store_id"]))
+    if not shift_row:
+        return None, (jsonify({"error": "Сначала откройте смену"}), 400)
+    shift_id, elapsed_sec = shift_row[0], (shift_row[1] or 0)
+    if elapsed_sec >= _shift_duration_seconds():
+        return None, (jsonify({"error": expired_message}), 400)
+    return shift_id, None
+
 
 def _round_money(v):
     return round(float(v), MONEY_DECIMALS)
@@ -20,6 +243,74 @@ def _round_percent(v):
     return round(float(v), PERCENT_DECIMALS)
 
 
+def _day_range(date_from, date_to, column="o.created_at"):
+    """Условие " AND ..." и параметры для дней с date_from по date_to включительно (строки ГГГГ-ММ-ДД, пустая — без границы).
+
+    Неверная дата — ValueError.
+    """
+    sql, params = "", []
+    if date_from:
+        sql += " AND " + column + " >= " + _DAY_START
+        params += [date.fromisoformat(date_from), 0, STORE_TIMEZONE]
+    if date_to:
+        sql += " AND " + column + " < " + _DAY_START
+        params += [date.fromisoformat(date_to), 1, STORE_TIMEZONE]
+    return sql, params
+
+
+def _page_cursor(after):
+    """Курсор страницы "created_at,id" -> (datetime, id); пустой — None, неверный — ValueError."""
+    if not after:
+        return None
+    ts, _sep, op_id = after.rpartition(",")
+    return datetime.fromisoformat(ts), int(op_id)
+
+
+def _page_limit(value, cap):
+    return min(max(int(value or cap), 1), cap)
+
+
+def _sales_page_args(args):
+    """Параметры страницы /sales/by-store-date: (день, курсор (created_at, id), размер); неверные — ValueError."""
+    day = date.fromisoformat(args.get("date") or "")
+    cursor = _page_cursor(args.get("after")) or ("-infinity", 0)
+    return day, cursor, _page_limit(args.get("limit"), SALES_BY_DATE_PAGE_SIZE)
+
+
+def _sales_page_params(store_id, day, cursor, limit):
+    return (store_id, day, 0, STORE_TIMEZONE, day, 1, STORE_TIMEZONE, cursor[0], cursor[1], limit + 1)
+
+
+def _sales_page(rows, limit):
+    """(список продаж, курсор следующей страницы или None) по строкам pos_sales_for_return (limit + 1 строк)."""
+    page = [
+        {"id": r[0], "created_at": r[1].isoformat() if hasattr(r[1], "isoformat") else str(r[1]), "total_revenue": _round_money(r[2])}
+        for r in rows[:limit]
+    ]
+    next_cursor = "%s,%d" % (rows[limit - 1][1].isoformat(), rows[limit - 1][0]) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def _stream_json_array(rows, to_item, chunk_size=500):
+    """Отдаёт JSON-массив по мере чтения строк, не собирая его целиком в памяти."""
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield "["
+        buf = []
+        first = True
+        for r in rows:
+            buf.append(("" if first else ",") + dumps(to_item(r), separators=(",", ":")))
+            first = False
+            if len(buf) >= chunk_size:
+                yield "".join(buf)
+                buf = []
+        buf.append("]")
+        yield "".join(buf)
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
 def _require_admin():
     u = current_user()
     if not u or u["role"] != "admin":
@@ -106,6 +397,8 @@ def update_store(store_id):
         (name, (data.get("address") or "").strip(), (data.get("phone") or "").strip(), store_id),
         fetch=False,
     )
+    # Название магазина входит в данные пользователя
+    invalidate_user()
     return jsonify({"ok": True})
 
 
@@ -123,12 +416,12 @@ def get_store_stock(store_id):
     if not _require_admin():
         return jsonify({"error": "Доступ запрещён"}), 403
     db = get_db()
-    rows = db.execute(
+    rows = db.stream(
         """SELECT p.id_product, p.name, sps.quantity FROM store_product_stock sps
            JOIN products p ON p.id_product = sps.product_id WHERE sps.store_id = %s ORDER BY p.name""",
         (store_id,),
-    ) or []
-    return jsonify([{"product_id": r[0], "product_name": r[1], "quantity": r[2]} for r in rows])
+    )
+    return _stream_json_array(rows, lambda r: {"product_id": r[0], "product_name": r[1], "quantity": r[2]})
 
 
 @bp.route("/warehouses", methods=["GET"])
@@ -291,6 +584,7 @@ def update_product(product_id):
          float(data.get("purchase_price") or 0), float(data.get("retail_price") or 0), int(data.get("min_stock") or 5), product_id),
         fetch=False,
     )
+    price_cache.cache.invalidate([product_id])
     return jsonify({"ok": True})
 
 
@@ -300,6 +594,7 @@ def delete_product(product_id):
         return jsonify({"error": "Доступ запрещён"}), 403
     db = get_db()
     db.execute("UPDATE products SET is_active = FALSE WHERE id_product = %s", (product_id,), fetch=False)
+    price_cache.cache.invalidate([product_id])
     return jsonify({"ok": True})
 
 
@@ -378,12 +673,11 @@ def create_employee():
     full_name = (data.get("full_name") or "").strip()
     if not login or not password or not full_name:
         return jsonify({"error": "Укажите логин, пароль и ФИО"}), 400
-    from werkzeug.security import generate_password_hash
     db = get_db()
     existing = db.execute_one("SELECT id_employee FROM employees WHERE login = %s", (login,))
     if existing:
         return jsonify({"error": "Логин уже занят"}), 400
-    pw_hash = generate_password_hash(password, method="pbkdf2:sha256")
+    pw_hash = hash_password(password)
     db.execute(
         "INSERT INTO employees (login, password_hash, full_name, role, store_id, is_active) VALUES (%s, %s, %s, %s, %s, TRUE)",
         (login, pw_hash, full_name, data.get("role") or "seller", data.get("store_id") or None),
@@ -407,6 +701,7 @@ def update_employee(emp_id):
         (full_name, data.get("role") or "seller", data.get("store_id") or None, bool(data.get("active", True)), emp_id),
         fetch=False,
     )
+    invalidate_user(emp_id)
     return jsonify({"ok": True})
 
 
@@ -416,6 +711,7 @@ def delete_employee(emp_id):
         return jsonify({"error": "Доступ запрещён"}), 403
     db = get_db()
     db.execute("UPDATE employees SET is_active = FALSE WHERE id_employee = %s", (emp_id,), fetch=False)
+    invalidate_user(emp_id)
     return jsonify({"ok": True})
 
 
@@ -424,31 +720,103 @@ def current_shift():
     u = _require_seller()
     if not u:
         return jsonify({"error": "Доступ только для продавца"}), 403
-    db = get_db()
-    row = db.execute_one(
-        """SELECT id_shift, shift_start,
-           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - shift_start))::BIGINT AS elapsed_sec
-           FROM shifts
-           WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL
-           ORDER BY shift_start DESC LIMIT 1""",
-        (u["id"], u["store_id"]),
-    )
-    if not row:
-        return jsonify({"shift": None})
-    id_shift, shift_start, elapsed_sec = row[0], row[1], (row[2] or 0)
-    limit_sec = _shift_duration_seconds()
-    if elapsed_sec >= limit_sec:
-        db.execute(
-            "UPDATE shifts SET shift_end = CURRENT_TIMESTAMP, status = 'closed' WHERE id_shift = %s",
-            (id_shift,),
-            fetch=False,
-        )
-        return jsonify({"shift": None, "closed": True, "shift_id": id_shift})
+    body, _open = _current_shift_status(get_db(), u)
+    return jsonify(body)
+
+
+def _shift_body(id_shift, shift_start, elapsed_sec):
     hours = int(elapsed_sec // 3600)
     minutes = int((elapsed_sec % 3600) // 60)
-    return jsonify({
-        "shift": {"id": id_shift, "opened_at": row[1].isoformat(), "work_hours": hours, "work_minutes": minutes},
-    })
+    return {"shift": {"id": id_shift, "opened_at": shift_start.isoformat(), "work_hours": hours, "work_minutes": minutes}}
+
+
+def _shift_status(row):
+    """Ответ /shifts/current по строке pos_current_shift и открытая смена (id, начало, секунд) или None.
+
+    Смена с истёкшим сроком считается закрытой; в БД её закрывает shift_events.close_expired
+    или следующее открытие либо закрытие смены.
+    """
+    if not row:
+        return {"shift": None}, None
+    id_shift, shift_start, elapsed_sec = row[0], row[1], (row[2] or 0)
+    if elapsed_sec >= _shift_duration_seconds():
+        return {"shift": None, "closed": True, "shift_id": id_shift}, None
+    return _shift_body(id_shift, shift_start, elapsed_sec), (id_shift, shift_start, elapsed_sec)
+
+
+def _current_shift_status(db, u):
+    return _shift_status(db.execute_prepared_one("pos_current_shift", (u["id"], u["store_id"])))
+
+
+def _shift_closed(prev, body):
+    """Если смена prev, которую показывал поток, больше не открыта (закрыта в том числе с другой кассы), сообщает о её закрытии."""
+    if prev and body.get("shift") is None:
+        return {"shift": None, "closed": True, "shift_id": prev[0]}
+    return body
+
+
+def _sse(body):
+    return "data: " + json.dumps(body, ensure_ascii=False) + "\n\n"
+
+
+def _next_tick(elapsed_sec):
+    """Секунд до смены минуты на счётчике или до конца смены, если он раньше."""
+    return max(0.5, min(60 - elapsed_sec % 60, _shift_duration_seconds() - elapsed_sec))
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@bp.route("/shifts/events", methods=["GET"])
+def shift_events_stream():
+    """Поток SSE с состоянием смены (тело как у /shifts/current).
+
+    Сообщение отправляется сразу, при каждой смене минуты и при открытии или
+    закрытии смены (shift_events.py). Смену из БД поток перечитывает только
+    по событию или по истечении её срока.
+    """
+    u = _require_seller()
+    if not u:
+        return jsonify({"error": "Доступ только для продавца"}), 403
+    body, shift = _current_shift_status(get_db(), u)
+    events = queue.Queue()
+    deliver = events.put_nowait
+    shift_events.subscribe(u["id"], deliver)
+
+    def reread():
+        db = Database(pool=get_pool())
+        try:
+            return _current_shift_status(db, u)
+        finally:
+            db.close()
+
+    def generate():
+        nonlocal body, shift
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                yield _sse(body)
+                read_at = time.monotonic()
+                while True:
+                    elapsed = shift[2] + time.monotonic() - read_at if shift else 0
+                    try:
+                        events.get(timeout=_next_tick(elapsed) if shift else 60)
+                        break
+                    except queue.Empty:
+                        if not shift:
+                            yield ": keepalive\n\n"
+                            continue
+                    elapsed = shift[2] + time.monotonic() - read_at
+                    if elapsed >= _shift_duration_seconds():
+                        break
+                    yield _sse(_shift_body(shift[0], shift[1], elapsed))
+                prev = shift
+                body, shift = reread()
+                body = _shift_closed(prev, body)
+        finally:
+            shift_events.unsubscribe(u["id"], deliver)
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
 
 
 @bp.route("/shifts/open", methods=["POST"])
@@ -457,6 +825,8 @@ def open_shift():
     if not u:
         return jsonify({"error": "Доступ только для продавца"}), 403
     db = get_db()
+    # Просроченная смена, которую ещё не закрыла фоновая задача, не мешает открыть новую
+    shift_events.expire_shifts(db, u["id"])
     existing = db.execute_one(
         "SELECT id_shift FROM shifts WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL",
         (u["id"], u["store_id"]),
@@ -478,6 +848,9 @@ def close_shift(shift_id):
     if not u:
         return jsonify({"error": "Доступ только для продавца"}), 403
     db = get_db()
+    # Просроченная смена закрывается концом срока, а не временем нажатия кнопки
+    if shift_id in shift_events.expire_shifts(db, u["id"]):
+        return jsonify({"ok": True})
     row = db.execute_one("SELECT employee_id, store_id FROM shifts WHERE id_shift = %s AND shift_end IS NULL", (shift_id,))
     if not row or row[0] != u["id"] or row[1] != u["store_id"]:
         return jsonify({"error": "Смена не найдена или уже закрыта"}), 400
@@ -489,67 +862,59 @@ def close_shift(shift_id):
     return jsonify({"ok": True})
 
 
-@bp.route("/shifts/<int:shift_id>/report", methods=["GET"])
-def shift_report_api(shift_id):
-    db = get_db()
-    shift_row = db.execute_one(
-        """SELECT s.id_shift, s.shift_start, s.shift_end, s.employee_id, s.store_id,
-                  e.full_name, st.name AS store_name
+# Отчёт закрытой смены — одна строка Z-отчёта по первичному ключу.
+SHIFT_REPORT_SNAPSHOT_QUERY = """SELECT shift_id, shift_start, shift_end, seller_name, store_name,
+           sales_count, sales_revenue, sales_cost, sales_profit, returns_count, returns_revenue, returns_cost, returns_profit, receipts
+           FROM shift_reports WHERE shift_id = %s"""
+SHIFT_REPORT_LIVE_QUERY = """SELECT s.id_shift, s.shift_start, s.shift_end, e.full_name, st.name,
+           s.sales_count, s.sales_revenue, s.sales_cost, s.sales_profit, s.returns_count, s.returns_revenue, s.returns_cost, s.returns_profit
            FROM shifts s
            JOIN employees e ON e.id_employee = s.employee_id
            LEFT JOIN stores st ON st.id_store = s.store_id
-           WHERE s.id_shift = %s""",
-        (shift_id,),
-    )
-    if not shift_row:
-        return jsonify({"error": "Смена не найдена"}), 404
-    sid, start_ts, end_ts, emp_id, store_id, seller_name, store_name = shift_row
-    start_str = start_ts.strftime("%H:%M") if start_ts else ""
-    end_str = end_ts.strftime("%H:%M") if end_ts else ""
-    date_str = start_ts.strftime("%d.%m.%Y") if start_ts else ""
-    sales_rows = db.execute(
-        """SELECT id_operation, created_at, total_revenue, total_cost, total_profit, operation_type, original_operation_id
+           WHERE s.id_shift = %s"""
+SHIFT_REPORT_RECEIPTS_QUERY = """SELECT id_operation, created_at, total_revenue, total_cost, total_profit, operation_type, original_operation_id
            FROM operations
            WHERE shift_id = %s AND (operation_type = 'sale' OR operation_type = 'return')
-           ORDER BY created_at""",
-        (shift_id,),
-    ) or []
-    totals_sale = db.execute_one(
-        """SELECT COALESCE(SUM(total_revenue), 0), COALESCE(SUM(total_cost), 0), COALESCE(SUM(total_profit), 0)
-           FROM operations WHERE shift_id = %s AND operation_type = 'sale'""",
-        (shift_id,),
-    )
-    totals_ret = db.execute_one(
-        """SELECT COALESCE(SUM(total_revenue), 0), COALESCE(SUM(total_cost), 0), COALESCE(SUM(total_profit), 0)
-           FROM operations WHERE shift_id = %s AND operation_type = 'return'""",
-        (shift_id,),
-    )
-    rev_s = (totals_sale[0] or 0) if totals_sale else 0
-    cost_s = (totals_sale[1] or 0) if totals_sale else 0
-    profit_s = (totals_sale[2] or 0) if totals_sale else 0
-    rev_r = (totals_ret[0] or 0) if totals_ret else 0
-    cost_r = (totals_ret[1] or 0) if totals_ret else 0
-    profit_r = (totals_ret[2] or 0) if totals_ret else 0
-    rev = rev_s - rev_r
-    cost = cost_s - cost_r
-    profit = profit_s - profit_r
-    return jsonify({
+           ORDER BY created_at"""
+
+
+def _shift_report_body(header, receipts):
+    """Ответ /shifts/<id>/report по строке итогов смены и её чекам (строкам или массивам из Z-отчёта)."""
+    (sid, start_ts, end_ts, seller_name, store_name,
+     sales_count, rev_s, cost_s, profit_s, returns_count, rev_r, cost_r, profit_r) = header
+    return {
         "shift_id": sid,
         "seller_name": seller_name or "",
         "store_name": store_name or "",
-        "date": date_str,
-        "shift_start": start_str,
-        "shift_end": end_str,
-        "total_revenue": _round_money(rev),
-        "total_cost": _round_money(cost),
-        "total_profit": _round_money(profit),
+        "date": start_ts.strftime("%d.%m.%Y") if start_ts else "",
+        "shift_start": start_ts.strftime("%H:%M") if start_ts else "",
+        "shift_end": end_ts.strftime("%H:%M") if end_ts else "",
+        "total_revenue": _round_money(rev_s - rev_r),
+        "total_cost": _round_money(cost_s - cost_r),
+        "total_profit": _round_money(profit_s - profit_r),
+        "sales_count": sales_count,
+        "returns_count": returns_count,
         "sales": [
             {"id": r[0], "created_at": r[1].isoformat() if hasattr(r[1], "isoformat") else str(r[1]),
              "total_revenue": _round_money(r[2]), "total_cost": _round_money(r[3]), "total_profit": _round_money(r[4]),
-             "operation_type": r[5] if len(r) > 5 else "sale", "original_operation_id": r[6] if len(r) > 6 else None}
-            for r in sales_rows
+             "operation_type": r[5] or "sale", "original_operation_id": r[6]}
+            for r in receipts
         ],
-    })
+    }
+
+
+@bp.route("/shifts/<int:shift_id>/report", methods=["GET"])
+def shift_report_api(shift_id):
+    db = get_db()
+    row = db.execute_one(SHIFT_REPORT_SNAPSHOT_QUERY, (shift_id,))
+    if row:
+        return jsonify(_shift_report_body(row[:-1], row[-1]))
+    # Отчёт ещё открытой смены: итоги из самой смены и её чеки
+    header = db.execute_one(SHIFT_REPORT_LIVE_QUERY, (shift_id,))
+    if not header:
+        return jsonify({"error": "Смена не найдена"}), 404
+    receipts = db.execute(SHIFT_REPORT_RECEIPTS_QUERY, (shift_id,)) or []
+    return jsonify(_shift_report_body(header, receipts))
 
 
 @bp.route("/sales", methods=["POST"])
@@ -561,81 +926,225 @@ def create_sale():
     items = data.get("items") or []
     if not items:
         return jsonify({"error": "Добавьте товары в чек"}), 400
+    try:
+        idem_key, request_hash = _idempotency(data)
+    except IdempotencyError as e:
+        return jsonify({"error": str(e)}), 400
     db = get_db()
-    shift_row = db.execute_one(
-        """SELECT id_shift,
-           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - shift_start))::BIGINT AS elapsed_sec
-           FROM shifts WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL ORDER BY shift_start DESC LIMIT 1""",
-        (u["id"], u["store_id"]),
-    )
-    if not shift_row:
-        return jsonify({"error": "Сначала откройте смену"}), 400
-    shift_id, elapsed_sec = shift_row[0], (shift_row[1] or 0)
-    if elapsed_sec >= _shift_duration_seconds():
-        db.execute("UPDATE shifts SET shift_end = CURRENT_TIMESTAMP, status = 'closed' WHERE id_shift = %s", (shift_id,), fetch=False)
-        return jsonify({"error": "Смена закрыта по истечении заданного времени. Откройте новую смену."}), 400
+    if idem_key:
+        row = db.execute_prepared_one("idem_lookup", (u["id"], idem_key))
+        if row:
+            return _replay(row, "sale", request_hash)
+    shift_id, error = _open_shift_or_error(db, u, "Смена закрыта по истечении заданного времени. Откройте новую смену.")
+    if error:
+        return error
     store_id = u["store_id"]
-    total_revenue = total_cost = total_profit = 0
-    line_items = []
-    for it in items:
-        pid = it.get("product_id")
-        qty = int(it.get("quantity") or 0)
-        if not pid or qty <= 0:
-            continue
-        prod = db.execute_one(
-            "SELECT retail_price, purchase_price FROM products WHERE id_product = %s",
-            (pid,),
-        )
-        if not prod:
-            continue
-        price, cost_unit = float(prod[0]), float(prod[1])
-        revenue = price * qty
-        cost = cost_unit * qty
-        profit = revenue - cost
-        total_revenue += revenue
-        total_cost += cost
-        total_profit += profit
-        line_items.append({"product_id": pid, "quantity": qty, "price": price, "cost": cost_unit, "revenue": revenue, "profit": profit})
+    requested = _requested_items(items)
+    line_items, total_revenue, total_cost, total_profit = _price_lines(_product_prices(db, [it["product_id"] for it in requested]), requested)
     if not line_items:
         return jsonify({"error": "Добавьте товары в чек"}), 400
-    for it in line_items:
-        row = db.execute_one(
-            "SELECT quantity FROM store_product_stock WHERE store_id = %s AND product_id = %s",
-            (store_id, it["product_id"]),
-        )
-        avail = (row[0] or 0) if row else 0
-        if avail < it["quantity"]:
-            return jsonify({"error": "Недостаточно товара на точке (остаток %s)" % avail}), 400
-    with db.cursor() as cur:
-        cur.execute(
-            """INSERT INTO operations (operation_type, shift_id, employee_id, store_id, operation_date, total_revenue, total_cost, total_profit, created_at)
-               VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s, CURRENT_TIMESTAMP) RETURNING id_operation""",
-            ("sale", shift_id, u["id"], store_id, _round_money(total_revenue), _round_money(total_cost), _round_money(total_profit)),
-        )
-        check_id = cur.fetchone()[0]
-        for it in line_items:
-            cur.execute(
-                """INSERT INTO operation_items (operation_id, product_id, quantity, unit_price, purchase_price, total_price, cost, profit)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                (check_id, it["product_id"], it["quantity"], it["price"], it["cost"], it["revenue"], it["cost"], it["profit"]),
-            )
-            cur.execute(
-                "UPDATE store_product_stock SET quantity = quantity - %s, update_date = CURRENT_TIMESTAMP WHERE store_id = %s AND product_id = %s",
-                (it["quantity"], store_id, it["product_id"]),
-            )
-        for it in line_items:
-            cur.execute(
-                "SELECT quantity FROM store_product_stock WHERE store_id = %s AND product_id = %s",
-                (store_id, it["product_id"]),
-            )
-            r = cur.fetchone()
-            q = (r[0] or 0) if r else 0
-            if q < LOW_STOCK_THRESHOLD:
-                cur.execute(
-                    "INSERT INTO notifications (product_id, store_id, warehouse_id, current_quantity, threshold, status, created_at) VALUES (%s, %s, NULL, %s, %s, 'unread', CURRENT_TIMESTAMP)",
-                    (it["product_id"], store_id, q, LOW_STOCK_THRESHOLD),
-                )
-    return jsonify({"ok": True, "check_id": check_id, "total": _round_money(total_revenue)})
+    try:
+        with db.cursor() as cur:
+            if idem_key:
+                db.run_prepared(cur, "idem_claim", (u["id"], idem_key, "sale", request_hash))
+                if cur.fetchone() is None:
+                    db.run_prepared(cur, "idem_lookup", (u["id"], idem_key))
+                    return _replay(cur.fetchone(), "sale", request_hash)
+            stock = _stock_rows(store_id, line_items)
+            db.run_prepared(cur, "pos_lock_stock", (store_id, [r[1] for r in stock]))
+            db.run_prepared(cur, "pos_take_stock", ([r[1] for r in stock], [r[2] for r in stock], store_id))
+            left = dict(cur.fetchall())
+            if len(left) < len(stock):
+                db.run_prepared(cur, "pos_stock_levels", (store_id, [r[1] for r in stock]))
+                raise _shortage(line_items, left, dict(cur.fetchall()))
+            db.run_prepared(cur, "pos_insert_operation", (
+                "sale", shift_id, u["id"], store_id, _round_money(total_revenue), _round_money(total_cost), _round_money(total_profit), None,
+            ))
+            check_id, created_at = cur.fetchone()
+            db.insert_rows("operation_items", _ITEM_COLUMNS, [_item_row(check_id, created_at, it) for it in line_items], cur=cur)
+            db.run_prepared(cur, "pos_shift_totals", _shift_totals_params(shift_id, "sale", 1, total_revenue, total_cost, total_profit))
+            if cur.fetchone() is None:
+                raise ShiftClosed()
+            db.run_prepared(cur, "sales_rollup_add", sales_rollup.add_params([(check_id, created_at)]))
+            body = {"ok": True, "check_id": check_id, "total": _round_money(total_revenue)}
+            if idem_key:
+                db.run_prepared(cur, "idem_store", (check_id, idempotency.dump_response(body), u["id"], idem_key))
+    except (StockShortage, ShiftClosed) as e:
+        return jsonify({"error": str(e)}), 400
+    stock_events.emit(left, store_id=store_id)
+    return jsonify(body)
+
+
+def _client_time(value, shift_start=None):
+    """Время чека с терминала (ISO 8601); время без пояса считается местным временем сервера.
+
+    Время должно лежать между началом смены shift_start и текущим моментом
+    с допуском SALES_BATCH_CLOCK_SKEW_SECONDS в обе стороны: чек, пробитый
+    раньше смены, попал бы в её итоги и в сводку давно закрытого дня.
+    """
+    if not value:
+        raise ValueError("Укажите время чека (created_at)")
+    try:
+        value = str(value)
+        # fromisoformat до Python 3.11 не понимает суффикс Z
+        ts = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith(("Z", "z")) else value)
+        if ts.tzinfo is None:
+            ts = ts.astimezone()
+    except (ValueError, OverflowError):
+        raise ValueError("Неверный формат времени чека: %s" % value)
+    if (ts - datetime.now(timezone.utc)).total_seconds() > SALES_BATCH_CLOCK_SKEW_SECONDS:
+        raise ValueError("Время чека в будущем: %s" % value)
+    if shift_start is not None and (shift_start - ts).total_seconds() > SALES_BATCH_CLOCK_SKEW_SECONDS:
+        raise ValueError("Время чека раньше начала смены: %s" % value)
+    return ts
+
+
+def _batch_receipt(rc, seen, shift_start=None):
+    """Разбирает чек пакета: (чек для сохранения, None) или (None, текст ошибки)."""
+    rc = rc if isinstance(rc, dict) else {}
+    client_id = str(rc.get("client_id") or "").strip()
+    if not client_id or len(client_id) > idempotency.KEY_MAX_LENGTH:
+        return None, "Укажите client_id чека (не длиннее %d символов)" % idempotency.KEY_MAX_LENGTH
+    if client_id in seen:
+        return None, "client_id повторяется в пакете"
+    seen.add(client_id)
+    try:
+        created_at = _client_time(rc.get("created_at"), shift_start)
+    except ValueError as e:
+        return None, str(e)
+    items = _requested_items(rc.get("items") or [])
+    if not items:
+        return None, "Добавьте товары в чек"
+    return {
+        "client_id": client_id, "created_at": created_at, "items": items,
+        # Тот же хеш, что у POST /api/sales с телом {"items": ...}: чек, отправленный
+        # сначала по одному, а потом в пакете (или наоборот), не проводится дважды.
+        "request_hash": idempotency.fingerprint({"items": rc.get("items")}),
+    }, None
+
+
+def _save_sales_chunk(db, cur, u, shift_id, prices, chunk):
+    """Сохраняет часть пакета в одной транзакции.
+
+    Возвращает ({номер чека в пакете: результат}, id товаров, остатки которых изменились).
+    """
+    store_id = u["store_id"]
+    out = {}
+    db.run_prepared(cur, "idem_claim_many", (u["id"], "sale", [p["client_id"] for p in chunk], [p["request_hash"] for p in chunk]))
+    claimed = {r[0] for r in cur.fetchall()}
+    replays = [p for p in chunk if p["client_id"] not in claimed]
+    if replays:
+        db.run_prepared(cur, "idem_lookup_many", (u["id"], [p["client_id"] for p in replays]))
+        stored = {r[0]: r[1:] for r in cur.fetchall()}
+        for p in replays:
+            try:
+                body = idempotency.stored_response(stored.get(p["client_id"]), "sale", p["request_hash"])
+            except IdempotencyError as e:
+                out[p["index"]] = {"client_id": p["client_id"], "status": "rejected", "error": str(e)}
+                continue
+            out[p["index"]] = {"client_id": p["client_id"], "status": "duplicate", "check_id": body.get("check_id"), "total": body.get("total")}
+    fresh = sorted((p for p in chunk if p["client_id"] in claimed), key=lambda p: p["created_at"])
+    if not fresh:
+        return out, []
+
+    # Остатки всех товаров части блокируются одним запросом и распределяются
+    # между чеками в порядке их времени; чек, которому не хватило товара, отклоняется целиком.
+    db.run_prepared(cur, "pos_lock_stock", (store_id, sorted({it["product_id"] for p in fresh for it in p["items"]})))
+    available = dict(cur.fetchall())
+    accepted, released = [], []
+    for p in fresh:
+        line_items, total_revenue, total_cost, total_profit = _price_lines(prices, p["items"])
+        need = _stock_rows(store_id, line_items)
+        short = next((r for r in need if (available.get(r[1]) or 0) < r[2]), None)
+        if not line_items or short:
+            released.append(p["client_id"])
+            error = str(StockShortage(available.get(short[1]) or 0)) if short else "Добавьте товары в чек"
+            out[p["index"]] = {"client_id": p["client_id"], "status": "rejected", "error": error}
+            continue
+        for _store, pid, qty in need:
+            available[pid] -= qty
+        accepted.append((p, line_items, total_revenue, total_cost, total_profit))
+    if released:
+        db.run_prepared(cur, "idem_release_many", (u["id"], released))
+    if not accepted:
+        return out, []
+
+    stock = _stock_rows(store_id, [it for _p, line_items, *_totals in accepted for it in line_items])
+    db.run_prepared(cur, "pos_take_stock", ([r[1] for r in stock], [r[2] for r in stock], store_id))
+    left = dict(cur.fetchall())
+    ids = db.insert_rows("operations", _BATCH_OPERATION_COLUMNS, [
+        ("sale", shift_id, u["id"], store_id, p["created_at"], _round_money(rev), _round_money(cost), _round_money(profit), p["created_at"])
+        for p, _lines, rev, cost, profit in accepted
+    ], returning="id_operation, created_at", cur=cur)
+    item_rows, keys, check_ids, bodies = [], [], [], []
+    for (p, line_items, total_revenue, _cost, _profit), (check_id, created_at) in zip(accepted, ids):
+        item_rows += [_item_row(check_id, created_at, it) for it in line_items]
+        body = {"ok": True, "check_id": check_id, "total": _round_money(total_revenue)}
+        keys.append(p["client_id"])
+        check_ids.append(check_id)
+        bodies.append(idempotency.dump_response(body))
+        out[p["index"]] = {"client_id": p["client_id"], "status": "created", "check_id": check_id, "total": body["total"]}
+    db.insert_rows("operation_items", _ITEM_COLUMNS, item_rows, cur=cur)
+    db.run_prepared(cur, "pos_shift_totals", _shift_totals_params(
+        shift_id, "sale", len(accepted), *(sum(_round_money(a[i]) for a in accepted) for i in (2, 3, 4)),
+    ))
+    if cur.fetchone() is None:
+        raise ShiftClosed()
+    db.run_prepared(cur, "sales_rollup_add", sales_rollup.add_params(ids))
+    db.run_prepared(cur, "idem_store_many", (keys, check_ids, bodies, u["id"]))
+    return out, list(left)
+
+
+@bp.route("/sales/batch", methods=["POST"])
+def create_sales_batch():
+    """Пакет чеков с терминала: {"receipts": [{"client_id", "created_at", "items"}, ...]}.
+
+    Смена проверяется один раз, цены всех чеков читаются одним запросом, чеки
+    сохраняются транзакциями по SALES_BATCH_CHUNK. client_id служит ключом
+    идемпотентности: повторно присланный чек не проводится, а возвращает
+    прежний результат. Ответ содержит результат каждого чека в порядке запроса.
+    """
+    u = _require_seller()
+    if not u:
+        return jsonify({"error": "Доступ только для продавца"}), 403
+    data = request.get_json() or {}
+    receipts = data.get("receipts")
+    if not isinstance(receipts, list) or not receipts:
+        return jsonify({"error": "Передайте чеки в поле receipts"}), 400
+    if len(receipts) > SALES_BATCH_MAX_RECEIPTS:
+        return jsonify({"error": "Не более %d чеков в одном пакете" % SALES_BATCH_MAX_RECEIPTS}), 413
+    db = get_db()
+    shift_id, error = _open_shift_or_error(db, u, "Смена закрыта по истечении заданного времени. Откройте новую смену.")
+    if error:
+        return error
+    shift_start = db.execute_one("SELECT shift_start FROM shifts WHERE id_shift = %s", (shift_id,))[0]
+    results = [None] * len(receipts)
+    pending = []
+    seen = set()
+    for i, rc in enumerate(receipts):
+        receipt, error = _batch_receipt(rc, seen, shift_start)
+        if error:
+            results[i] = {"client_id": (rc.get("client_id") if isinstance(rc, dict) else None), "status": "rejected", "error": error}
+            continue
+        receipt["index"] = i
+        pending.append(receipt)
+    if pending:
+        product_ids = sorted({it["product_id"] for p in pending for it in p["items"]})
+        prices = _product_prices(db, product_ids)
+    for start in range(0, len(pending), max(1, SALES_BATCH_CHUNK)):
+        chunk = pending[start:start + max(1, SALES_BATCH_CHUNK)]
+        try:
+            with db.cursor() as cur:
+                outcomes, changed = _save_sales_chunk(db, cur, u, shift_id, prices, chunk)
+            stock_events.emit(changed, store_id=u["store_id"])
+        except Exception as e:
+            outcomes = {p["index"]: {"client_id": p["client_id"], "status": "error", "error": "Ошибка при сохранении чека: " + str(e)} for p in chunk}
+        for i, res in outcomes.items():
+            results[i] = res
+    counts = {}
+    for res in results:
+        counts[res["status"]] = counts.get(res["status"], 0) + 1
+    return jsonify({"ok": True, "results": results, "counts": counts})
 
 
 @bp.route("/sales/by-store-date", methods=["GET"])
@@ -643,41 +1152,19 @@ def sales_by_store_date():
     u = _require_seller()
     if not u:
         return jsonify({"error": "Доступ только для продавца"}), 403
-    date_str = request.args.get("date") or ""
-    if not date_str:
+    if not request.args.get("date"):
         return jsonify([])
-    db = get_db()
-    rows = db.execute(
-        """WITH sale_products AS (
-             SELECT o.id_operation, oi.product_id, oi.quantity AS sold
-             FROM operations o
-             JOIN operation_items oi ON oi.operation_id = o.id_operation
-             WHERE o.store_id = %s AND o.operation_type = 'sale' AND (o.created_at::date) = %s
-           ),
-           returned_by_sale_product AS (
-             SELECT r.original_operation_id AS id_operation, oi.product_id, SUM(oi.quantity) AS returned
-             FROM operations r
-             JOIN operation_items oi ON oi.operation_id = r.id_operation
-             WHERE r.operation_type = 'return' AND r.original_operation_id IS NOT NULL
-             GROUP BY r.original_operation_id, oi.product_id
-           ),
-           not_fully_returned AS (
-             SELECT DISTINCT s.id_operation
-             FROM sale_products s
-             LEFT JOIN returned_by_sale_product r ON r.id_operation = s.id_operation AND r.product_id = s.product_id
-             WHERE s.sold > COALESCE(r.returned, 0)
-           )
-           SELECT o.id_operation, o.created_at, o.total_revenue
-           FROM operations o
-           WHERE o.store_id = %s AND o.operation_type = 'sale' AND (o.created_at::date) = %s
-             AND o.id_operation IN (SELECT id_operation FROM not_fully_returned)
-           ORDER BY o.created_at""",
-        (u["store_id"], date_str, u["store_id"], date_str),
-    ) or []
-    return jsonify([
-        {"id": r[0], "created_at": r[1].isoformat() if hasattr(r[1], "isoformat") else str(r[1]), "total_revenue": _round_money(r[2])}
-        for r in rows
-    ])
+    try:
+        day, cursor, limit = _sales_page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Неверная дата или курсор страницы"}), 400
+    db = get_db(readonly=True)
+    rows = db.execute_prepared("pos_sales_for_return", _sales_page_params(u["store_id"], day, cursor, limit)) or []
+    page, next_cursor = _sales_page(rows, limit)
+    resp = jsonify(page)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
 
 
 @bp.route("/operations/<int:op_id>/items", methods=["GET"])
@@ -686,33 +1173,19 @@ def operation_items(op_id):
     if not u:
         return jsonify({"error": "Доступ только для продавца"}), 403
     db = get_db()
-    op = db.execute_one(
-        "SELECT id_operation, store_id, operation_type FROM operations WHERE id_operation = %s",
-        (op_id,),
-    )
+    op = db.execute_prepared_one("pos_sale_header", (op_id,))
     if not op or op[1] != u["store_id"] or op[2] != "sale":
         return jsonify({"error": "Продажа не найдена или доступ запрещён"}), 404
     rows = db.execute(
-        """SELECT oi.product_id, p.name, oi.quantity, oi.unit_price, oi.total_price
+        """SELECT oi.product_id, p.name, oi.quantity, oi.unit_price, oi.total_price, oi.returned_quantity
            FROM operation_items oi
            JOIN products p ON p.id_product = oi.product_id
-           WHERE oi.operation_id = %s ORDER BY oi.product_id""",
-        (op_id,),
+           WHERE oi.operation_id = %s AND oi.created_at = %s ORDER BY oi.product_id, oi.id""",
+        (op_id, op[3]),
     ) or []
-    returned = {}
-    for r in db.execute(
-        """SELECT oi.product_id, SUM(oi.quantity)
-           FROM operations o
-           JOIN operation_items oi ON oi.operation_id = o.id_operation
-           WHERE o.operation_type = 'return' AND o.original_operation_id = %s
-           GROUP BY oi.product_id""",
-        (op_id,),
-    ) or []:
-        returned[r[0]] = r[1]
     out = []
     for r in rows:
-        pid, name, sold, uprice, tprice = r[0], r[1], r[2], r[3], r[4]
-        already = returned.get(pid, 0)
+        pid, name, sold, uprice, tprice, already = r[0], r[1], r[2], r[3], r[4], r[5]
         remaining = max(0, sold - already)
         out.append({
             "product_id": pid, "product_name": name,
@@ -732,100 +1205,70 @@ def create_return():
     items = data.get("items") or []
     if not original_id or not items:
         return jsonify({"error": "Укажите продажу и товары для возврата"}), 400
+    try:
+        idem_key, request_hash = _idempotency(data)
+    except IdempotencyError as e:
+        return jsonify({"error": str(e)}), 400
     db = get_db()
-    sale_row = db.execute_one(
-        "SELECT id_operation, store_id, operation_type FROM operations WHERE id_operation = %s",
-        (original_id,),
-    )
+    if idem_key:
+        row = db.execute_prepared_one("idem_lookup", (u["id"], idem_key))
+        if row:
+            return _replay(row, "return", request_hash)
+    sale_row = db.execute_prepared_one("pos_sale_header", (original_id,))
     if not sale_row or sale_row[1] != u["store_id"] or sale_row[2] != "sale":
         return jsonify({"error": "Продажа не найдена или доступ запрещён"}), 400
-    sold = {}
-    for row in db.execute(
-        "SELECT product_id, quantity FROM operation_items WHERE operation_id = %s",
-        (original_id,),
-    ) or []:
-        sold[row[0]] = row[1]
-    returned = {}
-    for row in db.execute(
-        """SELECT oi.product_id, SUM(oi.quantity)
-           FROM operations o JOIN operation_items oi ON oi.operation_id = o.id_operation
-           WHERE o.operation_type = 'return' AND o.original_operation_id = %s
-           GROUP BY oi.product_id""",
-        (original_id,),
-    ) or []:
-        returned[row[0]] = row[1]
-    return_items = []
-    for it in items:
-        pid = it.get("product_id")
-        qty = int(it.get("quantity") or 0)
-        if not pid or qty <= 0:
-            continue
-        sold_qty = sold.get(pid, 0)
-        already = returned.get(pid, 0)
-        remaining = max(0, sold_qty - already)
-        if pid not in sold or qty > remaining:
-            return jsonify({"error": "Количество возврата по товару не может превышать оставшееся к возврату (продано минус уже возвращено)"}), 400
-        return_items.append({"product_id": pid, "quantity": qty})
+    try:
+        return_items, _increments = _return_lines(db.execute_prepared("pos_sale_lines", (original_id, sale_row[3])) or [], _requested_items(items))
+    except ReturnExceeded as e:
+        return jsonify({"error": str(e)}), 400
     if not return_items:
         return jsonify({"error": "Добавьте товары для возврата"}), 400
-    shift_row = db.execute_one(
-        """SELECT id_shift,
-           EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - shift_start))::BIGINT AS elapsed_sec
-           FROM shifts WHERE employee_id = %s AND store_id = %s AND shift_end IS NULL ORDER BY shift_start DESC LIMIT 1""",
-        (u["id"], u["store_id"]),
-    )
-    if not shift_row:
-        return jsonify({"error": "Сначала откройте смену"}), 400
-    shift_id, elapsed_sec = shift_row[0], (shift_row[1] or 0)
-    if elapsed_sec >= _shift_duration_seconds():
-        db.execute("UPDATE shifts SET shift_end = CURRENT_TIMESTAMP, status = 'closed' WHERE id_shift = %s", (shift_id,), fetch=False)
-        return jsonify({"error": "Смена закрыта по времени. Откройте новую смену."}), 400
+    shift_id, error = _open_shift_or_error(db, u, "Смена закрыта по времени. Откройте новую смену.")
+    if error:
+        return error
     store_id = u["store_id"]
-    total_revenue = total_cost = total_profit = 0
-    line_items = []
-    for it in return_items:
-        pid, qty = it["product_id"], it["quantity"]
-        prod = db.execute_one(
-            "SELECT retail_price, purchase_price FROM products WHERE id_product = %s",
-            (pid,),
-        )
-        if not prod:
-            continue
-        price, cost_unit = float(prod[0]), float(prod[1])
-        revenue = price * qty
-        cost = cost_unit * qty
-        profit = revenue - cost
-        total_revenue += revenue
-        total_cost += cost
-        total_profit += profit
-        line_items.append({"product_id": pid, "quantity": qty, "price": price, "cost": cost_unit, "revenue": revenue, "profit": profit})
+    line_items, total_revenue, total_cost, total_profit = _price_lines(_product_prices(db, [it["product_id"] for it in return_items]), return_items)
     if not line_items:
         return jsonify({"error": "Добавьте товары для возврата"}), 400
     try:
         with db.cursor() as cur:
-            cur.execute(
-                """INSERT INTO operations (operation_type, shift_id, employee_id, store_id, operation_date, total_revenue, total_cost, total_profit, created_at, original_operation_id)
-                   VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s, CURRENT_TIMESTAMP, %s) RETURNING id_operation""",
-                ("return", shift_id, u["id"], store_id, _round_money(total_revenue), _round_money(total_cost), _round_money(total_profit), original_id),
+            if idem_key:
+                db.run_prepared(cur, "idem_claim", (u["id"], idem_key, "return", request_hash))
+                if cur.fetchone() is None:
+                    db.run_prepared(cur, "idem_lookup", (u["id"], idem_key))
+                    return _replay(cur.fetchone(), "return", request_hash)
+            db.run_prepared(cur, "pos_lock_sale_lines", (original_id, sale_row[3]))
+            _items, increments = _return_lines(cur.fetchall(), return_items)
+            db.run_prepared(cur, "pos_mark_returned", ([i[0] for i in increments], [i[1] for i in increments], sale_row[3]))
+            db.run_prepared(cur, "pos_insert_operation", (
+                "return", shift_id, u["id"], store_id, _round_money(total_revenue), _round_money(total_cost), _round_money(total_profit), original_id,
+            ))
+            return_id, created_at = cur.fetchone()
+            db.insert_rows("operation_items", _ITEM_COLUMNS, [_item_row(return_id, created_at, it) for it in line_items], cur=cur)
+            stock = _stock_rows(store_id, line_items)
+            db.run_prepared(cur, "pos_lock_stock", (store_id, [r[1] for r in stock]))
+            db.insert_rows(
+                "store_product_stock", ("store_id", "product_id", "quantity"),
+                stock,
+                on_conflict="(store_id, product_id) DO UPDATE SET quantity = store_product_stock.quantity + EXCLUDED.quantity, update_date = CURRENT_TIMESTAMP",
+                cur=cur,
             )
-            return_id = cur.fetchone()[0]
-            for it in line_items:
-                cur.execute(
-                    """INSERT INTO operation_items (operation_id, product_id, quantity, unit_price, purchase_price, total_price, cost, profit)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (return_id, it["product_id"], it["quantity"], it["price"], it["cost"], it["revenue"], it["cost"], it["profit"]),
-                )
-                cur.execute(
-                    """INSERT INTO store_product_stock (store_id, product_id, quantity, update_date) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-                       ON CONFLICT (store_id, product_id) DO UPDATE SET quantity = store_product_stock.quantity + EXCLUDED.quantity, update_date = CURRENT_TIMESTAMP""",
-                    (store_id, it["product_id"], it["quantity"]),
-                )
+            db.run_prepared(cur, "pos_shift_totals", _shift_totals_params(shift_id, "return", 1, total_revenue, total_cost, total_profit))
+            if cur.fetchone() is None:
+                raise ShiftClosed()
+            db.run_prepared(cur, "sales_rollup_add", sales_rollup.add_params([(return_id, created_at)]))
+            body = {"ok": True, "return_id": return_id, "total": _round_money(total_revenue)}
+            if idem_key:
+                db.run_prepared(cur, "idem_store", (return_id, idempotency.dump_response(body), u["id"], idem_key))
+    except (ReturnExceeded, ShiftClosed) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         err = str(e)
         if "original_operation_id" in err and ("column" in err.lower() or "does not exist" in err.lower()):
             return jsonify({"error": "В базе нет колонки для возвратов. Выполните скрипт init_db.sql заново (блок с original_operation_id)."}), 500
         return jsonify({"error": "Ошибка при сохранении возврата: " + err}), 500
-    return jsonify({"ok": True, "return_id": return_id, "total": _round_money(total_revenue)})
+    stock_events.emit([it["product_id"] for it in line_items], store_id=store_id)
+    return jsonify(body)
 
 
 @bp.route("/receipt", methods=["POST"])
@@ -853,6 +1296,7 @@ def create_receipt():
             return jsonify({"error": str(e)}), 400
         finally:
             cur.close()
+        stock_events.emit([product_id], store_id=store_id)
     else:
         cur = db.get_cursor()
         try:
@@ -866,6 +1310,7 @@ def create_receipt():
             return jsonify({"error": str(e)}), 400
         finally:
             cur.close()
+        stock_events.emit([product_id], warehouse_id=warehouse_id)
     return jsonify({"ok": True})
 
 
@@ -903,72 +1348,228 @@ def create_distribution():
                 "INSERT INTO warehouse_product_stock (warehouse_id, product_id, quantity, update_date) VALUES (%s, %s, %s, CURRENT_TIMESTAMP) ON CONFLICT (warehouse_id, product_id) DO UPDATE SET quantity = warehouse_product_stock.quantity + EXCLUDED.quantity, update_date = CURRENT_TIMESTAMP",
                 (to_wh, product_id, quantity),
             )
+    stock_events.emit([product_id], warehouse_id=from_wh)
+    stock_events.emit([product_id], store_id=to_store or None, warehouse_id=None if to_store else to_wh)
     return jsonify({"ok": True})
 
 
+def _sales_filter(args):
+    """Условие " AND ..." и параметры отчёта о продажах для operations o.
+
+    Фильтры: date_from, date_to, store_id, employee_id, type (sale или return;
+    без него — продажи и возвраты). Неверная дата, число или тип — ValueError.
+    """
+    where, params = _day_range(args.get("date_from") or "", args.get("date_to") or "")
+    if args.get("type") not in (None, "", "sale", "return"):
+        raise ValueError("Неверный тип операции: %s" % args["type"])
+    if args.get("type"):
+        where += " AND o.operation_type = %s"
+        params.append(args["type"])
+    else:
+        where += " AND o.operation_type IN ('sale', 'return')"
+    for name in ("store_id", "employee_id"):
+        if args.get(name):
+            where += " AND o.%s = %%s" % name
+            params.append(int(args[name]))
+    return where, params
+
+
 @bp.route("/reports/sales", methods=["GET"])
+@report_cache.cached
 def report_sales():
+    """Продажи и возвраты, от новых к старым, страницами не больше REPORT_SALES_PAGE_SIZE.
+
+    Фильтры: date_from, date_to, store_id, employee_id, type (sale или return).
+    Следующая страница — параметр after со значением заголовка X-Next-Cursor
+    (курсор по created_at, id_operation, а не OFFSET, поэтому любая страница
+    читается по индексу за одно и то же время). С count=1 в X-Total-Count
+    отдаётся число строк по фильтрам без учёта страницы.
+    """
     if not _require_admin():
         return jsonify({"error": "Доступ запрещён"}), 403
-    db = get_db()
-    date_from = request.args.get("date_from") or ""
-    date_to = request.args.get("date_to") or ""
-    q = """SELECT o.id_operation, o.created_at, s.name AS store_name, e.full_name AS seller_name,
+    args = request.args
+    try:
+        where, params = _sales_filter(args)
+        cursor = _page_cursor(args.get("after"))
+        limit = _page_limit(args.get("limit"), REPORT_SALES_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Неверный формат даты, фильтра или курсора страницы"}), 400
+    db = get_db(readonly=True)
+    total = None
+    if args.get("count") in ("1", "true"):
+        row = db.execute_one("SELECT COUNT(*) FROM operations o WHERE 1=1" + where, tuple(params))
+        total = row[0] if row else 0
+    if cursor is not None:
+        # Отдельное условие на created_at отсекает секции новее курсора: сравнение строк для этого не годится
+        where += " AND o.created_at <= %s::timestamptz AND (o.created_at, o.id_operation) < (%s::timestamptz, %s::int)"
+        params += [cursor[0]] + list(cursor)
+    rows = db.execute(
+        """SELECT o.id_operation, o.created_at, s.name AS store_name, e.full_name AS seller_name,
                   o.total_revenue, o.total_cost, o.total_profit, o.operation_type, o.original_operation_id
            FROM operations o
            JOIN stores s ON s.id_store = o.store_id
            JOIN employees e ON e.id_employee = o.employee_id
-           WHERE (o.operation_type = 'sale' OR o.operation_type = 'return')
-           AND 1=1"""
-    params = []
-    if date_from:
-        q += " AND o.created_at::date >= %s"
-        params.append(date_from)
-    if date_to:
-        q += " AND o.created_at::date <= %s"
-        params.append(date_to)
-    q += " ORDER BY o.created_at DESC"
-    rows = db.execute(q, tuple(params)) if params else db.execute(q) or []
-    return jsonify([
-        {"id": r[0], "created_at": r[1].isoformat() if hasattr(r[1], "isoformat") else str(r[1]),
-         "store_name": r[2], "seller_name": r[3],
-         "total_revenue": _round_money(r[4]), "total_cost": _round_money(r[5]), "total_profit": _round_money(r[6]),
-         "operation_type": r[7] or "sale", "original_operation_id": r[8]}
-        for r in rows
-    ])
-
-
-@bp.route("/reports/summary", methods=["GET"])
-def report_summary():
+           WHERE 1=1""" + where + " ORDER BY o.created_at DESC, o.id_operation DESC LIMIT %s",
+        tuple(params) + (limit + 1,),
+    ) or []
+    resp = jsonify([{
+        "id": r[0], "created_at": r[1].isoformat() if hasattr(r[1], "isoformat") else str(r[1]),
+        "store_name": r[2], "seller_name": r[3],
+        "total_revenue": _round_money(r[4]), "total_cost": _round_money(r[5]), "total_profit": _round_money(r[6]),
+        "operation_type": r[7] or "sale", "original_operation_id": r[8],
+    } for r in rows[:limit]])
+    if len(rows) > limit:
+        resp.headers["X-Next-Cursor"] = "%s,%d" % (rows[limit - 1][1].isoformat(), rows[limit - 1][0])
+    if total is not None:
+        resp.headers["X-Total-Count"] = str(total)
+    return resp
+
+
+_EXPORT_HEADER = ["Операция", "Дата", "Тип", "Магазин", "Продавец", "Выручка", "Себестоимость", "Прибыль", "Исходный чек"]
+_EXPORT_ITEM_HEADER = ["Код товара", "Товар", "Количество", "Цена", "Сумма", "Себестоимость строки", "Прибыль строки", "Возвращено"]
+
+
+@bp.route("/reports/sales/export", methods=["GET"])
+def export_sales():
+    """Выгрузка отчёта о продажах целиком: format=csv (по умолчанию) или xlsx.
+
+    Фильтры те же, что у /api/reports/sales; с items=1 — по строке на каждую
+    позицию чека. Строки читаются серверным курсором и сразу уходят клиенту,
+    так что память не зависит от размера выгрузки.
+    """
     if not _require_admin():
         return jsonify({"error": "Доступ запрещён"}), 403
-    db = get_db()
-    date_from = request.args.get("date_from") or ""
-    date_to = request.args.get("date_to") or ""
-    base = " AND o.created_at::date >= %s" if date_from else ""
-    base += " AND o.created_at::date <= %s" if date_to else ""
-    params = ([date_from] if date_from else []) + ([date_to] if date_to else [])
-    q_sale = """SELECT COALESCE(SUM(o.total_revenue), 0), COALESCE(SUM(o.total_cost), 0), COALESCE(SUM(o.total_profit), 0)
-                FROM operations o WHERE o.operation_type = 'sale' AND 1=1""" + base
-    q_ret = """SELECT COALESCE(SUM(o.total_revenue), 0), COALESCE(SUM(o.total_cost), 0), COALESCE(SUM(o.total_profit), 0)
-               FROM operations o WHERE o.operation_type = 'return' AND 1=1""" + base
-    row_sale = db.execute_one(q_sale, tuple(params)) if params else db.execute_one(q_sale)
-    row_ret = db.execute_one(q_ret, tuple(params)) if params else db.execute_one(q_ret)
-    rev_sale = (row_sale[0] or 0) if row_sale else 0
-    cost_sale = (row_sale[1] or 0) if row_sale else 0
-    profit_sale = (row_sale[2] or 0) if row_sale else 0
-    rev_ret = (row_ret[0] or 0) if row_ret else 0
-    cost_ret = (row_ret[1] or 0) if row_ret else 0
-    profit_ret = (row_ret[2] or 0) if row_ret else 0
+    args = request.args
+    fmt = args.get("format") or "csv"
+    if fmt not in ("csv", "xlsx"):
+        return jsonify({"error": "Неверный формат выгрузки"}), 400
+    if fmt == "xlsx" and not report_export.xlsx_available():
+        return jsonify({"error": "Выгрузка в XLSX недоступна: установите пакет xlsxwriter"}), 400
+    try:
+        where, params = _sales_filter(args)
+    except ValueError:
+        return jsonify({"error": "Неверный формат даты или фильтра"}), 400
+    items = args.get("items") in ("1", "true")
+    header = _EXPORT_HEADER + (_EXPORT_ITEM_HEADER if items else [])
+    query = """SELECT o.id_operation, o.created_at, CASE o.operation_type WHEN 'return' THEN 'Возврат' ELSE 'Продажа' END,
+                      s.name, e.full_name, o.total_revenue, o.total_cost, o.total_profit, o.original_operation_id"""
+    if items:
+        query += """, oi.product_id, p.name, oi.quantity, oi.unit_price, oi.total_price, oi.cost, oi.profit, oi.returned_quantity
+           FROM operations o
+           JOIN operation_items oi ON oi.operation_id = o.id_operation AND oi.created_at = o.created_at
+           JOIN products p ON p.id_product = oi.product_id"""
+    else:
+        query += " FROM operations o"
+    query += """
+           JOIN stores s ON s.id_store = o.store_id
+           JOIN employees e ON e.id_employee = o.employee_id
+           WHERE 1=1""" + where + " ORDER BY o.created_at DESC, o.id_operation DESC" + (", oi.id" if items else "")
+    rows = get_db(readonly=True).stream(query, tuple(params), batch_size=REPORT_EXPORT_CHUNK_ROWS)
+    name = "_".join(["sales"] + [args[k] for k in ("date_from", "date_to") if args.get(k)]) + "." + fmt
+    headers = {"Content-Disposition": 'attachment; filename="%s"' % name, "X-Accel-Buffering": "no"}
+    if fmt == "xlsx":
+        chunks = report_export.xlsx_chunks(header, rows, sheet_name="Продажи")
+        return Response(stream_with_context(chunks), mimetype=report_export.XLSX_MIMETYPE, headers=headers)
+    return Response(stream_with_context(report_export.csv_chunks(header, rows)), mimetype="text/csv", headers=headers)
+
+
+# Суммы по строкам сводных таблиц sales_daily_store / sales_daily_product (псевдоним r)
+_ROLLUP_SUMS = """COALESCE(SUM(r.sales_revenue), 0), COALESCE(SUM(r.sales_cost), 0), COALESCE(SUM(r.sales_profit), 0),
+                  COALESCE(SUM(r.returns_revenue), 0), COALESCE(SUM(r.returns_cost), 0), COALESCE(SUM(r.returns_profit), 0),
+                  COALESCE(SUM(r.sales_quantity), 0), COALESCE(SUM(r.returns_quantity), 0)"""
+
+
+def _rollup_filter(args):
+    """Условие " AND ..." и параметры по дням (date_from, date_to включительно) и магазину (store_id) для сводки r.
+
+    Неверная дата или магазин — ValueError.
+    """
+    sql, params = "", []
+    if args.get("date_from"):
+        sql += " AND r.day >= %s"
+        params.append(date.fromisoformat(args["date_from"]))
+    if args.get("date_to"):
+        sql += " AND r.day <= %s"
+        params.append(date.fromisoformat(args["date_to"]))
+    if args.get("store_id"):
+        sql += " AND r.store_id = %s"
+        params.append(int(args["store_id"]))
+    return sql, params
+
+
+def _rollup_totals(sums):
+    """Итоги с учётом возвратов по восьми суммам _ROLLUP_SUMS."""
+    rev_sale, cost_sale, profit_sale, rev_ret, cost_ret, profit_ret, qty_sale, qty_ret = sums
     rev = rev_sale - rev_ret
-    cost = cost_sale - cost_ret
     profit = profit_sale - profit_ret
-    margin = _round_percent((profit / rev * 100) if rev else 0)
-    return jsonify({
+    return {
         "total_revenue": _round_money(rev),
-        "total_cost": _round_money(cost),
+        "total_cost": _round_money(cost_sale - cost_ret),
         "total_profit": _round_money(profit),
-        "margin_percent": margin,
+        "margin_percent": _round_percent((profit / rev * 100) if rev else 0),
         "total_revenue_sales": _round_money(rev_sale),
         "total_revenue_returns": _round_money(rev_ret),
-    })
+        "quantity_sold": int(qty_sale),
+        "quantity_returned": int(qty_ret),
+    }
+
+
+def _rollup_report(query):
+    """Ответ отчёта по сводке: query — запрос с подстановкой {sums} и {where}, строки — ключи и суммы."""
+    if not _require_admin():
+        return None, (jsonify({"error": "Доступ запрещён"}), 403)
+    try:
+        where, params = _rollup_filter(request.args)
+    except ValueError:
+        return None, (jsonify({"error": "Неверный формат даты или магазина"}), 400)
+    db = get_db(readonly=True)
+    return db.execute(query.format(sums=_ROLLUP_SUMS, where=where), tuple(params)) or [], None
+
+
+@bp.route("/reports/summary", methods=["GET"])
+@report_cache.cached
+def report_summary():
+    """Выручка, себестоимость и прибыль за период с учётом возвратов (по сводке магазин × день)."""
+    rows, error = _rollup_report("SELECT {sums} FROM sales_daily_store r WHERE 1=1{where}")
+    if error:
+        return error
+    return jsonify(_rollup_totals(rows[0]))
+
+
+@bp.route("/reports/by-store", methods=["GET"])
+@report_cache.cached
+def report_by_store():
+    rows, error = _rollup_report(
+        """SELECT r.store_id, s.name, {sums} FROM sales_daily_store r
+           JOIN stores s ON s.id_store = r.store_id
+           WHERE 1=1{where} GROUP BY r.store_id, s.name ORDER BY s.name"""
+    )
+    if error:
+        return error
+    return jsonify([{"store_id": r[0], "store_name": r[1], **_rollup_totals(r[2:])} for r in rows])
+
+
+@bp.route("/reports/by-day", methods=["GET"])
+@report_cache.cached
+def report_by_day():
+    rows, error = _rollup_report(
+        "SELECT r.day, {sums} FROM sales_daily_store r WHERE 1=1{where} GROUP BY r.day ORDER BY r.day"
+    )
+    if error:
+        return error
+    return jsonify([{"day": r[0].isoformat(), **_rollup_totals(r[1:])} for r in rows])
+
+
+@bp.route("/reports/by-product", methods=["GET"])
+@report_cache.cached
+def report_by_product():
+    """Итоги по товарам за период (store_id — по одному магазину), по убыванию чистой выручки."""
+    rows, error = _rollup_report(
+        """SELECT r.product_id, p.name, {sums} FROM sales_daily_product r
+           JOIN products p ON p.id_product = r.product_id
+           WHERE 1=1{where} GROUP BY r.product_id, p.name
+           ORDER BY SUM(r.sales_revenue) - SUM(r.returns_revenue) DESC, p.name"""
+    )
+    if error:
+        return error
+    return jsonify([{"product_id": r[0], "product_name": r[1], **_rollup_totals(r[2:])} for r in rows])
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Асинхронные версии читающих маршрутов API продавца для asgi.py.
+
+Здесь только то, что терминалы опрашивают постоянно или держат открытым:
+товары, текущая смена, поток событий смены, отчёт смены, продажи за день
+и строки чека. Пути и ответы совпадают с routes/api_routes.py, поэтому
+страницам продавца всё равно, какое приложение их обслуживает.
+
+Изменяющие маршруты (открытие и закрытие смены, продажа, пакет чеков,
+возврат) есть только в routes/api_routes.py: asgi.py передаёт их
+Flask-приложению, и логика транзакций чека существует в одном экземпляре.
+"""
+import asyncio
+import time
+
+from quart import Blueprint, Response, request, jsonify, session, g
+
+from async_database import get_async_db
+from auth_util import user_cache, user_from_row, CURRENT_USER_QUERY
+import shift_events
+from routes.api_routes import (
+    _round_money, _shift_duration_seconds, _sales_page_args, _sales_page_params, _sales_page,
+    _shift_status, _shift_body, _shift_closed, _sse, _next_tick, SSE_HEADERS, _shift_report_body,
+    SHIFT_REPORT_SNAPSHOT_QUERY, SHIFT_REPORT_LIVE_QUERY, SHIFT_REPORT_RECEIPTS_QUERY,
+)
+
+bp = Blueprint("async_api_routes", __name__)
+
+
+async def current_user():
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    if "user" not in g:
+        user = user_cache.get(user_id)
+        if user is None:
+            generation = user_cache.generation
+            user = user_from_row(await get_async_db().execute_one(CURRENT_USER_QUERY, (user_id,)))
+            user_cache.put(user_id, user, generation)
+        g.user = user
+    return g.user
+
+
+async def _require_seller():
+    u = await current_user()
+    if not u or u["role"] != "seller":
+        return None
+    return u
+
+
+@bp.route("/products", methods=["GET"])
+async def list_products():
+    u = await current_user()
+    if not u:
+        return jsonify({"error": "Авторизуйтесь"}), 403
+    rows = await get_async_db().execute(
+        """SELECT p.id_product, p.name, p.unit, p.purchase_price, p.retail_price, p.min_stock_level
+           FROM products p WHERE p.is_active = TRUE ORDER BY p.name"""
+    ) or []
+    return jsonify([
+        {"id": r[0], "name": r[1], "unit": r[2], "purchase_price": _round_money(r[3]), "retail_price": _round_money(r[4]), "min_stock": r[5]}
+        for r in rows
+    ])
+
+
+@bp.route("/shifts/current", methods=["GET"])
+async def current_shift():
+    u = await _require_seller()
+    if not u:
+        return jsonify({"error": "Доступ только для продавца"}), 403
+    body, _open = await _current_shift_status(get_async_db(), u)
+    return jsonify(body)
+
+
+async def _current_shift_status(db, u):
+    async with db.cursor() as cur:
+        await db.execute_statement(cur, "pos_current_shift", (u["id"], u["store_id"]))
+        return _shift_status(await cur.fetchone())
+
+
+@bp.route("/shifts/events", methods=["GET"])
+async def shift_events_stream():
+    u = await _require_seller()
+    if not u:
+        return jsonify({"error": "Доступ только для продавца"}), 403
+    db = get_async_db()
+    body, shift = await _current_shift_status(db, u)
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def deliver(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    shift_events.subscribe(u["id"], deliver)
+
+    async def generate():
+        nonlocal body, shift
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                yield _sse(body)
+                read_at = time.monotonic()
+                while True:
+                    elapsed = shift[2] + time.monotonic() - read_at if shift else 0
+                    try:
+                        await asyncio.wait_for(events.get(), _next_tick(elapsed) if shift else 60)
+                        break
+                    except asyncio.TimeoutError:
+                        if not shift:
+                            yield ": keepalive\n\n"
+                            continue
+                    elapsed = shift[2] + time.monotonic() - read_at
+                    if elapsed >= _shift_duration_seconds():
+                        break
+                    yield _sse(_shift_body(shift[0], shift[1], elapsed))
+                prev = shift
+                body, shift = await _current_shift_status(db, u)
+                body = _shift_closed(prev, body)
+        finally:
+            shift_events.unsubscribe(u["id"], deliver)
+
+    resp = Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+    resp.timeout = None
+    return resp
+
+
+@bp.route("/shifts/<int:shift_id>/report", methods=["GET"])
+async def shift_report_api(shift_id):
+    db = get_async_db()
+    row = await db.execute_one(SHIFT_REPORT_SNAPSHOT_QUERY, (shift_id,))
+    if row:
+        return jsonify(_shift_report_body(row[:-1], row[-1]))
+    header = await db.execute_one(SHIFT_REPORT_LIVE_QUERY, (shift_id,))
+    if not header:
+        return jsonify({"error": "Смена не найдена"}), 404
+    receipts = await db.execute(SHIFT_REPORT_RECEIPTS_QUERY, (shift_id,)) or []
+    return jsonify(_shift_report_body(header, receipts))
+
+
+@bp.route("/sales/by-store-date", methods=["GET"])
+async def sales_by_store_date():
+    u = await _require_seller()
+    if not u:
+        return jsonify({"error": "Доступ только для продавца"}), 403
+    if not request.args.get("date"):
+        return jsonify([])
+    try:
+        day, cursor, limit = _sales_page_args(request.args)
+    except ValueError:
+        return jsonify({"error": "Неверная дата или курсор страницы"}), 400
+    db = get_async_db()
+    async with db.cursor() as cur:
+        await db.execute_statement(cur, "pos_sales_for_return", _sales_page_params(u["store_id"], day, cursor, limit))
+        rows = await cur.fetchall()
+    page, next_cursor = _sales_page(rows, limit)
+    resp = jsonify(page)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp
+
+
+@bp.route("/operations/<int:op_id>/items", methods=["GET"])
+async def operation_items(op_id):
+    u = await _require_seller()
+    if not u:
+        return jsonify({"error": "Доступ только для продавца"}), 403
+    db = get_async_db()
+    async with db.cursor() as cur:
+        await db.execute_statement(cur, "pos_sale_header", (op_id,))
+        op = await cur.fetchone()
+        if not op or op[1] != u["store_id"] or op[2] != "sale":
+            return jsonify({"error": "Продажа не найдена или доступ запрещён"}), 404
+        await cur.execute(
+            """SELECT oi.product_id, p.name, oi.quantity, oi.unit_price, oi.total_price, oi.returned_quantity
+               FROM operation_items oi
+               JOIN products p ON p.id_product = oi.product_id
+               WHERE oi.operation_id = %s AND oi.created_at = %s ORDER BY oi.product_id, oi.id""",
+            (op_id, op[3]),
+        )
+        rows = await cur.fetchall()
+    out = []
+    for pid, name, sold, uprice, tprice, already in rows:
+        out.append({
+            "product_id": pid, "product_name": name,
+            "quantity": sold, "already_returned": already, "remaining": max(0, sold - already),
+            "unit_price": _round_money(uprice), "total_price": _round_money(tprice),
+        })
+    return jsonify(out)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, render_template, redirect, url_for, request
 from auth_util import current_user, require_seller, get_db
+import shift_events
 
 bp = Blueprint("seller_routes", __name__, template_folder="../templates")
 
@@ -43,7 +44,9 @@ def seller_main():
     if shift:
         id_shift, shift_start, elapsed_sec = shift[0], shift[1], (shift[2] or 0)
         if elapsed_sec >= _duration_sec:
-            db.execute("UPDATE shifts SET shift_end = CURRENT_TIMESTAMP, status = 'closed' WHERE id_shift = %s", (id_shift,), fetch=False)
+            # Просроченная смена закрывается концом срока, не дожидаясь фоновой задачи,
+            # чтобы отчёт показал её закрытой, а следующий заход открыл новую
+            shift_events.expire_shifts(db, user["id"])
             return redirect(url_for("seller_routes.shift_report", shift_id=id_shift))
         opened = shift_start
         if opened.tzinfo is None:
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Сводные таблицы продаж по дням для отчётов.
+
+sales_daily_store (магазин × день) и sales_daily_product (товар × магазин ×
+день) хранят число чеков, количество, выручку, себестоимость и прибыль
+отдельно по продажам и возвратам. Чек продажи, пакет чеков и возврат
+добавляют свои операции к сводке в своей же транзакции (функция
+sales_rollup_add в init_db.sql), поэтому отчёты по сводке всегда совпадают
+с operations и читают не больше одной строки на магазин и день.
+
+День — дата операции в часовом поясе STORE_TIMEZONE. После смены
+STORE_TIMEZONE или правки operations вручную сводку нужно перестроить:
+flask rebuild-rollups [--date-from ГГГГ-ММ-ДД] [--date-to ГГГГ-ММ-ДД].
+"""
+import logging
+from datetime import date
+
+from auth_util import get_pool
+from config import STORE_TIMEZONE
+from database import Database, register_statement
+
+
+logger = logging.getLogger(__name__)
+
+register_statement("sales_rollup_add", "SELECT sales_rollup_add(%s::int[], %s::timestamptz[], %s)")
+
+_TZ = "COALESCE(NULLIF(%s::text, ''), current_setting('TimeZone'))"
+
+
+def add_params(operations):
+    """Параметры sales_rollup_add для операций чека — пар (id_operation, created_at); вызывать в транзакции чека."""
+    operations = list(operations)
+    return [op[0] for op in operations], [op[1] for op in operations], STORE_TIMEZONE
+
+
+def _months(date_from, date_to):
+    """Полуоткрытые интервалы [начало, конец) по месяцам, покрывающие дни с date_from по date_to."""
+    start = date_from
+    while start <= date_to:
+        end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        yield start, min(end, date.fromordinal(date_to.toordinal() + 1))
+        start = end
+
+
+def rebuild(date_from=None, date_to=None, pool=None):
+    """Пересчитывает сводку за дни с date_from по date_to (по умолчанию — за всю историю).
+
+    Считает по месяцам, каждый месяц в своей транзакции. На время пересчёта
+    месяца сводные таблицы блокируются от записи: чеки, проведённые в это
+    время, дождутся конца пересчёта и добавятся к уже пересчитанной сводке.
+    Возвращает число пересчитанных операций.
+    """
+    db = Database(pool=pool or get_pool())
+    try:
+        if date_from is None or date_to is None:
+            row = db.execute_one(
+                "SELECT MIN((created_at AT TIME ZONE " + _TZ + ")::date), MAX((created_at AT TIME ZONE " + _TZ + ")::date) FROM operations",
+                (STORE_TIMEZONE, STORE_TIMEZONE),
+            )
+            if not row or row[0] is None:
+                with db.cursor() as cur:
+                    cur.execute("TRUNCATE sales_daily_store, sales_daily_product")
+                return 0
+            date_from = date_from or row[0]
+            date_to = date_to or row[1]
+            # Дни вне истории операций (например, удалённых вручную) из сводки убираются
+            with db.cursor() as cur:
+                for table in ("sales_daily_store", "sales_daily_product"):
+                    cur.execute("DELETE FROM " + table + " WHERE day < %s OR day > %s", (date_from, date_to))
+        total = 0
+        for start, end in _months(date_from, date_to):
+            with db.cursor() as cur:
+                cur.execute("LOCK TABLE sales_daily_store, sales_daily_product IN EXCLUSIVE MODE")
+                cur.execute("DELETE FROM sales_daily_store WHERE day >= %s AND day < %s", (start, end))
+                cur.execute("DELETE FROM sales_daily_product WHERE day >= %s AND day < %s", (start, end))
+                cur.execute(
+                    """SELECT id_operation, created_at FROM operations
+                       WHERE created_at >= %s::timestamp AT TIME ZONE """ + _TZ + """
+                         AND created_at < %s::timestamp AT TIME ZONE """ + _TZ,
+                    (start, STORE_TIMEZONE, end, STORE_TIMEZONE),
+                )
+                ids = cur.fetchall()
+                db.run_prepared(cur, "sales_rollup_add", add_params(ids))
+            total += len(ids)
+            logger.info("sales rollup rebuilt for %s..%s: %d operations", start, end, len(ids))
+        return total
+    finally:
+        db.close()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""События смен продавцов (открытие и закрытие) для потока /api/shifts/events.
+
+Любое открытие или закрытие смены (в том числе в другом процессе или вне
+приложения) триггер trg_shifts_notify сообщает через NOTIFY в канал
+SHIFT_EVENTS_CHANNEL: {"shift_id", "employee_id", "store_id", "closed"}.
+Поток-слушатель процесса раздаёт события подписчикам этого сотрудника —
+открытым потокам SSE. Между событиями поток SSE сам сообщает прошедшее время
+смены и к БД не обращается.
+
+После каждого подключения слушателя (события за время обрыва могли
+потеряться) всем подписчикам отправляется {"resync": True}, и они
+перечитывают смену из БД.
+
+Смены дольше SHIFT_DURATION_HOURS закрывает фоновая задача close_expired
+(jobs.py) одним UPDATE; события о закрытии отправляет тот же триггер.
+Открытие и закрытие смены, вход, выход и главная страница продавца сначала тем
+же UPDATE закрывают просроченную смену продавца (expire_shifts), не дожидаясь
+задачи; остальные обработчики запросов только считают её закрытой.
+"""
+import json
+import logging
+import select
+import threading
+import time
+
+import psycopg2
+
+from auth_util import get_pool
+from config import SHIFT_DURATION_HOURS, SHIFT_DURATION_SECONDS, SHIFT_EVENTS_CHANNEL
+from database import Database, db_params_from_env
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_subscribers = {}                     # employee_id -> множество функций доставки
+_state = {"thread": None, "connected": False, "events": 0, "reconnects": 0}
+
+
+def subscribe(employee_id, deliver):
+    """Подписывает deliver(событие) на смены сотрудника.
+
+    deliver вызывается из потока-слушателя и не должен блокироваться
+    (например, queue.Queue.put_nowait или loop.call_soon_threadsafe).
+    """
+    with _lock:
+        _subscribers.setdefault(employee_id, set()).add(deliver)
+
+
+def unsubscribe(employee_id, deliver):
+    with _lock:
+        subs = _subscribers.get(employee_id)
+        if subs is not None:
+            subs.discard(deliver)
+            if not subs:
+                del _subscribers[employee_id]
+
+
+def publish(employee_id, event):
+    """Доставляет событие подписчикам сотрудника (employee_id=None — всем)."""
+    with _lock:
+        if employee_id is None:
+            targets = [d for subs in _subscribers.values() for d in subs]
+        else:
+            targets = list(_subscribers.get(employee_id, ()))
+    for deliver in targets:
+        try:
+            deliver(event)
+        except Exception as e:
+            logger.warning("shift event delivery failed: %s", e)
+
+
+def _dispatch(payload):
+    try:
+        event = json.loads(payload)
+        employee_id = int(event["employee_id"])
+    except (ValueError, KeyError, TypeError):
+        logger.warning("bad shift event payload: %r", payload)
+        return
+    _state["events"] += 1
+    publish(employee_id, event)
+
+
+def _listen():
+    backoff = 1
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**db_params_from_env())
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("LISTEN " + SHIFT_EVENTS_CHANNEL)
+            # Подписчики, открытые до LISTEN, могли пропустить события
+            publish(None, {"resync": True})
+            _state["connected"] = True
+            backoff = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    cur.execute("SELECT 1")
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _dispatch(conn.notifies.pop(0).payload)
+        except Exception as e:
+            _state["connected"] = False
+            _state["reconnects"] += 1
+            logger.warning("shift events listener disconnected, retry in %d s: %s", backoff, e)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def expire_shifts(db, employee_id=None):
+    """Закрывает смены (все или одного сотрудника), открытые дольше установленного срока; возвращает их id.
+
+    Время закрытия — конец срока смены, а не момент запуска, чтобы забытая
+    смена не растягивалась в отчётах.
+    """
+    duration = SHIFT_DURATION_SECONDS if SHIFT_DURATION_SECONDS is not None else SHIFT_DURATION_HOURS * 3600
+    with db.cursor() as cur:
+        cur.execute(
+            """UPDATE shifts SET shift_end = shift_start + %s * INTERVAL '1 second', status = 'closed'
+               WHERE shift_end IS NULL AND shift_start <= CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                 AND (%s::int IS NULL OR employee_id = %s)
+               RETURNING id_shift""",
+            (duration, duration, employee_id, employee_id),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def close_expired(pool=None):
+    """Фоновая задача: закрывает все просроченные смены (expire_shifts); возвращает их число."""
+    db = Database(pool=pool or get_pool())
+    try:
+        return len(expire_shifts(db))
+    finally:
+        db.close()
+
+
+def start():
+    """Запускает слушатель уведомлений (один на процесс)."""
+    with _lock:
+        if _state["thread"] is None:
+            _state["thread"] = threading.Thread(target=_listen, name="shift-events", daemon=True)
+            _state["thread"].start()
+
+
+def status():
+    with _lock:
+        subscribers = sum(len(subs) for subs in _subscribers.values())
+    return {
+        "connected": _state["connected"], "subscribers": subscribers,
+        "events": _state["events"], "reconnects": _state["reconnects"],
+    }
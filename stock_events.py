@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Уведомления о низких остатках по событиям изменения остатков.
+
+Продажа, возврат, поступление и распределение после commit сообщают, какие
+остатки изменились (emit). События копятся в очереди процесса и
+обрабатываются фоновым потоком: всё, что пришло за STOCK_EVENTS_COALESCE_SECONDS,
+склеивается, повторы одной пары (магазин/склад, товар) схлопываются, и
+уведомления обновляются одним запросом по текущим остаткам:
+
+- остаток ниже products.min_stock_level — создаётся уведомление, а если
+  непрочитанное для этой пары уже есть, в нём обновляется количество;
+- остаток снова не ниже порога — непрочитанное уведомление помечается resolved.
+
+На одну пару бывает не больше одного непрочитанного уведомления
+(уникальный частичный индекс в init_db.sql), поэтому параллельные процессы
+не создают дублей. События, потерянные при переполнении очереди или
+перезапуске, подбирает периодическая сверка всех остатков (sweep, jobs.py).
+"""
+import logging
+import queue
+import threading
+import time
+
+from auth_util import get_pool
+from config import STOCK_EVENTS_COALESCE_SECONDS, STOCK_EVENTS_QUEUE_SIZE
+from database import Database, register_statement
+
+
+logger = logging.getLogger(__name__)
+
+register_statement("stock_refresh_notifications", """WITH changed AS (
+             SELECT DISTINCT * FROM unnest(%s::int[], %s::int[], %s::int[]) AS c(store_id, warehouse_id, product_id)
+           ),
+           levels AS (
+             SELECT c.store_id, c.warehouse_id, c.product_id, COALESCE(s.quantity, w.quantity, 0) AS quantity, p.min_stock_level
+             FROM changed c
+             JOIN products p ON p.id_product = c.product_id
+             LEFT JOIN store_product_stock s ON s.store_id = c.store_id AND s.product_id = c.product_id
+             LEFT JOIN warehouse_product_stock w ON w.warehouse_id = c.warehouse_id AND w.product_id = c.product_id
+           ),
+           resolved AS (
+             UPDATE notifications n SET status = 'resolved'
+             FROM levels l
+             WHERE n.status = 'unread' AND n.product_id = l.product_id
+               AND n.store_id IS NOT DISTINCT FROM l.store_id AND n.warehouse_id IS NOT DISTINCT FROM l.warehouse_id
+               AND l.quantity >= l.min_stock_level
+             RETURNING n.id
+           ),
+           raised AS (
+             INSERT INTO notifications (product_id, store_id, warehouse_id, current_quantity, threshold, status, created_at)
+             SELECT product_id, store_id, warehouse_id, quantity, min_stock_level, 'unread', CURRENT_TIMESTAMP
+             FROM levels WHERE quantity < min_stock_level
+             ON CONFLICT (product_id, COALESCE(store_id, 0), COALESCE(warehouse_id, 0)) WHERE status = 'unread'
+             DO UPDATE SET current_quantity = EXCLUDED.current_quantity, threshold = EXCLUDED.threshold
+               WHERE notifications.current_quantity <> EXCLUDED.current_quantity OR notifications.threshold <> EXCLUDED.threshold
+             RETURNING (xmax = 0) AS inserted
+           )
+           SELECT (SELECT COUNT(*) FROM raised WHERE inserted), (SELECT COUNT(*) FROM raised WHERE NOT inserted), (SELECT COUNT(*) FROM resolved)""")
+
+_queue = queue.Queue(maxsize=STOCK_EVENTS_QUEUE_SIZE)
+_lock = threading.Lock()
+_state = {"thread": None, "events": 0, "dropped": 0, "batches": 0, "keys": 0, "errors": 0}
+
+
+def emit(product_ids, store_id=None, warehouse_id=None):
+    """Сообщает об изменении остатков товаров в магазине или на складе (вызывать после commit)."""
+    for pid in product_ids:
+        try:
+            _queue.put_nowait((int(store_id) if store_id else None, int(warehouse_id) if warehouse_id else None, int(pid)))
+            _state["events"] += 1
+        except queue.Full:
+            _state["dropped"] += 1
+
+
+def refresh(keys, pool=None):
+    """Обновляет уведомления по парам (store_id, warehouse_id, product_id); возвращает (создано, обновлено, снято)."""
+    keys = list(keys)
+    if not keys:
+        return 0, 0, 0
+    db = Database(pool=pool or get_pool())
+    try:
+        row = db.execute_prepared_one("stock_refresh_notifications", (
+            [k[0] for k in keys], [k[1] for k in keys], [k[2] for k in keys],
+        ))
+    finally:
+        db.close()
+    return tuple(int(v or 0) for v in row)
+
+
+def sweep(pool=None):
+    """Сверяет уведомления со всеми остатками (на случай потерянных событий)."""
+    db = Database(pool=pool or get_pool())
+    try:
+        keys = db.execute(
+            """SELECT store_id, NULL::int, product_id FROM store_product_stock
+               UNION ALL
+               SELECT NULL::int, warehouse_id, product_id FROM warehouse_product_stock"""
+        ) or []
+    finally:
+        db.close()
+    return refresh(keys, pool=pool)
+
+
+def _run():
+    while True:
+        keys = {_queue.get()}
+        deadline = time.monotonic() + STOCK_EVENTS_COALESCE_SECONDS
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                keys.add(_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            created, updated, resolved = refresh(keys)
+        except Exception as e:
+            _state["errors"] += 1
+            logger.warning("low stock refresh failed for %d keys: %s", len(keys), e)
+            continue
+        _state["batches"] += 1
+        _state["keys"] += len(keys)
+        if created or updated or resolved:
+            logger.info("low stock notifications: %d created, %d updated, %d resolved", created, updated, resolved)
+
+
+def start():
+    """Запускает фоновый обработчик событий (один на процесс)."""
+    with _lock:
+        if _state["thread"] is None:
+            _state["thread"] = threading.Thread(target=_run, name="stock-events", daemon=True)
+            _state["thread"].start()
+
+
+def status():
+    return {
+        "running": _state["thread"] is not None,
+        "queued": _queue.qsize(),
+        **{k: _state[k] for k in ("events", "dropped", "batches", "keys", "errors")},
+    }
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Расчёт строк чека и разбор чеков пакета в routes/api_routes.py (без БД)."""
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from config import SALES_BATCH_CLOCK_SKEW_SECONDS
+from routes.api_routes import StockShortage, _batch_receipt, _client_time, _price_lines, _shortage, _stock_rows
+
+
+SKEW = timedelta(seconds=SALES_BATCH_CLOCK_SKEW_SECONDS)
+
+
+def _receipt(client_id="r1", created_at=None, items=None):
+    return {
+        "client_id": client_id,
+        "created_at": created_at or datetime.now(timezone.utc).isoformat(),
+        "items": items if items is not None else [{"product_id": 1, "quantity": 2}],
+    }
+
+
+class PriceLinesTest(unittest.TestCase):
+    def test_totals_and_unknown_products(self):
+        prices = {1: (15.0, 10.0), 2: (7.5, 5.0)}
+        items = [{"product_id": 1, "quantity": 2}, {"product_id": 9, "quantity": 1}, {"product_id": 2, "quantity": 4}]
+        lines, revenue, cost, profit = _price_lines(prices, items)
+        self.assertEqual([it["product_id"] for it in lines], [1, 2])
+        self.assertEqual(lines[0], {"product_id": 1, "quantity": 2, "price": 15.0, "cost": 10.0, "revenue": 30.0, "profit": 10.0})
+        self.assertEqual((revenue, cost, profit), (60.0, 40.0, 20.0))
+
+    def test_stock_rows_sum_repeated_products(self):
+        lines = [{"product_id": 3, "quantity": 1}, {"product_id": 1, "quantity": 2}, {"product_id": 3, "quantity": 4}]
+        self.assertEqual(_stock_rows(7, lines), [(7, 1, 2), (7, 3, 5)])
+
+
+class ShortageTest(unittest.TestCase):
+    def test_first_line_not_taken(self):
+        lines = [{"product_id": 1, "quantity": 2}, {"product_id": 2, "quantity": 5}, {"product_id": 3, "quantity": 1}]
+        error = _shortage(lines, taken={1: 8}, levels={2: 3})
+        self.assertIsInstance(error, StockShortage)
+        self.assertEqual(error.available, 3)
+
+    def test_missing_stock_row_is_zero(self):
+        error = _shortage([{"product_id": 4, "quantity": 1}], taken={}, levels={})
+        self.assertEqual(error.available, 0)
+
+    def test_everything_taken(self):
+        self.assertIsNone(_shortage([{"product_id": 1, "quantity": 1}], taken={1: 0}, levels={}))
+
+
+class ClientTimeTest(unittest.TestCase):
+    def test_z_suffix_and_offset(self):
+        self.assertEqual(_client_time("2020-10-18T10:00:00Z"), datetime(2020, 10, 18, 10, tzinfo=timezone.utc))
+        self.assertEqual(_client_time("2020-10-18T13:00:00+03:00"), datetime(2020, 10, 18, 10, tzinfo=timezone.utc))
+
+    def test_naive_time_gets_local_zone(self):
+        self.assertIsNotNone(_client_time("2020-10-18T10:00:00").tzinfo)
+
+    def test_missing_or_malformed(self):
+        for value in (None, "", "вчера", "2026-13-01T00:00:00"):
+            with self.assertRaises(ValueError):
+                _client_time(value)
+
+    def test_future_bound(self):
+        now = datetime.now(timezone.utc)
+        _client_time((now + SKEW - timedelta(seconds=5)).isoformat())
+        with self.assertRaisesRegex(ValueError, "в будущем"):
+            _client_time((now + SKEW + timedelta(seconds=5)).isoformat())
+
+    def test_past_bound_is_shift_start(self):
+        shift_start = datetime.now(timezone.utc) - timedelta(hours=2)
+        _client_time((shift_start - SKEW + timedelta(seconds=5)).isoformat(), shift_start)
+        with self.assertRaisesRegex(ValueError, "раньше начала смены"):
+            _client_time((shift_start - SKEW - timedelta(seconds=5)).isoformat(), shift_start)
+        with self.assertRaisesRegex(ValueError, "раньше начала смены"):
+            _client_time("0001-01-01T00:00:00+00:00", shift_start)
+
+
+class BatchReceiptTest(unittest.TestCase):
+    def test_valid_receipt(self):
+        receipt, error = _batch_receipt(_receipt(), set())
+        self.assertIsNone(error)
+        self.assertEqual(receipt["client_id"], "r1")
+        self.assertEqual(receipt["items"], [{"product_id": 1, "quantity": 2}])
+
+    def test_duplicate_client_id(self):
+        seen = set()
+        self.assertIsNone(_batch_receipt(_receipt(), seen)[1])
+        receipt, error = _batch_receipt(_receipt(), seen)
+        self.assertIsNone(receipt)
+        self.assertIn("повторяется", error)
+
+    def test_same_items_hash_as_single_sale(self):
+        a, _error = _batch_receipt(_receipt("a"), set())
+        b, _error = _batch_receipt(_receipt("b", created_at="2020-10-18T10:00:00Z"), set())
+        self.assertEqual(a["request_hash"], b["request_hash"])
+
+    def test_rejected_receipts(self):
+        shift_start = datetime.now(timezone.utc) - timedelta(hours=1)
+        cases = [
+            ({"items": [{"product_id": 1, "quantity": 1}]}, "client_id"),
+            (_receipt(items=[]), "товары"),
+            (_receipt(created_at="2020-01-01T00:00:00Z"), "раньше начала смены"),
+            ("не объект", "client_id"),
+        ]
+        for rc, message in cases:
+            receipt, error = _batch_receipt(rc, set(), shift_start)
+            self.assertIsNone(receipt)
+            self.assertIn(message, error)
+
+
+if __name__ == "__main__":
+    unittest.main()
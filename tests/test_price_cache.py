@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Вытеснение и поколения PriceCache (без БД и слушателя)."""
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+import price_cache
+from price_cache import PriceCache
+
+
+def _cache(capacity=3):
+    cache = PriceCache(capacity)
+    cache.set_enabled(True)
+    return cache
+
+
+def _row(pid):
+    return (pid, Decimal(pid) + Decimal("0.5"), Decimal(pid))
+
+
+def _cached(cache):
+    return set(cache._slots)
+
+
+class GetPutTest(unittest.TestCase):
+    def test_round_trip_in_cents(self):
+        cache = _cache()
+        cache.put_many([(1, Decimal("15.99"), Decimal("10.10"))], cache.generation)
+        found, missing, _generation = cache.get_many([1, 2])
+        self.assertEqual(found, {1: (15.99, 10.1)})
+        self.assertEqual(missing, [2])
+
+    def test_disabled_cache_reads_everything_from_db(self):
+        cache = PriceCache(3)
+        cache.put_many([_row(1)], cache.generation)
+        found, missing, _generation = cache.get_many([1])
+        self.assertEqual((found, missing), ({}, [1]))
+
+    def test_zero_capacity(self):
+        cache = _cache(0)
+        cache.put_many([_row(1)], cache.generation)
+        self.assertEqual(_cached(cache), set())
+
+
+class EvictionTest(unittest.TestCase):
+    def test_clock_skips_recently_used(self):
+        cache = _cache(3)
+        cache.put_many([_row(1), _row(2), _row(3)], cache.generation)
+        # Первый проход стрелки снимает биты обращения у всех ячеек и вытесняет товар 1
+        cache.put_many([_row(4)], cache.generation)
+        self.assertEqual(_cached(cache), {2, 3, 4})
+        # Товар 2 с тех пор не читался, а 3 читался: вытесняется 2
+        cache.get_many([3])
+        cache.put_many([_row(5)], cache.generation)
+        self.assertEqual(_cached(cache), {3, 4, 5})
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_invalidated_slot_is_reused_before_eviction(self):
+        cache = _cache(3)
+        cache.put_many([_row(1), _row(2), _row(3)], cache.generation)
+        cache.invalidate([2])
+        cache.put_many([_row(4)], cache.generation)
+        self.assertEqual(_cached(cache), {1, 3, 4})
+        self.assertEqual(cache.stats()["evictions"], 0)
+        self.assertEqual(cache.get_many([4])[0], {4: (4.5, 4.0)})
+
+
+class GenerationTest(unittest.TestCase):
+    def test_rows_read_before_invalidate_are_not_stored(self):
+        cache = _cache()
+        _found, _missing, generation = cache.get_many([1])
+        cache.invalidate([1])
+        cache.put_many([_row(1)], generation)
+        self.assertEqual(cache.get_many([1])[1], [1])
+
+    def test_rows_read_before_reset_are_not_stored(self):
+        cache = _cache()
+        _found, _missing, generation = cache.get_many([1])
+        cache.set_enabled(False)
+        cache.set_enabled(True)
+        cache.put_many([_row(1)], generation)
+        self.assertEqual(_cached(cache), set())
+
+    def test_reset_drops_everything(self):
+        cache = _cache()
+        cache.put_many([_row(1), _row(2)], cache.generation)
+        cache.invalidate()
+        self.assertEqual(_cached(cache), set())
+        cache.put_many([_row(3)], cache.generation)
+        self.assertEqual(cache.get_many([3])[0], {3: (3.5, 3.0)})
+
+    def test_lookup_fetches_only_missing(self):
+        cache = _cache()
+        cache.put_many([_row(1)], cache.generation)
+        fetch = mock.Mock(return_value=[_row(2)])
+        with mock.patch.object(price_cache, "cache", cache):
+            prices = price_cache.lookup([1, 2], fetch)
+            self.assertEqual(set(prices), {1, 2})
+            fetch.assert_called_once_with([2])
+            price_cache.lookup([1, 2], fetch)
+        self.assertEqual(fetch.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Область ответов и сверка версий ReportCache (без БД и слушателя)."""
+import unittest
+from datetime import date
+
+from flask import Response
+
+import report_cache
+from report_cache import ReportCache, _covers, _parse
+
+
+D1, D2, D3 = date(2026, 10, 1), date(2026, 10, 2), date(2026, 10, 3)
+
+
+def _response(body="{}"):
+    resp = Response(body, mimetype="application/json")
+    resp.headers["X-Total-Count"] = "1"
+    return resp
+
+
+def _cache(stale_seconds=0):
+    cache = ReportCache(8, stale_seconds)
+    cache.set_enabled(True)
+    return cache
+
+
+class CoversTest(unittest.TestCase):
+    def test_period_and_store(self):
+        self.assertTrue(_covers((D1, D2, 1), D2, 1))
+        self.assertFalse(_covers((D1, D2, 1), D3, 1))
+        self.assertFalse(_covers((D1, D2, 1), D1, 2))
+
+    def test_open_bounds_and_all_stores(self):
+        self.assertTrue(_covers((None, None, None), D3, 5))
+        self.assertTrue(_covers((D2, None, None), D3, 1))
+        self.assertFalse(_covers((None, D1, None), D2, 1))
+
+    def test_parse(self):
+        self.assertEqual(_parse("2026-10-02:3"), (D2, 3))
+        self.assertIsNone(_parse(""))
+        self.assertIsNone(_parse("2026-10-02"))
+
+
+class PutTest(unittest.TestCase):
+    def test_put_and_get(self):
+        cache = _cache()
+        entry, state, version = cache.get("k")
+        self.assertEqual(state, "miss")
+        cache.put("k", (D1, D2, 1), _response(), version)
+        entry, state, _version = cache.get("k")
+        self.assertEqual(state, "hit")
+        self.assertEqual(entry.headers, [("X-Total-Count", "1")])
+
+    def test_disabled_cache_is_bypassed(self):
+        cache = ReportCache(8)
+        _entry, state, version = cache.get("k")
+        self.assertEqual(state, "bypass")
+        cache.put("k", (D1, D2, 1), _response(), version)
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_change_in_scope_while_reading_rejects_put(self):
+        cache = _cache()
+        _entry, _state, version = cache.get("k")
+        cache.invalidate([(D2, 1)])
+        cache.put("k", (D1, D2, 1), _response(), version)
+        self.assertEqual(cache.get("k")[1], "miss")
+
+    def test_change_outside_scope_while_reading_keeps_put(self):
+        cache = _cache()
+        _entry, _state, version = cache.get("k")
+        cache.invalidate([(D3, 1), (D2, 2)])
+        cache.put("k", (D1, D2, 1), _response(), version)
+        self.assertEqual(cache.get("k")[1], "hit")
+
+    def test_reset_while_reading_rejects_put(self):
+        cache = _cache()
+        _entry, _state, version = cache.get("k")
+        cache.invalidate()
+        cache.put("k", (D1, D1, 1), _response(), version)
+        self.assertEqual(cache.get("k")[1], "miss")
+
+    def test_changes_beyond_version_log_reject_put(self):
+        cache = _cache()
+        _entry, _state, version = cache.get("k")
+        cache.invalidate([(D3, 2)] * (report_cache._VERSION_LOG + 1))
+        cache.put("k", (D1, D1, 1), _response(), version)
+        self.assertEqual(cache.get("k")[1], "miss")
+
+    def test_capacity_evicts_least_recently_used(self):
+        cache = ReportCache(2)
+        cache.set_enabled(True)
+        for key in ("a", "b"):
+            cache.put(key, (D1, D1, 1), _response(), cache.version)
+        cache.get("a")
+        cache.put("c", (D1, D1, 1), _response(), cache.version)
+        self.assertEqual(cache.get("b")[1], "miss")
+        self.assertEqual(cache.get("a")[1], "hit")
+
+
+class InvalidateTest(unittest.TestCase):
+    def test_drops_only_overlapping_entries(self):
+        cache = _cache()
+        cache.put("store1", (D1, D2, 1), _response(), cache.version)
+        cache.put("store2", (D1, D2, 2), _response(), cache.version)
+        cache.put("all", (None, None, None), _response(), cache.version)
+        cache.invalidate([(D2, 1)])
+        self.assertEqual(cache.get("store1")[1], "miss")
+        self.assertEqual(cache.get("store2")[1], "hit")
+        self.assertEqual(cache.get("all")[1], "miss")
+
+    def test_reset_drops_everything(self):
+        cache = _cache()
+        cache.put("k", (D1, D1, 1), _response(), cache.version)
+        cache.invalidate()
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_disable_clears_entries(self):
+        cache = _cache()
+        cache.put("k", (D1, D1, 1), _response(), cache.version)
+        cache.set_enabled(False)
+        cache.set_enabled(True)
+        self.assertEqual(cache.get("k")[1], "miss")
+
+
+class StaleTest(unittest.TestCase):
+    def test_invalidated_entry_is_served_stale_until_refreshed(self):
+        cache = _cache(stale_seconds=30)
+        cache.put("k", (D1, D2, 1), _response("old"), cache.version)
+        cache.invalidate([(D1, 1)])
+        entry, state, version = cache.get("k")
+        self.assertEqual((state, entry.body), ("stale", b"old"))
+        self.assertTrue(cache.begin_refresh("k"))
+        self.assertFalse(cache.begin_refresh("k"))
+        cache.put("k", (D1, D2, 1), _response("new"), version)
+        cache.end_refresh("k")
+        entry, state, _version = cache.get("k")
+        self.assertEqual((state, entry.body), ("hit", b"new"))
+
+    def test_stale_entry_expires(self):
+        cache = _cache(stale_seconds=30)
+        cache.put("k", (D1, D2, 1), _response(), cache.version)
+        cache.invalidate([(D1, 1)])
+        cache._entries["k"].stale_since -= 31
+        self.assertEqual(cache.get("k")[1], "miss")
+
+
+if __name__ == "__main__":
+    unittest.main()